@@ -0,0 +1,135 @@
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from loguru import logger
+
+from app.metrics import CIRCUIT_STATE, endpoint
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+# A connection error, so callers handle it like the upstream being down,
+# without a request ever being sent.
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(
+            f"Circuit of {name} is open, retrying in {retry_after:.0f} seconds."
+        )
+        self.retry_after = retry_after
+
+
+# Opens after a number of failures in a row, failing every call right away.
+# Once the reset time passed, a single probe is let through while half-open:
+# its success closes the circuit, its failure opens it again.
+class CircuitBreaker:
+    def __init__(
+        self,
+        upstream: str,
+        endpoint: str,
+        failure_threshold: int,
+        reset_seconds: float,
+    ):
+        self.upstream = upstream
+        self.endpoint = endpoint
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = CLOSED
+        self._failures = 0
+        self._retry_at = 0.0
+        self._lock = threading.Lock()
+        self._set_state(CLOSED)
+
+    @property
+    def name(self) -> str:
+        return f"{self.upstream}/{self.endpoint}"
+
+    def _set_state(self, state: str) -> None:
+        if state != self.state:
+            logger.warning(f"Circuit of {self.name} is now {state}.")
+        self.state = state
+        CIRCUIT_STATE.set(
+            STATE_VALUES[state], upstream=self.upstream, endpoint=self.endpoint
+        )
+
+    def retry_in(self, now: float | None = None) -> float:
+        # How long calls would fail right away, 0 if one may go out now.
+        with self._lock:
+            if self.state == CLOSED:
+                return 0
+            return max(self._retry_at - (now or time.time()), 0)
+
+    def before_call(self) -> None:
+        now = time.time()
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            if now < self._retry_at:
+                raise CircuitOpenError(
+                    name=self.name, retry_after=self._retry_at - now
+                )
+            # Lets one probe through, holding back the rest until it ends.
+            self._set_state(HALF_OPEN)
+            self._retry_at = now + self.reset_seconds
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._set_state(CLOSED)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if (
+                self.state == HALF_OPEN
+                or self._failures >= self.failure_threshold
+            ):
+                self._set_state(OPEN)
+                self._retry_at = time.time() + self.reset_seconds
+
+
+# One breaker per upstream and endpoint, so a broken endpoint does not stop
+# calls to the others.
+class CircuitBreakers:
+    def __init__(
+        self,
+        failure_threshold: int | None = None,
+        reset_seconds: float | None = None,
+    ):
+        self.failure_threshold = failure_threshold or int(
+            os.environ.get("CIRCUIT_FAILURE_THRESHOLD", 5)
+        )
+        self.reset_seconds = reset_seconds or float(
+            os.environ.get("CIRCUIT_RESET_SECONDS", 30)
+        )
+        self._breakers: dict[tuple[str, str], CircuitBreaker] = dict()
+        self._lock = threading.Lock()
+
+    def get(self, url: str) -> CircuitBreaker:
+        parts = urlsplit(url)
+        key = (parts.hostname or "", endpoint(parts.path))
+        with self._lock:
+            breaker = self._breakers.get(key)
+            if breaker is None:
+                breaker = self._breakers[key] = CircuitBreaker(
+                    upstream=key[0],
+                    endpoint=key[1],
+                    failure_threshold=self.failure_threshold,
+                    reset_seconds=self.reset_seconds,
+                )
+            return breaker
+
+    def retry_in(self, url: str) -> float:
+        return self.get(url).retry_in()
+
+    def states(self) -> dict[str, str]:
+        with self._lock:
+            return {
+                breaker.name: breaker.state
+                for breaker in self._breakers.values()
+            }
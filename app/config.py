@@ -0,0 +1,168 @@
+import os
+import tomllib
+from dataclasses import dataclass, field
+
+from loguru import logger
+
+from app.templates import MessageStyle
+
+
+# A team or organisation whose live members share one digest message per
+# webhook instead of a message each.
+@dataclass
+class Group:
+    members: list[str]
+    webhooks: list[str]
+
+
+# Which Discord webhooks every streamer is announced on. Streamers listed in
+# STREAMER_NAME go to DISCORD_WEBHOOK_URL, the optional TOML config file can
+# add more streamers and give each their own webhooks, and put streamers in
+# groups.
+@dataclass
+class Config:
+    webhooks: dict[str, list[str]]
+    groups: dict[str, Group] = field(default_factory=dict)
+    style: MessageStyle = field(default_factory=MessageStyle)
+
+    @property
+    def streamers(self) -> list[str]:
+        streamers = dict.fromkeys(self.webhooks)
+        for group in self.groups.values():
+            streamers.update(dict.fromkeys(group.members))
+        return list(streamers)
+
+    def targets(self, streamer: str) -> list[str]:
+        return self.webhooks.get(streamer, [])
+
+    def groups_of(self, streamer: str) -> list[str]:
+        return [
+            name
+            for name, group in self.groups.items()
+            if streamer in group.members
+        ]
+
+
+def config_path() -> str:
+    return os.environ.get("CONFIG_PATH", "config.toml")
+
+
+def load_config(path: str | None = None, required: bool = False) -> Config:
+    # A required file that is missing or empty raises, as it is most likely
+    # being saved right now rather than meant to drop every streamer.
+    path = path or config_path()
+    default_webhook = os.environ.get("DISCORD_WEBHOOK_URL")
+    default_webhooks = [default_webhook] if default_webhook else []
+
+    webhooks = {
+        streamer.lower(): default_webhooks
+        for streamer in os.environ.get("STREAMER_NAME", "").split(",")
+        if streamer
+    }
+    try:
+        with open(path, "rb") as file:
+            config = tomllib.load(file)
+    except FileNotFoundError:
+        if required:
+            raise
+        config = {}
+    if required and not config:
+        raise ValueError(f"{path} is empty.")
+    for streamer, settings in config.get("streamers", {}).items():
+        webhooks[streamer.lower()] = settings.get("webhooks", default_webhooks)
+
+    groups = {
+        name: Group(
+            members=[member.lower() for member in settings.get("members", [])],
+            webhooks=settings.get("webhooks", default_webhooks),
+        )
+        for name, settings in config.get("groups", {}).items()
+    }
+
+    config = Config(
+        webhooks=webhooks,
+        groups=groups,
+        style=MessageStyle(**config.get("message", {})),
+    )
+    for streamer in config.streamers:
+        if not config.targets(streamer) and not config.groups_of(streamer):
+            logger.warning(f"{streamer} has no webhook to be announced on.")
+    return config
+
+
+def added(old: list[str], new: list[str]) -> list[str]:
+    return [item for item in new if item not in old]
+
+
+# What changed between two configs, so a reload only touches the streamers,
+# groups and webhooks that changed.
+@dataclass
+class ConfigDiff:
+    added_streamers: list[str] = field(default_factory=list)
+    removed_streamers: list[str] = field(default_factory=list)
+    # Webhooks added to or removed from streamers in both configs.
+    added_targets: dict[str, list[str]] = field(default_factory=dict)
+    removed_targets: dict[str, list[str]] = field(default_factory=dict)
+    added_groups: list[str] = field(default_factory=list)
+    removed_groups: list[str] = field(default_factory=list)
+    changed_groups: list[str] = field(default_factory=list)
+    added_group_targets: dict[str, list[str]] = field(default_factory=dict)
+    removed_group_targets: dict[str, list[str]] = field(default_factory=dict)
+    style_changed: bool = False
+
+
+def diff_config(old: Config, new: Config) -> ConfigDiff:
+    diff = ConfigDiff(
+        added_streamers=added(old.streamers, new.streamers),
+        removed_streamers=added(new.streamers, old.streamers),
+        added_groups=added(list(old.groups), list(new.groups)),
+        removed_groups=added(list(new.groups), list(old.groups)),
+        style_changed=old.style != new.style,
+    )
+    for streamer in new.streamers:
+        if streamer in diff.added_streamers:
+            continue
+        old_targets = old.targets(streamer)
+        new_targets = new.targets(streamer)
+        if added(old_targets, new_targets):
+            diff.added_targets[streamer] = added(old_targets, new_targets)
+        if added(new_targets, old_targets):
+            diff.removed_targets[streamer] = added(new_targets, old_targets)
+
+    for name, group in new.groups.items():
+        if name in diff.added_groups:
+            continue
+        old_group = old.groups[name]
+        if old_group.members != group.members:
+            diff.changed_groups.append(name)
+        if added(old_group.webhooks, group.webhooks):
+            diff.added_group_targets[name] = added(
+                old_group.webhooks, group.webhooks
+            )
+        if added(group.webhooks, old_group.webhooks):
+            diff.removed_group_targets[name] = added(
+                group.webhooks, old_group.webhooks
+            )
+    return diff
+
+
+# Tells whether the config file changed since it was last looked at, by
+# polling its modification time and size.
+class ConfigWatcher:
+    def __init__(self, path: str | None = None):
+        self.path = path or config_path()
+        self._signature = self._stat()
+
+    def _stat(self) -> tuple[int, int] | None:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def changed(self) -> bool:
+        signature = self._stat()
+        if signature == self._signature:
+            return False
+        self._signature = signature
+        return True
@@ -1,169 +1,116 @@
-import os
-from time import sleep
+import asyncio
 
-import requests
 from loguru import logger
 from requests import exceptions
 
-from app.twitch_client import StreamInformation
+from app.profiling import span, traced_arguments
+from app.transport import CONNECTION_ERRORS, Transport, log_request_error
 
+JSON_HEADERS = {"Content-Type": "application/json"}
 
-class DiscordClient:
-    notification_msg_id: str = ""
 
-    def __init__(self):
-        self._webhook_url = os.environ["DISCORD_WEBHOOK_URL"]
+class DiscordClient:
+    def __init__(self, transport: Transport | None = None):
+        self._transport = transport or Transport()
 
+    # Messages arrive rendered and serialized by the message templates.
     def send_information_to_discord(
-        self,
-        stream: StreamInformation,
-        profile_image: str,
-        retry_count: int = 0,
-    ) -> None:
+        self, webhook_url: str, message: bytes
+    ) -> str:
         logger.info("Sending a message with an embed to the webhook...")
-        streamer_url = f"https://www.twitch.tv/{stream.user_login}"
         try:
-            response = requests.post(
-                url=f"{self._webhook_url}?wait=true",
-                json={
-                    "username": "Oak Tree",
-                    "avatar_url": "https://i.imgur.com/DBOuwjx.png",
-                    "content": f"@everyone {stream.user_name} went live!",
-                    "embeds": [
-                        {
-                            "title": stream.title,
-                            "color": 8388863,
-                            "timestamp": stream.started_at,
-                            "url": streamer_url,
-                            "author": {
-                                "name": stream.user_name,
-                                "url": streamer_url,
-                                "icon_url": profile_image,
-                            },
-                            "image": {"url": stream.thumbnail_url},
-                            "fields": [
-                                {
-                                    "name": "Game",
-                                    "value": stream.game_name,
-                                    "inline": True,
-                                },
-                                {
-                                    "name": "Viewers",
-                                    "value": stream.viewer_count,
-                                    "inline": True,
-                                },
-                            ],
-                        }
-                    ],
-                },
+            response = self._transport.post(
+                url=f"{webhook_url}?wait=true",
+                data=message,
+                headers=JSON_HEADERS,
             )
 
             response.raise_for_status()
 
-            self.notification_msg_id = response.json()["id"]
             logger.info("Stream information sent with ping to Discord.")
-        except (exceptions.ConnectionError, exceptions.HTTPError) as err:
-            logger.opt(exception=err).warning(
-                "Could not send embed to Discord."
-            )
-            if retry_count > 5:
-                logger.warning("Aborted sending the embed to Discord.")
-                return
-            retry_count += 1
-            logger.info(f"Retrying finalize in {retry_count * 5} seconds.")
-            sleep(retry_count * 5)
-            self.send_information_to_discord(
-                stream=stream,
-                profile_image=profile_image,
-                retry_count=retry_count,
-            )
+            return response.json()["id"]
+        except (*CONNECTION_ERRORS, exceptions.HTTPError) as err:
+            log_request_error(err, "Could not send embed to Discord.")
+            raise
 
     def update_information_on_discord(
-        self, stream: StreamInformation, profile_image: str
+        self, webhook_url: str, message_id: str, message: bytes
     ) -> None:
         logger.info("Updating stream information on Discord...")
-        streamer_url = f"https://www.twitch.tv/{stream.user_login}"
+        if not message_id:
+            logger.info("Message ID not set, nothing to update.")
+            return
+
         try:
-            response = requests.patch(
-                url=f"{self._webhook_url}/messages/{self.notification_msg_id}",
-                json={
-                    "embeds": [
-                        {
-                            "title": stream.title,
-                            "color": 8388863,
-                            "timestamp": stream.started_at,
-                            "url": streamer_url,
-                            "author": {
-                                "name": f"{stream.user_name}",
-                                "url": streamer_url,
-                                "icon_url": profile_image,
-                            },
-                            "image": {"url": stream.thumbnail_url},
-                            "fields": [
-                                {
-                                    "name": "Game",
-                                    "value": stream.game_name,
-                                    "inline": True,
-                                },
-                                {
-                                    "name": "Viewers",
-                                    "value": stream.viewer_count,
-                                    "inline": True,
-                                },
-                            ],
-                        }
-                    ],
-                },
+            response = self._transport.patch(
+                url=f"{webhook_url}/messages/{message_id}",
+                data=message,
+                headers=JSON_HEADERS,
             )
             response.raise_for_status()
             logger.info("Message embed content updated.")
-        except (exceptions.ConnectionError, exceptions.HTTPError) as err:
-            logger.opt(exception=err).warning(
-                "Could not update embed content due to connection error. "
-                "Not retrying due to this not being important."
+        except (*CONNECTION_ERRORS, exceptions.HTTPError) as err:
+            log_request_error(
+                err, "Could not update embed content due to connection error."
             )
+            raise
 
     def finalize_information_on_discord(
-        self, streamer_name, vod_url: str | None, retry_count: int = 0
+        self, webhook_url: str, message_id: str, message: bytes
     ) -> None:
         logger.info("Finalizing stream information on Discord...")
-        if not self.notification_msg_id:
+        if not message_id:
             logger.info("Message ID not set, nothing to finalize.")
             return
 
-        if not vod_url:
-            vod_url = "None available."
-
         try:
-            response = requests.patch(
-                url=f"{self._webhook_url}/messages/{self.notification_msg_id}",
-                json={
-                    "username": "Oak Tree",
-                    "avatar_url": "https://i.imgur.com/DBOuwjx.png",
-                    "content": (
-                        f"{streamer_name} stopped the stream. Check out the VOD!"
-                        f"\n{vod_url}"
-                    ),
-                    "embeds": [],
-                },
+            response = self._transport.patch(
+                url=f"{webhook_url}/messages/{message_id}",
+                data=message,
+                headers=JSON_HEADERS,
             )
             response.raise_for_status()
             logger.info("Message updated with VOD.")
-        except (exceptions.ConnectionError, exceptions.HTTPError) as err:
-            logger.opt(exception=err).warning(
-                "Could not finalize embed on Discord."
-            )
-            if retry_count > 5:
-                logger.warning(
-                    "Aborted finalizing the embed on Discord. "
-                    "It will be stuck on the last stream update."
-                )
-                return
-            retry_count += 1
-            logger.info(f"Retrying finalize in {retry_count * 5} seconds.")
-            sleep(retry_count * 5)
-            self.finalize_information_on_discord(
-                streamer_name=streamer_name,
-                vod_url=vod_url,
-                retry_count=retry_count,
-            )
+        except (*CONNECTION_ERRORS, exceptions.HTTPError) as err:
+            log_request_error(err, "Could not finalize embed on Discord.")
+            raise
+
+
+class AsyncDiscordClient:
+    def __init__(self, client: DiscordClient, semaphore: asyncio.Semaphore):
+        self.client = client
+        self._semaphore = semaphore
+
+    async def _run(self, function, *args, **kwargs):
+        with span(f"discord.{function.__name__}", **traced_arguments(kwargs)):
+            async with self._semaphore:
+                return await asyncio.to_thread(function, *args, **kwargs)
+
+    async def send_information_to_discord(
+        self, webhook_url: str, message: bytes
+    ) -> str:
+        return await self._run(
+            self.client.send_information_to_discord,
+            webhook_url=webhook_url,
+            message=message,
+        )
+
+    async def update_information_on_discord(
+        self, webhook_url: str, message_id: str, message: bytes
+    ) -> None:
+        await self._run(
+            self.client.update_information_on_discord,
+            webhook_url=webhook_url,
+            message_id=message_id,
+            message=message,
+        )
+
+    async def finalize_information_on_discord(
+        self, webhook_url: str, message_id: str, message: bytes
+    ) -> None:
+        await self._run(
+            self.client.finalize_information_on_discord,
+            webhook_url=webhook_url,
+            message_id=message_id,
+            message=message,
+        )
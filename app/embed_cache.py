@@ -0,0 +1,58 @@
+import math
+import os
+
+from app.twitch_client import StreamInformation
+
+
+def round_significant(value: int, digits: int) -> int:
+    if value <= 0:
+        return 0
+    magnitude = 10 ** max(int(math.log10(value)) + 1 - digits, 0)
+    return round(value / magnitude) * magnitude
+
+
+# Remembers what was last sent for every message, so an update is only sent
+# when the embed would visibly change. Viewer counts are compared rounded to a
+# few significant digits, and the thumbnail only changes whenever its cache
+# preventing suffix is refreshed.
+class EmbedDiffCache:
+    def __init__(self, viewer_count_digits: int | None = None):
+        self._viewer_count_digits = viewer_count_digits or int(
+            os.environ.get("VIEWER_COUNT_SIGNIFICANT_DIGITS", 2)
+        )
+        self._last_sent: dict[str, tuple] = dict()
+
+    def _fingerprint(
+        self, stream: StreamInformation, profile_image: str | None
+    ) -> tuple:
+        return (
+            stream.title,
+            stream.game_name,
+            round_significant(stream.viewer_count, self._viewer_count_digits),
+            stream.thumbnail_url,
+            profile_image,
+        )
+
+    def has_changed(
+        self, key: str, stream: StreamInformation, profile_image: str | None
+    ) -> bool:
+        fingerprint = self._fingerprint(stream, profile_image)
+        if self._last_sent.get(key) == fingerprint:
+            return False
+        self._last_sent[key] = fingerprint
+        return True
+
+    def has_digest_changed(
+        self, key: str, streams: list[tuple[StreamInformation, str | None]]
+    ) -> bool:
+        fingerprint = tuple(
+            self._fingerprint(stream, profile_image)
+            for stream, profile_image in streams
+        )
+        if self._last_sent.get(key) == fingerprint:
+            return False
+        self._last_sent[key] = fingerprint
+        return True
+
+    def forget(self, key: str) -> None:
+        self._last_sent.pop(key, None)
@@ -0,0 +1,146 @@
+import hashlib
+import hmac
+import json
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+
+from loguru import logger
+
+MESSAGE_ID = "Twitch-Eventsub-Message-Id"
+MESSAGE_TIMESTAMP = "Twitch-Eventsub-Message-Timestamp"
+MESSAGE_SIGNATURE = "Twitch-Eventsub-Message-Signature"
+MESSAGE_TYPE = "Twitch-Eventsub-Message-Type"
+
+STREAM_ONLINE = "stream.online"
+STREAM_OFFLINE = "stream.offline"
+
+# Twitch recommends rejecting messages older than this to prevent replays.
+MAX_MESSAGE_AGE = timedelta(minutes=10)
+SEEN_MESSAGE_IDS = 1000
+
+
+def sign(secret: str, message_id: str, timestamp: str, body: bytes) -> str:
+    digest = hmac.new(
+        secret.encode(),
+        message_id.encode() + timestamp.encode() + body,
+        hashlib.sha256,
+    ).hexdigest()
+    return f"sha256={digest}"
+
+
+def parse_timestamp(timestamp: str) -> datetime:
+    # Twitch sends nanoseconds, which fromisoformat can not parse.
+    timestamp = timestamp.rstrip("Z")
+    if "." in timestamp:
+        seconds, fraction = timestamp.split(".", 1)
+        timestamp = f"{seconds}.{fraction[:6]}"
+    return datetime.fromisoformat(timestamp).replace(tzinfo=timezone.utc)
+
+
+class EventSubHandler(BaseHTTPRequestHandler):
+    server: "EventSubServer"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        message_id = self.headers.get(MESSAGE_ID, "")
+        timestamp = self.headers.get(MESSAGE_TIMESTAMP, "")
+        signature = sign(self.server.secret, message_id, timestamp, body)
+        if not hmac.compare_digest(
+            signature, self.headers.get(MESSAGE_SIGNATURE, "")
+        ):
+            logger.warning("Rejected EventSub message with a bad signature.")
+            self._respond(403)
+            return
+
+        try:
+            message_age = datetime.now(timezone.utc) - parse_timestamp(
+                timestamp
+            )
+        except ValueError:
+            message_age = MAX_MESSAGE_AGE
+        if message_age >= MAX_MESSAGE_AGE:
+            logger.warning("Rejected EventSub message that is too old.")
+            self._respond(403)
+            return
+
+        if not self.server.mark_seen(message_id):
+            self._respond(204)
+            return
+
+        message = json.loads(body)
+        message_type = self.headers.get(MESSAGE_TYPE)
+        if message_type == "webhook_callback_verification":
+            logger.info(
+                f"Verified EventSub subscription to "
+                f"{message['subscription']['type']}."
+            )
+            self._respond(200, message["challenge"].encode())
+        elif message_type == "notification":
+            self.server.on_event(
+                message["subscription"]["type"], message["event"]
+            )
+            self._respond(204)
+        elif message_type == "revocation":
+            logger.warning(
+                f"Twitch revoked the EventSub subscription to "
+                f"{message['subscription']['type']}: "
+                f"{message['subscription']['status']}."
+            )
+            if self.server.on_revocation:
+                self.server.on_revocation(message["subscription"])
+            self._respond(204)
+        else:
+            self._respond(204)
+
+    def _respond(self, status: int, body: bytes = b""):
+        self.send_response(status)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# Receives EventSub webhook notifications and passes stream.online and
+# stream.offline events and revoked subscriptions on, from the thread the
+# server runs in.
+class EventSubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        secret: str,
+        on_event: Callable[[str, dict], None],
+        port: int = 8080,
+        host: str = "0.0.0.0",
+        on_revocation: Callable[[dict], None] | None = None,
+    ):
+        super().__init__((host, port), EventSubHandler)
+        self.secret = secret
+        self.on_event = on_event
+        self.on_revocation = on_revocation
+        self._seen_message_ids: OrderedDict[str, None] = OrderedDict()
+        self._seen_lock = threading.Lock()
+
+    def mark_seen(self, message_id: str) -> bool:
+        # Twitch delivers at least once, so repeated messages are dropped.
+        with self._seen_lock:
+            if message_id in self._seen_message_ids:
+                return False
+            self._seen_message_ids[message_id] = None
+            if len(self._seen_message_ids) > SEEN_MESSAGE_IDS:
+                self._seen_message_ids.popitem(last=False)
+            return True
+
+    def start(self) -> None:
+        logger.info(f"Listening for EventSub on port {self.server_port}.")
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
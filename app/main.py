@@ -1,121 +1,778 @@
-import json
+import asyncio
+import math
 import os
+import signal
+import threading
 import time
-from dataclasses import asdict
-from json import JSONDecodeError
+from concurrent.futures import Future, ThreadPoolExecutor
 
 from loguru import logger
-from requests import HTTPError
+from requests import RequestException
 
-from app.discord_client import DiscordClient
-from app.twitch_client import StreamInformation, TwitchClient
+from app import metrics
+from app.config import ConfigWatcher, diff_config, load_config
+from app.discord_client import AsyncDiscordClient, DiscordClient
+from app.embed_cache import EmbedDiffCache
+from app.eventsub import STREAM_OFFLINE, STREAM_ONLINE, EventSubServer
+from app.metrics import MetricsServer
+from app.outbox import Outbox, digest_key
+from app.profiling import TickProfiler
+from app.rate_limit import HelixBudget, WebhookRateLimiter
+from app.scheduler import PollScheduler
+from app.state_store import StateStore
+from app.templates import MessageTemplates
+from app.transitions import Transitions, compute_transitions
+from app.transport import Transport
+from app.twitch_client import (
+    HELIX_BATCH_SIZE,
+    AsyncTwitchClient,
+    StreamInformation,
+    TwitchClient,
+)
+from app.user_cache import UserCache
+from app.viewer_history import ViewerHistory
+from app.vod_resolver import VodResolver
 
 
 class Main:
-    is_live: bool = False
-    current_stream_id: str = ""
-    streams: dict[str, StreamInformation] = dict()
-
     def __init__(self):
-        self.twitch_client = TwitchClient(streamer=os.environ["STREAMER_NAME"])
-        self.twitch_client.update_access_token()
-        self.profile_image = self.twitch_client.get_streamer_profile_picture()
-        self.discord_client = DiscordClient()
+        # Limits how many Twitch and Discord requests are in flight at once.
+        semaphore = asyncio.Semaphore(
+            int(os.environ.get("MAX_CONCURRENT_REQUESTS", 10))
+        )
+        self.transport = Transport()
+        self.helix_budget = HelixBudget()
+        self.transport.add_response_hook(self.helix_budget.observe)
+        self.transport.add_response_hook(metrics.observe_response)
+        # The config file is polled for changes every few seconds.
+        self.config_watcher = ConfigWatcher()
+        self.config_reload_seconds = float(
+            os.environ.get("CONFIG_RELOAD_SECONDS", 10)
+        )
+        self.config = load_config(path=self.config_watcher.path)
+        twitch_client = TwitchClient(
+            streamers=self.config.streamers,
+            transport=self.transport,
+        )
+        self.streamers = twitch_client.streamers
+        self.twitch_client = AsyncTwitchClient(
+            client=twitch_client,
+            semaphore=semaphore,
+            budget=self.helix_budget,
+        )
+        self.discord_client = AsyncDiscordClient(
+            client=DiscordClient(transport=self.transport),
+            semaphore=semaphore,
+        )
+        self.embed_cache = EmbedDiffCache()
+        self.webhook_rate_limiter = WebhookRateLimiter()
+        self.transport.add_response_hook(self.webhook_rate_limiter.observe)
+        self.outbox = Outbox(
+            discord_client=self.discord_client,
+            rate_limiter=self.webhook_rate_limiter,
+            on_sent=self._on_sent,
+            templates=MessageTemplates(style=self.config.style),
+        )
+        # Groups with a digest message that has not been finalized yet.
+        self._live_digests = {
+            group
+            for group in self.config.groups
+            if self.outbox.has_message(key=digest_key(group))
+        }
+        # Maps the login of every streamer that is live to their stream's id.
+        self.live_streams: dict[str, str] = dict()
+        # Startup only reads local state, network setup happens in setup().
+        self.state_store = StateStore()
+        self.state_store.import_snapshot(path="streams.json")
+        self.streams: dict[str, StreamInformation] = self.state_store.load()
+        for stream_id, stream in self.state_store.load_live().items():
+            if stream.user_login in self.streamers:
+                self.live_streams[stream.user_login] = stream_id
+        self.user_cache = UserCache(state_store=self.state_store)
+        self.viewer_history = ViewerHistory()
+        self.vod_resolver = VodResolver(
+            twitch_client=self.twitch_client,
+            state_store=self.state_store,
+            on_resolved=self._on_vod_resolved,
+        )
+        self._setup_tasks: list[asyncio.Task] = []
+        self.shutdown_timeout = float(
+            os.environ.get("SHUTDOWN_TIMEOUT_SECONDS", 8)
+        )
+        self._next_maintenance = time.time() + STATE_MAINTENANCE_SECONDS
+        # With EventSub, Twitch tells us who goes live and offline, and only
+        # live streamers are polled, to keep their embeds up to date.
+        self.eventsub_callback_url = os.environ.get("EVENTSUB_CALLBACK_URL")
+        self.eventsub_server: EventSubServer | None = None
+        self.metrics_server: MetricsServer | None = None
+        # Maps streamers Twitch announced as live to when we stop waiting for
+        # Helix to list their stream.
+        self._announced_streamers: dict[str, float] = dict()
+        # Maps ids of streams EventSub ended to until when polls listing them
+        # are ignored, as Helix keeps listing ended streams for a while.
+        self._ended_streams: dict[str, float] = dict()
+        # Streamers with working EventSub subscriptions. Everyone else is
+        # polled on schedule, like without EventSub.
+        self._subscribed_streamers: set[str] = set()
+        # Everyone is polled once right away, afterwards each at their own pace.
+        self.scheduler = PollScheduler(
+            live_interval=DELAY_SECONDS,
+            max_interval=float(os.environ.get("MAX_POLL_INTERVAL", 300)),
+        )
+        for streamer in self.streamers:
+            self.scheduler.add(streamer=streamer)
+        # Set to poll right away instead of waiting for the next tick.
+        self.wake = asyncio.Event()
+        self.profiler = TickProfiler()
+
+    async def setup(self):
+        # Runs network setup concurrently. Only a cold start without cached
+        # users waits for them, otherwise the first poll goes out right away
+        # and they are refreshed in the background.
+        if os.environ.get("METRICS_PORT"):
+            self.metrics_server = MetricsServer(
+                port=int(os.environ["METRICS_PORT"])
+            )
+            self.metrics_server.start()
+        if self.eventsub_callback_url:
+            self._setup_tasks.append(asyncio.create_task(self.start_eventsub()))
+        if any(streamer not in self.user_cache for streamer in self.streamers):
+            await self._refresh_users_wrapper()
+        self._setup_tasks.append(
+            asyncio.create_task(self._refresh_users_periodically())
+        )
+        if self.config_reload_seconds > 0:
+            self._setup_tasks.append(asyncio.create_task(self._watch_config()))
+        for task in self._setup_tasks:
+            task.add_done_callback(self._log_setup_failure)
+
+    @staticmethod
+    def _log_setup_failure(task: asyncio.Task):
+        if not task.cancelled() and task.exception():
+            logger.opt(exception=task.exception()).error("Set-up step failed.")
+
+    async def refresh_users(self):
+        # Refetches only users missing from the cache or past their TTL.
+        stale_streamers = self.user_cache.stale(logins=self.streamers)
+        if stale_streamers:
+            users = await self.twitch_client.get_users(logins=stale_streamers)
+            self.user_cache.update(users=list(users.values()))
+
+    async def _refresh_users_wrapper(self):
         try:
-            with open("streams.json", "r") as file:
-                saved_streams = json.load(file)
-                for stream_id, saved_stream in saved_streams:
-                    self.streams[stream_id] = StreamInformation(**saved_stream)
-        except (FileNotFoundError, JSONDecodeError):
-            pass
-
-    def update_status(self):
+            await self.refresh_users()
+        except RequestException as e:
+            logger.exception(e)
+
+    async def _refresh_users_periodically(self):
+        while True:
+            await self._refresh_users_wrapper()
+            await asyncio.sleep(USER_REFRESH_SECONDS)
+
+    async def update_status(self):
+        now = time.time()
+        due_at = self.scheduler.next_due_at()
+        streamers = self.scheduler.pop_due(now=now)
+        if not streamers:
+            return
+
+        metrics.TICK_DRIFT_SECONDS.set(max(now - due_at, 0))
+        with self.profiler.tick():
+            await self._poll_streamers(streamers=streamers, now=now)
+        metrics.TICK_SECONDS.observe(time.time() - now)
+        metrics.TRACKED_STREAMERS.set(len(self.streamers))
+        metrics.LIVE_STREAMERS.set(len(self.live_streams))
+
+    async def _poll_streamers(self, streamers: list[str], now: float):
+        if self.helix_budget.is_low():
+            # Offline streamers wait while the budget recovers, so the live
+            # ones stay up to date.
+            deferred = [
+                streamer
+                for streamer in streamers
+                if streamer not in self.live_streams
+                and streamer not in self._announced_streamers
+            ]
+            if deferred:
+                logger.warning(
+                    f"Twitch rate limit budget is low, deferring "
+                    f"{len(deferred)} offline streamers."
+                )
+            for streamer in deferred:
+                self.scheduler.add(
+                    streamer=streamer, due_at=now + self.scheduler.live_interval
+                )
+            streamers = [
+                streamer for streamer in streamers if streamer not in deferred
+            ]
+
+        # Polls that are certain to fail are not sent while the circuit of
+        # the streams endpoint is open.
+        wait_seconds = max(
+            self.transport.circuit_breakers.retry_in(HELIX_STREAMS_URL),
+            self.helix_budget.wait_time(
+                points=math.ceil(len(streamers) / HELIX_BATCH_SIZE)
+            ),
+        )
+        if wait_seconds > 0:
+            for streamer in streamers:
+                self.scheduler.add(streamer=streamer, due_at=now + wait_seconds)
+            return
+
         try:
-            stream = self.twitch_client.get_stream()
-
-            if not stream:
-                if self.is_live:
-                    logger.info("Streamer went offline.")
-                    self.is_live = False
-                    stream = self.streams.get(self.current_stream_id)
-                    if stream:
-                        self.discord_client.finalize_information_on_discord(
-                            streamer_name=stream.user_name,
-                            vod_url=self.twitch_client.get_vod(
-                                user_id=stream.user_id
-                            ),
-                        )
-                return
+            streams = await self.twitch_client.get_stream(streamers=streamers)
+        except RequestException as e:
+            logger.exception(e)
+            streams = dict()
+
+        for streamer in streamers:
+            if streamer not in streams:
+                # Polling them failed, so try again like nothing changed.
+                self.scheduler.reschedule(
+                    streamer=streamer,
+                    is_live=streamer in self.live_streams,
+                    now=now,
+                )
+
+        self._ended_streams = {
+            stream_id: ignored_until
+            for stream_id, ignored_until in self._ended_streams.items()
+            if ignored_until > now
+        }
+        polled_streams = dict()
+        for streamer, stream in streams.items():
+            if stream and stream.id in self._ended_streams:
+                stream = None
+            if stream:
+                self._announced_streamers.pop(streamer, None)
+            elif self._announced_streamers.get(streamer, 0) > now:
+                # Helix takes a moment to list streams EventSub announced.
+                self.scheduler.reschedule(
+                    streamer=streamer, is_live=True, now=now
+                )
+                continue
+
+            polled_streams[streamer] = stream
+            # With EventSub, only live streamers need to be polled.
+            if stream or streamer not in self._subscribed_streamers:
+                self.scheduler.reschedule(
+                    streamer=streamer, is_live=stream is not None, now=now
+                )
+        self.handle_streams(streams=polled_streams)
+
+    async def start_eventsub(self):
+        loop = asyncio.get_running_loop()
+        self.eventsub_server = EventSubServer(
+            secret=os.environ["EVENTSUB_SECRET"],
+            port=int(os.environ.get("EVENTSUB_PORT", 8080)),
+            on_event=lambda subscription_type, event: loop.call_soon_threadsafe(
+                self.on_eventsub_event, subscription_type, event
+            ),
+            on_revocation=lambda subscription: loop.call_soon_threadsafe(
+                self.on_eventsub_revocation, subscription
+            ),
+        )
+        self.eventsub_server.start()
+
+        await self.subscribe_eventsub()
+
+    async def subscribe_eventsub(self, logins: list[str] | None = None):
+        users = await self.twitch_client.get_users(logins=logins)
+        self.user_cache.update(users=list(users.values()))
+        results = await asyncio.gather(
+            *(self._subscribe_streamer(user=user) for user in users.values()),
+            return_exceptions=True,
+        )
+        for login, result in zip(users, results):
+            if isinstance(result, Exception):
+                logger.opt(exception=result).error(
+                    f"Could not subscribe to EventSub of {login}, "
+                    "polling them instead."
+                )
+
+    async def _subscribe_streamer(self, user: dict):
+        await asyncio.gather(
+            *(
+                self.twitch_client.create_eventsub_subscription(
+                    subscription_type=subscription_type,
+                    broadcaster_user_id=user["id"],
+                    callback_url=self.eventsub_callback_url,
+                    secret=os.environ["EVENTSUB_SECRET"],
+                )
+                for subscription_type in (STREAM_ONLINE, STREAM_OFFLINE)
+            )
+        )
+        self._subscribed_streamers.add(user["login"])
+
+    async def unsubscribe_eventsub(self, logins: list[str]):
+        # Streamers never looked up have no subscriptions to delete.
+        user_ids = {
+            login: self.user_cache.get(login)["id"]
+            for login in logins
+            if (self.user_cache.get(login) or {}).get("id")
+        }
+        results = await asyncio.gather(
+            *(
+                self.twitch_client.delete_eventsub_subscriptions(
+                    broadcaster_user_id=user_id,
+                    callback_url=self.eventsub_callback_url,
+                )
+                for user_id in user_ids.values()
+            ),
+            return_exceptions=True,
+        )
+        for login, result in zip(user_ids, results):
+            if isinstance(result, Exception):
+                logger.opt(exception=result).error(
+                    f"Could not unsubscribe from EventSub of {login}."
+                )
+
+    def on_eventsub_revocation(self, subscription: dict):
+        # Polls the streamer until they are subscribed again, so no go-live
+        # is missed in between.
+        user_id = subscription["condition"]["broadcaster_user_id"]
+        streamer = next(
+            (
+                streamer
+                for streamer in self.streamers
+                if (self.user_cache.get(streamer) or {}).get("id") == user_id
+            ),
+            None,
+        )
+        if streamer is None:
+            return
+
+        logger.info(f"Subscribing to EventSub of {streamer} again.")
+        self._subscribed_streamers.discard(streamer)
+        self.scheduler.add(streamer=streamer)
+        self.wake.set()
+        self._setup_tasks.append(
+            asyncio.create_task(self.subscribe_eventsub(logins=[streamer]))
+        )
+        self._setup_tasks[-1].add_done_callback(self._log_setup_failure)
+
+    async def _watch_config(self):
+        while True:
+            await asyncio.sleep(self.config_reload_seconds)
+            if self.config_watcher.changed():
+                self.reload_config()
+
+    def reload_config(self):
+        # Applies only what changed to the running notifier. Tokens,
+        # connections and the messages already sent are left as they are.
+        try:
+            config = load_config(path=self.config_watcher.path, required=True)
+        except (AttributeError, OSError, TypeError, ValueError) as err:
+            logger.opt(exception=err).error(
+                "Could not reload the config, keeping the current one."
+            )
+            return
+
+        diff = diff_config(self.config, config)
+        logger.info(
+            f"Reloaded the config, {len(diff.added_streamers)} streamers "
+            f"added and {len(diff.removed_streamers)} removed."
+        )
+        # Messages are ended on the webhooks they were sent to, before the
+        # new config forgets about them.
+        if self.eventsub_callback_url and diff.removed_streamers:
+            self._setup_tasks.append(
+                asyncio.create_task(
+                    self.unsubscribe_eventsub(diff.removed_streamers)
+                )
+            )
+            self._setup_tasks[-1].add_done_callback(self._log_setup_failure)
+        for streamer in diff.removed_streamers:
+            self._announced_streamers.pop(streamer, None)
+            self._subscribed_streamers.discard(streamer)
+            self.scheduler.remove(streamer=streamer)
+            self.streamers.remove(streamer)
+            if streamer in self.live_streams:
+                self.finalize_stream(stream_id=self.live_streams.pop(streamer))
+        for streamer, targets in diff.removed_targets.items():
+            if streamer in self.live_streams:
+                self.outbox.end(
+                    stream=self.streams[self.live_streams[streamer]],
+                    targets=targets,
+                )
+        for group in diff.removed_groups:
+            if group in self._live_digests:
+                self._live_digests.discard(group)
+                self.embed_cache.forget(key=digest_key(group))
+                self.outbox.finalize_digest(
+                    group=group, targets=self.config.groups[group].webhooks
+                )
+        for group, targets in diff.removed_group_targets.items():
+            if group in self._live_digests:
+                self.outbox.finalize_digest(group=group, targets=targets)
+
+        self.config = config
+        if diff.style_changed:
+            self.outbox.use_templates(MessageTemplates(style=config.style))
 
-            if not self.is_live:
-                logger.info("Streamer went live.")
-                existing_stream = self.streams.get(stream.id)
-                if existing_stream:
-                    logger.info(
-                        "Recovering from crash, updating discord if possible."
-                    )
-                    self.is_live = True
-                    if existing_stream.discord_message_id:
-                        self.discord_client.notification_msg_id = (
-                            existing_stream.discord_message_id
-                        )
-                        self.discord_client.update_information_on_discord(
-                            stream=stream, profile_image=self.profile_image
-                        )
-                    return
-
-                self.is_live = True
-                self.current_stream_id = stream.id
-                self.streams[stream.id] = stream
-                self.discord_client.send_information_to_discord(
-                    stream=stream, profile_image=self.profile_image
-                )
-                self.streams[
-                    stream.id
-                ].discord_message_id = self.discord_client.notification_msg_id
+        for streamer in diff.added_streamers:
+            self.streamers.append(streamer)
+            self.scheduler.add(streamer=streamer)
+        for streamer, targets in diff.added_targets.items():
+            if streamer in self.live_streams:
+                self.outbox.send(
+                    stream=self.streams[self.live_streams[streamer]],
+                    profile_image=self.user_cache.profile_image(streamer),
+                    targets=targets,
+                )
+        for group, targets in diff.added_group_targets.items():
+            if group in self._live_digests:
+                self.outbox.send_digest(
+                    group=group,
+                    streams=self._digest_streams(group),
+                    targets=targets,
+                )
+        for group in (*diff.added_groups, *diff.changed_groups):
+            self.update_digest(group=group)
+
+        if diff.added_streamers:
+            self._setup_tasks.append(
+                asyncio.create_task(
+                    self._set_up_streamers(diff.added_streamers)
+                )
+            )
+            self._setup_tasks[-1].add_done_callback(self._log_setup_failure)
+            self.wake.set()
+
+    async def _set_up_streamers(self, streamers: list[str]):
+        if self.eventsub_callback_url:
+            await self.subscribe_eventsub(logins=streamers)
+        else:
+            await self.refresh_users()
+
+    def on_eventsub_event(self, subscription_type: str, event: dict):
+        streamer = event["broadcaster_user_login"]
+        # Subscriptions of removed streamers may still be around.
+        if streamer not in self.streamers:
+            logger.info(f"Ignoring EventSub event of untracked {streamer}.")
+            return
+        if subscription_type == STREAM_ONLINE:
+            logger.info(f"EventSub announced {streamer} going live.")
+            self._announced_streamers[streamer] = (
+                time.time() + ANNOUNCED_POLL_SECONDS
+            )
+            self.scheduler.add(streamer=streamer)
+            self.wake.set()
+        elif subscription_type == STREAM_OFFLINE:
+            logger.info(f"EventSub announced {streamer} going offline.")
+            self._announced_streamers.pop(streamer, None)
+            if streamer in self.live_streams:
+                self._ended_streams[self.live_streams[streamer]] = (
+                    time.time() + ENDED_STREAM_SECONDS
+                )
+            if streamer in self._subscribed_streamers:
+                self.scheduler.remove(streamer=streamer)
+            self.handle_streams(streams={streamer: None})
+
+    def handle_streams(self, streams: dict[str, StreamInformation | None]):
+        transitions = compute_transitions(
+            streams=streams,
+            live_streams=self.live_streams,
+            known_stream_ids=self.streams,
+        )
+        groups = {
+            group
+            for streamer in transitions.streamers
+            for group in self.config.groups_of(streamer)
+        }
+        with self.outbox.transaction():
+            self.apply_transitions(transitions)
+            for group in sorted(groups):
+                self.update_digest(group=group)
+
+    def apply_transitions(self, transitions: Transitions):
+        # Only queues messages in the outbox, so no Discord call ever holds
+        # up the tick.
+        now = time.time()
+        for streamer, stream_id in transitions.went_offline.items():
+            if streamer in transitions.went_live or (
+                streamer in transitions.resumed
+            ):
+                logger.info(f"{streamer} restarted their stream.")
             else:
-                self.discord_client.update_information_on_discord(
-                    stream=stream, profile_image=self.profile_image
+                logger.info(f"{streamer} went offline.")
+            del self.live_streams[streamer]
+            self.finalize_stream(stream_id=stream_id)
+
+        for streamer, stream in transitions.resumed.items():
+            logger.info(
+                f"{streamer} went live. Recovering from crash, "
+                "updating discord if possible."
+            )
+            self.live_streams[streamer] = stream.id
+            # A stream ended by a shutdown goes on with its message, viewer
+            # history and all, instead of being finalized with its VOD.
+            self.vod_resolver.remove(stream_id=stream.id)
+            self.state_store.mark_live(stream_id=stream.id)
+            existing_stream = self.streams[stream.id]
+            if existing_stream.discord_message_id:
+                existing_stream.update(stream)
+                self.state_store.put(existing_stream)
+                self._update_message(
+                    streamer=streamer, stream=existing_stream, force=True
                 )
-        except HTTPError as e:
-            logger.exception(e)
 
-    def interrupt(self):
-        if not self.is_live:
+        for streamer, stream in transitions.went_live.items():
+            logger.info(f"{streamer} went live.")
+            self.live_streams[streamer] = stream.id
+            self.streams[stream.id] = stream
+            self.state_store.put(stream)
+            profile_image = self.user_cache.profile_image(streamer)
+            self.embed_cache.has_changed(
+                key=stream.id, stream=stream, profile_image=profile_image
+            )
+            self.outbox.send(
+                stream=stream,
+                profile_image=profile_image,
+                targets=self.config.targets(streamer),
+            )
+
+        for streamer, stream in transitions.still_live.items():
+            # Polls update the record that is already known in place.
+            existing_stream = self.streams[stream.id]
+            existing_stream.update(stream)
+            self._update_message(streamer=streamer, stream=existing_stream)
+
+        for streamer, stream in (
+            *transitions.resumed.items(),
+            *transitions.went_live.items(),
+            *transitions.still_live.items(),
+        ):
+            self.viewer_history.record(
+                stream_id=stream.id,
+                viewer_count=stream.viewer_count or 0,
+                started_at=stream.started_at,
+                now=now,
+            )
+
+    def _update_message(
+        self, streamer: str, stream: StreamInformation, force: bool = False
+    ):
+        profile_image = self.user_cache.profile_image(streamer)
+        changed = self.embed_cache.has_changed(
+            key=stream.id, stream=stream, profile_image=profile_image
+        )
+        if changed or force:
+            self.state_store.put(stream)
+            self.outbox.update(
+                stream=stream,
+                profile_image=profile_image,
+                targets=self.config.targets(streamer),
+            )
+
+    def _digest_streams(
+        self, group: str
+    ) -> list[tuple[StreamInformation, str | None]]:
+        return [
+            (
+                self.streams[self.live_streams[member]],
+                self.user_cache.profile_image(member),
+            )
+            for member in self.config.groups[group].members
+            if member in self.live_streams
+        ]
+
+    def update_digest(self, group: str):
+        # Sends a digest once a member of the group goes live, edits it while
+        # any of them are live, and finalizes it once the last one is offline.
+        key = digest_key(group)
+        targets = self.config.groups[group].webhooks
+        streams = self._digest_streams(group)
+
+        if not streams:
+            if group in self._live_digests:
+                self._live_digests.discard(group)
+                self.embed_cache.forget(key=key)
+                self.outbox.finalize_digest(group=group, targets=targets)
             return
 
-        self.is_live = False
-        stream = self.streams.get(self.current_stream_id)
+        changed = self.embed_cache.has_digest_changed(key=key, streams=streams)
+        if group not in self._live_digests:
+            self._live_digests.add(group)
+            self.outbox.send_digest(
+                group=group, streams=streams, targets=targets
+            )
+        elif changed:
+            self.outbox.update_digest(
+                group=group, streams=streams, targets=targets
+            )
+
+    def _on_sent(self, stream_id: str, message_id: str):
+        stream = self.streams.get(stream_id)
         if stream:
-            self.discord_client.finalize_information_on_discord(
-                streamer_name=stream.user_name,
-                vod_url=self.twitch_client.get_vod(user_id=stream.user_id),
+            stream.discord_message_id = message_id
+            self.state_store.put(stream)
+
+    def finalize_stream(self, stream_id: str):
+        # The message is ended right away and finalized with the VOD once the
+        # resolver finds it.
+        stream = self.streams.get(stream_id)
+        if stream:
+            self.embed_cache.forget(key=stream_id)
+            self.state_store.mark_finalized(stream_id=stream_id)
+            self.outbox.end(
+                stream=stream,
+                targets=self.config.targets(stream.user_login),
+                summary=self.viewer_history.summary(stream_id),
+            )
+            self.vod_resolver.add(stream_id=stream_id, user_id=stream.user_id)
+
+    def _on_vod_resolved(self, stream_id: str, vod_url: str | None):
+        stream = self.streams.get(stream_id)
+        # Streamers removed from the config have no webhooks left.
+        targets = self.config.targets(stream.user_login) if stream else []
+        if not vod_url or not targets:
+            self.outbox.forget(key=stream_id)
+        else:
+            self.outbox.finalize(
+                stream=stream,
+                vod_url=vod_url,
+                targets=targets,
+                summary=self.viewer_history.summary(stream_id),
+            )
+        self.viewer_history.remove(stream_id)
+
+    def save_state(self):
+        self.state_store.flush()
+        if time.time() < self._next_maintenance:
+            return
+        self._next_maintenance = time.time() + STATE_MAINTENANCE_SECONDS
+        for stream_id in self.state_store.evict():
+            self.streams.pop(stream_id, None)
+            self.viewer_history.remove(stream_id)
+        self.state_store.compact()
+
+    async def interrupt(self):
+        # Finishes within the shutdown timeout, as Docker kills the process
+        # soon after SIGTERM. Messages that could not be sent and VODs that
+        # were not found stay in the outbox and state store, to be picked up
+        # by the next start.
+        deadline = time.monotonic() + self.shutdown_timeout
+        for task in self._setup_tasks:
+            task.cancel()
+        # Requests started from now on give up by the deadline.
+        self.transport.timeout = tuple(
+            min(timeout, self.shutdown_timeout)
+            for timeout in self.transport.timeout
+        )
+        await asyncio.gather(
+            *(
+                asyncio.to_thread(server.stop)
+                for server in (self.eventsub_server, self.metrics_server)
+                if server
+            )
+        )
+        for stream_id in self.live_streams.values():
+            self.finalize_stream(stream_id=stream_id)
+        self.live_streams.clear()
+        for group in self.config.groups:
+            self.update_digest(group=group)
+        self.state_store.flush()
+        # Messages of all streams are sent concurrently, limited only by
+        # the webhooks' rate limits.
+        remaining = max(deadline - time.monotonic(), 0)
+        try:
+            await asyncio.wait_for(
+                self.outbox.drain(timeout=remaining), timeout=remaining
+            )
+        except asyncio.TimeoutError:
+            logger.warning("Shutdown timeout passed while sending messages.")
+        self.state_store.close()
+        self.viewer_history.close()
+        if self.outbox.pending():
+            logger.warning(
+                f"{self.outbox.pending()} Discord messages are still pending, "
+                "they will be sent on the next start."
+            )
+        if self.vod_resolver.pending():
+            logger.info(
+                f"{self.vod_resolver.pending()} VODs are still looked up, "
+                "lookups continue on the next start."
+            )
+        for prefix, stats in self.transport.connection_stats().items():
+            logger.info(
+                f"{prefix}: {stats.requests} requests over "
+                f"{stats.new_connections} connections, "
+                f"{stats.reused_connections} reused."
             )
 
 
 DELAY_SECONDS = 30.0
+HELIX_STREAMS_URL = "https://api.twitch.tv/helix/streams"
+ANNOUNCED_POLL_SECONDS = 300.0
+ENDED_STREAM_SECONDS = 600.0
+STATE_MAINTENANCE_SECONDS = 3600.0
+USER_REFRESH_SECONDS = 60.0
+
+
+# Runs every call in a daemon thread of its own, as asyncio.run and the
+# interpreter join the threads of a pool without a timeout. Requests that
+# started before SIGTERM then can not hold up the exit past the shutdown
+# timeout. How many run at once is limited by the clients' semaphore.
+class DaemonThreadExecutor(ThreadPoolExecutor):
+    def submit(self, function, /, *args, **kwargs) -> Future:
+        future = Future()
+
+        def run_function():
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                future.set_result(function(*args, **kwargs))
+            except BaseException as err:
+                future.set_exception(err)
+
+        threading.Thread(target=run_function, daemon=True).start()
+        return future
 
 
 def entry() -> None:
     logger.info("Initiating main...")
-    start_time = time.time()
     main = Main()
 
     logger.info("Set-up looks correct, starting main loop.")
     try:
+        asyncio.run(run(main=main))
+    except asyncio.CancelledError:
+        logger.info("Stopped after SIGTERM.")
+
+
+async def run(main: Main) -> None:
+    workers = [
+        asyncio.create_task(main.outbox.run()),
+        asyncio.create_task(main.vod_resolver.run()),
+    ]
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(DaemonThreadExecutor())
+    main.profiler.install_signal_handler(loop=loop)
+    # Docker stops containers with SIGTERM, which shuts down like Ctrl+C.
+    loop.add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    try:
+        await main.setup()
         while True:
-            main.update_status()
-            with open("streams.json", "w") as file:
-                serializable_streams = {
-                    k: asdict(v) for k, v in main.streams.items()
-                }
-                json.dump(serializable_streams, file)
-            time.sleep(
-                DELAY_SECONDS - ((time.time() - start_time) % DELAY_SECONDS)
-            )
-    except (SystemExit, KeyboardInterrupt):
+            await main.update_status()
+            main.save_state()
+            try:
+                await asyncio.wait_for(
+                    main.wake.wait(),
+                    timeout=min(
+                        main.scheduler.seconds_until_next(), DELAY_SECONDS
+                    ),
+                )
+            except asyncio.TimeoutError:
+                pass
+            main.wake.clear()
+    except (SystemExit, KeyboardInterrupt, asyncio.CancelledError):
         logger.info("Caught wish to exit, interrupting and re-raising.")
-        main.interrupt()
+        # Messages the outbox is sending are finished by interrupt().
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        await main.interrupt()
         raise
 
 
@@ -0,0 +1,238 @@
+import bisect
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+import requests
+from loguru import logger
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def escape_label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"')
+
+
+def format_labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(
+        f'{name}="{escape_label_value(value)}"'
+        for name, value in labels.items()
+    )
+    return f"{{{pairs}}}"
+
+
+# Every metric created, in the order they are rendered in.
+REGISTRY: list["Metric"] = []
+
+
+# Metrics are updated from the worker threads requests run in, so every
+# metric guards its values with a lock.
+class Metric:
+    type = ""
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._lock = threading.Lock()
+        self._values: dict[tuple[str, ...], object] = dict()
+        REGISTRY.append(self)
+
+    def _key(self, labels: dict[str, str]) -> tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.extend(
+                    self._render_value(dict(zip(self.labels, key)), value)
+                )
+        return lines
+
+    def _render_value(self, labels: dict[str, str], value) -> list[str]:
+        return [f"{self.name}{format_labels(labels)} {value}"]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels: str) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def value(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name=name, help=help, labels=labels)
+        self.buckets = buckets
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(
+                key, ([0] * (len(self.buckets) + 1), 0.0)
+            )
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def count(self, **labels: str) -> int:
+        with self._lock:
+            counts, _ = self._values.get(self._key(labels), ([0], 0.0))
+            return sum(counts)
+
+    def _render_value(self, labels: dict[str, str], value) -> list[str]:
+        counts, total = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip((*self.buckets, "+Inf"), counts):
+            cumulative += count
+            bucket_labels = format_labels({**labels, "le": bound})
+            lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+        lines.append(f"{self.name}_sum{format_labels(labels)} {total}")
+        lines.append(f"{self.name}_count{format_labels(labels)} {cumulative}")
+        return lines
+
+
+REQUEST_SECONDS = Histogram(
+    "notifier_request_duration_seconds",
+    "Time until the response headers of Twitch and Discord requests arrived.",
+    labels=("upstream", "endpoint", "method"),
+)
+ERROR_RESPONSES = Counter(
+    "notifier_error_responses_total",
+    "Twitch and Discord responses with status 401, 429 or 5xx.",
+    labels=("upstream", "status"),
+)
+RETRIES = Counter(
+    "notifier_retries_total",
+    "Requests that are retried after they failed.",
+    labels=("operation",),
+)
+OUTBOX_ERRORS = Counter(
+    "notifier_outbox_errors_total",
+    "Discord messages of the outbox that failed with an unexpected error.",
+    labels=("kind",),
+)
+TOKEN_REFRESHES = Counter(
+    "notifier_token_refreshes_total", "Twitch app access tokens requested."
+)
+TICK_SECONDS = Histogram(
+    "notifier_tick_duration_seconds", "Time polling and handling one tick took."
+)
+TICK_DRIFT_SECONDS = Gauge(
+    "notifier_tick_drift_seconds",
+    "How late the last tick started after the streamers in it were due.",
+)
+TRACKED_STREAMERS = Gauge(
+    "notifier_tracked_streamers", "Streamers that are polled."
+)
+LIVE_STREAMERS = Gauge("notifier_live_streamers", "Streamers that are live.")
+CIRCUIT_STATE = Gauge(
+    "notifier_circuit_state",
+    "State of the circuit breakers, 0 closed, 1 half-open and 2 open.",
+    labels=("upstream", "endpoint"),
+)
+
+
+def render() -> bytes:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return ("\n".join(lines) + "\n").encode()
+
+
+# Ids and tokens in paths are left out, to keep the number of series small.
+ENDPOINT_PATTERNS = (
+    (
+        re.compile(r"^/api/(v\d+/)?webhooks/[^/]+/[^/]+/messages/.+$"),
+        "messages",
+    ),
+    (re.compile(r"^/api/(v\d+/)?webhooks/[^/]+/[^/]+/?$"), "webhook"),
+)
+
+
+def endpoint(path: str) -> str:
+    for pattern, name in ENDPOINT_PATTERNS:
+        if pattern.match(path):
+            return name
+    return path.strip("/")
+
+
+def observe_response(response: requests.Response, *args, **kwargs) -> None:
+    # Response hook of the transport, recording every Twitch and Discord call.
+    url = urlsplit(response.request.url)
+    REQUEST_SECONDS.observe(
+        response.elapsed.total_seconds(),
+        upstream=url.hostname,
+        endpoint=endpoint(url.path),
+        method=response.request.method,
+    )
+    if response.status_code in (401, 429):
+        ERROR_RESPONSES.inc(upstream=url.hostname, status=response.status_code)
+    elif response.status_code >= 500:
+        ERROR_RESPONSES.inc(upstream=url.hostname, status="5xx")
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        body = render()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port: int = 9090, host: str = "0.0.0.0"):
+        super().__init__((host, port), MetricsHandler)
+
+    def start(self) -> None:
+        logger.info(f"Serving metrics on port {self.server_port}.")
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,452 @@
+import asyncio
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Callable, Iterator
+
+from loguru import logger
+from requests import RequestException
+
+from app.circuit_breaker import CircuitOpenError
+from app.discord_client import AsyncDiscordClient
+from app.metrics import OUTBOX_ERRORS, RETRIES
+from app.rate_limit import WebhookRateLimiter
+from app.templates import MessageTemplates
+from app.twitch_client import StreamInformation
+from app.viewer_history import ViewerSummary
+
+SEND = "send"
+UPDATE = "update"
+# Ends a message while its VOD is still looked up, keeping its id around to
+# finalize it with the VOD later.
+END = "end"
+FINALIZE = "finalize"
+
+MAX_ATTEMPTS = 8
+BACKOFF_BASE_SECONDS = 5
+BACKOFF_MAX_SECONDS = 300
+IDLE_WAIT_SECONDS = 60
+MIN_WAIT_SECONDS = 0.1
+
+
+def digest_key(group: str) -> str:
+    return f"group:{group}"
+
+
+@dataclass
+class Job:
+    id: int
+    key: str
+    target: str
+    kind: str
+    # The message, rendered and serialized when it was queued.
+    payload: bytes
+    attempts: int
+    due_at: float
+
+
+# Durable queue of Discord writes. Jobs are grouped by key, the id of the
+# stream they belong to, and target, the webhook they are sent to. Each
+# group's jobs run one after another in order, so an update never overtakes
+# the send that created its message, while different targets run
+# concurrently. Messages are rendered once and shared by all targets.
+class Outbox:
+    def __init__(
+        self,
+        discord_client: AsyncDiscordClient,
+        rate_limiter: WebhookRateLimiter | None = None,
+        on_sent: Callable[[str, str], None] | None = None,
+        path: str | None = None,
+        templates: MessageTemplates | None = None,
+    ):
+        self._discord_client = discord_client
+        self._rate_limiter = rate_limiter or WebhookRateLimiter()
+        self._templates = templates or MessageTemplates()
+        self._on_sent = on_sent
+        self._db = sqlite3.connect(
+            path or os.environ.get("OUTBOX_PATH", "outbox.db")
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                key TEXT NOT NULL,
+                target TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                payload BLOB NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                due_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS jobs_key_target
+                ON jobs (key, target, id);
+            CREATE TABLE IF NOT EXISTS target_messages (
+                key TEXT NOT NULL,
+                target TEXT NOT NULL,
+                message_id TEXT NOT NULL,
+                PRIMARY KEY (key, target)
+            );
+            """
+        )
+        self._wake = asyncio.Event()
+        # The jobs the worker is sending, which outlive it when cancelled.
+        self._batch: asyncio.Future | None = None
+        self._in_flight: set[int] = set()
+        self._in_transaction = False
+
+    def send(
+        self,
+        stream: StreamInformation,
+        profile_image: str | None,
+        targets: list[str],
+    ) -> None:
+        self._enqueue(
+            key=stream.id,
+            targets=targets,
+            kind=SEND,
+            message=self._templates.live_message(stream, profile_image),
+        )
+
+    def update(
+        self,
+        stream: StreamInformation,
+        profile_image: str | None,
+        targets: list[str],
+    ) -> None:
+        self._enqueue(
+            key=stream.id,
+            targets=targets,
+            kind=UPDATE,
+            message=self._templates.update_message(stream, profile_image),
+        )
+
+    def end(
+        self,
+        stream: StreamInformation,
+        targets: list[str],
+        summary: ViewerSummary | None = None,
+    ) -> None:
+        self._enqueue(
+            key=stream.id,
+            targets=targets,
+            kind=END,
+            message=self._templates.finalized_message(
+                stream.user_name, None, summary
+            ),
+        )
+
+    def finalize(
+        self,
+        stream: StreamInformation,
+        vod_url: str | None,
+        targets: list[str],
+        summary: ViewerSummary | None = None,
+    ) -> None:
+        self._enqueue(
+            key=stream.id,
+            targets=targets,
+            kind=FINALIZE,
+            message=self._templates.finalized_message(
+                stream.user_name, vod_url, summary
+            ),
+        )
+
+    # Digests hold the live members of a group, keyed by the group's name.
+    def send_digest(
+        self,
+        group: str,
+        streams: list[tuple[StreamInformation, str | None]],
+        targets: list[str],
+    ) -> None:
+        self._enqueue(
+            key=digest_key(group),
+            targets=targets,
+            kind=SEND,
+            message=self._templates.digest_message(
+                group, streams, mention=True
+            ),
+        )
+
+    def update_digest(
+        self,
+        group: str,
+        streams: list[tuple[StreamInformation, str | None]],
+        targets: list[str],
+    ) -> None:
+        self._enqueue(
+            key=digest_key(group),
+            targets=targets,
+            kind=UPDATE,
+            message=self._templates.digest_message(group, streams),
+        )
+
+    def finalize_digest(self, group: str, targets: list[str]) -> None:
+        self._enqueue(
+            key=digest_key(group),
+            targets=targets,
+            kind=FINALIZE,
+            message=self._templates.finalized_digest_message(group),
+        )
+
+    def use_templates(self, templates: MessageTemplates) -> None:
+        # Messages queued already keep the style they were rendered with.
+        self._templates = templates
+
+    def has_message(self, key: str) -> bool:
+        # Whether a message was sent for the key or is about to be.
+        return bool(
+            self._db.execute(
+                "SELECT 1 FROM target_messages WHERE key = ? "
+                "UNION SELECT 1 FROM jobs WHERE key = ? AND kind = ?",
+                (key, key, SEND),
+            ).fetchone()
+        )
+
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        # Queues every message of the block in a single commit, as a commit
+        # per message costs more than writing it.
+        if self._in_transaction:
+            yield
+            return
+
+        self._in_transaction = True
+        try:
+            with self._db:
+                yield
+        finally:
+            self._in_transaction = False
+
+    def _enqueue(
+        self, key: str, targets: list[str], kind: str, message: bytes
+    ) -> None:
+        if not targets:
+            return
+
+        now = time.time()
+        with self.transaction():
+            # Only the newest edit of a message matters, so pending edits it
+            # replaces are dropped.
+            superseded = {
+                UPDATE: [UPDATE],
+                END: [UPDATE],
+                FINALIZE: [UPDATE, END],
+            }
+            self._db.executemany(
+                "DELETE FROM jobs WHERE key = ? AND target = ? AND kind = ?",
+                [
+                    (key, target, superseded_kind)
+                    for target in targets
+                    for superseded_kind in superseded.get(kind, [])
+                ],
+            )
+            self._db.executemany(
+                "INSERT INTO jobs (key, target, kind, payload, due_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(key, target, kind, message, now) for target in targets],
+            )
+        self._wake.set()
+
+    def forget(self, key: str) -> None:
+        # Drops the message ids of a key that will not be edited anymore.
+        with self.transaction():
+            self._db.execute(
+                "DELETE FROM target_messages WHERE key = ? AND NOT EXISTS "
+                "(SELECT 1 FROM jobs WHERE jobs.key = target_messages.key "
+                "AND jobs.target = target_messages.target)",
+                (key,),
+            )
+
+    def pending(self) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+
+    def _message_id(self, key: str, target: str) -> str | None:
+        row = self._db.execute(
+            "SELECT message_id FROM target_messages "
+            "WHERE key = ? AND target = ?",
+            (key, target),
+        ).fetchone()
+        return row[0] if row else None
+
+    def _head_jobs(self) -> list[Job]:
+        rows = self._db.execute(
+            "SELECT id, key, target, kind, payload, attempts, due_at FROM jobs "
+            "WHERE id IN (SELECT MIN(id) FROM jobs GROUP BY key, target) "
+            "ORDER BY due_at, id"
+        ).fetchall()
+        return [
+            Job(
+                id=row[0],
+                key=row[1],
+                target=row[2],
+                kind=row[3],
+                payload=row[4],
+                attempts=row[5],
+                due_at=row[6],
+            )
+            for row in rows
+        ]
+
+    def _ready_jobs(self, ignore_backoff: bool) -> tuple[list[Job], float]:
+        # Picks the jobs that may run now, reserving a request from their
+        # webhook's rate limit bucket for each, and how long to wait for more.
+        now = time.time()
+        ready_jobs = []
+        wait_seconds = IDLE_WAIT_SECONDS
+        for job in self._head_jobs():
+            if job.id in self._in_flight:
+                continue
+            delay = 0 if ignore_backoff else max(job.due_at - now, 0)
+            delay = max(delay, self._rate_limiter.delay(job.target))
+            if delay == 0 and self._rate_limiter.reserve(job.target):
+                ready_jobs.append(job)
+            else:
+                wait_seconds = min(wait_seconds, max(delay, MIN_WAIT_SECONDS))
+        return ready_jobs, wait_seconds
+
+    async def run(self) -> None:
+        logger.info(f"Starting outbox with {self.pending()} pending jobs.")
+        while True:
+            self._wake.clear()
+            ready_jobs, wait_seconds = self._ready_jobs(ignore_backoff=False)
+            if ready_jobs:
+                # Shielded, so cancelling the worker never stops a message
+                # that Discord may have received before the outbox knows.
+                self._batch = asyncio.gather(
+                    *(self._dispatch(job) for job in ready_jobs)
+                )
+                await asyncio.shield(self._batch)
+                continue
+
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=wait_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+    async def drain(self, timeout: float) -> None:
+        # Runs every pending job without waiting out its backoff, until the
+        # queue is empty or the timeout passes. Must not run alongside run(),
+        # but waits for the jobs a cancelled worker was still sending.
+        deadline = time.time() + timeout
+        if self._batch and not self._batch.done():
+            await asyncio.wait({self._batch}, timeout=timeout)
+        while self.pending() and time.time() < deadline:
+            ready_jobs, wait_seconds = self._ready_jobs(ignore_backoff=True)
+            succeeded = await asyncio.gather(
+                *(self._dispatch(job) for job in ready_jobs)
+            )
+            if not ready_jobs or not all(succeeded):
+                await asyncio.sleep(
+                    max(min(wait_seconds, 1, deadline - time.time()), 0)
+                )
+
+    async def _dispatch(self, job: Job) -> bool:
+        self._in_flight.add(job.id)
+        try:
+            return await self._attempt(job)
+        finally:
+            self._in_flight.discard(job.id)
+
+    async def _attempt(self, job: Job) -> bool:
+        try:
+            await self._execute(job)
+        except RequestException as err:
+            self._retry(job=job, err=err)
+            return False
+        except Exception as err:
+            # Counts as a failed attempt instead of ending the worker, which
+            # would stop every message after it.
+            OUTBOX_ERRORS.inc(kind=job.kind)
+            logger.opt(exception=err).error(
+                f"Discord {job.kind} for stream {job.key} failed unexpectedly."
+            )
+            self._retry(job=job, err=err)
+            return False
+
+        with self._db:
+            self._db.execute("DELETE FROM jobs WHERE id = ?", (job.id,))
+        return True
+
+    async def _execute(self, job: Job) -> None:
+        if job.kind == SEND:
+            message_id = await self._discord_client.send_information_to_discord(
+                webhook_url=job.target, message=job.payload
+            )
+            with self._db:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO target_messages VALUES (?, ?, ?)",
+                    (job.key, job.target, message_id),
+                )
+            if self._on_sent:
+                self._on_sent(job.key, message_id)
+            return
+
+        if job.kind == UPDATE:
+            await self._discord_client.update_information_on_discord(
+                webhook_url=job.target,
+                message_id=self._message_id(job.key, job.target) or "",
+                message=job.payload,
+            )
+            return
+
+        await self._discord_client.finalize_information_on_discord(
+            webhook_url=job.target,
+            message_id=self._message_id(job.key, job.target) or "",
+            message=job.payload,
+        )
+        if job.kind == FINALIZE:
+            with self._db:
+                self._db.execute(
+                    "DELETE FROM target_messages WHERE key = ? AND target = ?",
+                    (job.key, job.target),
+                )
+
+    def _hold_back(self, job: Job, delay: float) -> None:
+        with self._db:
+            self._db.execute(
+                "UPDATE jobs SET due_at = ? WHERE id = ?",
+                (time.time() + delay, job.id),
+            )
+
+    def _retry(self, job: Job, err: Exception) -> None:
+        if isinstance(err, CircuitOpenError):
+            # Nothing was sent, so it waits for the circuit's next probe
+            # without counting as a failed attempt.
+            self._hold_back(job=job, delay=err.retry_after)
+            return
+
+        response = getattr(err, "response", None)
+        if response is not None and response.status_code == 429:
+            RETRIES.inc(operation=f"discord_{job.kind}")
+            # Rate limited requests are held back by the rate limiter until
+            # their bucket resets, which does not count as a failed attempt.
+            self._hold_back(job=job, delay=self._rate_limiter.delay(job.target))
+            return
+
+        attempts = job.attempts + 1
+        # Updates are superseded by the next tick anyway, so they get one try.
+        if job.kind == UPDATE or attempts >= MAX_ATTEMPTS:
+            logger.warning(
+                f"Aborted the Discord {job.kind} for stream {job.key} "
+                f"after {attempts} attempts."
+            )
+            with self._db:
+                self._db.execute("DELETE FROM jobs WHERE id = ?", (job.id,))
+            return
+
+        RETRIES.inc(operation=f"discord_{job.kind}")
+        backoff = min(
+            BACKOFF_BASE_SECONDS * 2**job.attempts, BACKOFF_MAX_SECONDS
+        )
+        logger.info(
+            f"Retrying the Discord {job.kind} for stream {job.key} "
+            f"in {backoff} seconds."
+        )
+        with self._db:
+            self._db.execute(
+                "UPDATE jobs SET attempts = ?, due_at = ? WHERE id = ?",
+                (attempts, time.time() + backoff, job.id),
+            )
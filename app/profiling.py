@@ -0,0 +1,169 @@
+import cProfile
+import io
+import os
+import pstats
+import signal
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+
+from loguru import logger
+
+# Arguments of client calls that tell which streamer or message a span is
+# about. Webhook urls hold tokens and are never recorded.
+TRACED_ARGUMENTS = (
+    "logins",
+    "user_ids",
+    "user_id",
+    "stream_id",
+    "message_id",
+    "subscription_type",
+    "broadcaster_user_id",
+)
+MAX_TRACED_ITEMS = 3
+REPORTED_SPANS = 10
+REPORTED_FUNCTIONS = 15
+
+
+@dataclass
+class Span:
+    name: str
+    attributes: dict[str, str]
+    started_at: float = field(default_factory=time.perf_counter)
+    duration: float = 0.0
+
+
+# Spans finished during the tick being profiled, None while profiling is off
+# so spans cost next to nothing.
+_spans: list[Span] | None = None
+
+
+def describe(value) -> str:
+    if isinstance(value, (list, tuple)):
+        items = ", ".join(str(item) for item in value[:MAX_TRACED_ITEMS])
+        if len(value) > MAX_TRACED_ITEMS:
+            return f"{items} and {len(value) - MAX_TRACED_ITEMS} more"
+        return items
+    return str(value)
+
+
+def traced_arguments(arguments: dict) -> dict[str, str]:
+    return {
+        name: describe(value)
+        for name, value in arguments.items()
+        if name in TRACED_ARGUMENTS and value is not None
+    }
+
+
+@contextmanager
+def span(name: str, **attributes):
+    if _spans is None:
+        yield
+        return
+
+    current = Span(name=name, attributes=attributes)
+    try:
+        yield
+    finally:
+        current.duration = time.perf_counter() - current.started_at
+        if _spans is not None:
+            _spans.append(current)
+
+
+# Profiles ticks while enabled and dumps the profile and the slowest spans of
+# ticks slower than the threshold. Dumps are rate limited, as a struggling
+# upstream makes every tick slow. SIGUSR1 turns it on and off at runtime.
+class TickProfiler:
+    def __init__(
+        self,
+        threshold_seconds: float | None = None,
+        dump_interval_seconds: float | None = None,
+        directory: str | None = None,
+        enabled: bool | None = None,
+    ):
+        self.threshold_seconds = (
+            threshold_seconds
+            if threshold_seconds is not None
+            else float(os.environ.get("SLOW_TICK_SECONDS", 30))
+        )
+        self.dump_interval_seconds = (
+            dump_interval_seconds
+            if dump_interval_seconds is not None
+            else float(os.environ.get("PROFILE_DUMP_INTERVAL_SECONDS", 300))
+        )
+        self.directory = Path(
+            directory or os.environ.get("PROFILE_DIR", "profiles")
+        )
+        self.enabled = (
+            enabled
+            if enabled is not None
+            else os.environ.get("PROFILE_SLOW_TICKS", "") == "1"
+        )
+        self._last_dump_at = -float("inf")
+
+    def toggle(self) -> None:
+        self.enabled = not self.enabled
+        logger.info(
+            f"Slow tick profiling {'enabled' if self.enabled else 'disabled'}."
+        )
+
+    def install_signal_handler(self, loop) -> None:
+        # Windows has no SIGUSR1.
+        if hasattr(signal, "SIGUSR1"):
+            loop.add_signal_handler(signal.SIGUSR1, self.toggle)
+
+    @contextmanager
+    def tick(self):
+        global _spans
+        if not self.enabled:
+            yield
+            return
+
+        spans: list[Span] = []
+        _spans = spans
+        profile = cProfile.Profile()
+        started_at = time.perf_counter()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            _spans = None
+            duration = time.perf_counter() - started_at
+            if duration >= self.threshold_seconds:
+                self._report(duration=duration, spans=spans, profile=profile)
+
+    def _report(
+        self, duration: float, spans: list[Span], profile: cProfile.Profile
+    ) -> None:
+        slowest = sorted(spans, key=lambda span: span.duration, reverse=True)
+        lines = [
+            f"{span.duration:.3f}s {span.name} "
+            + " ".join(f"{k}={v}" for k, v in span.attributes.items())
+            for span in slowest[:REPORTED_SPANS]
+        ]
+        logger.warning(
+            f"Tick took {duration:.3f}s, slowest of {len(spans)} spans:\n"
+            + "\n".join(lines)
+        )
+
+        now = time.monotonic()
+        if now - self._last_dump_at < self.dump_interval_seconds:
+            return
+        self._last_dump_at = now
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / (
+            f"tick-{datetime.now().strftime('%Y%m%d-%H%M%S')}.prof"
+        )
+        profile.dump_stats(path)
+        stats_text = io.StringIO()
+        pstats.Stats(profile, stream=stats_text).sort_stats(
+            pstats.SortKey.CUMULATIVE
+        ).print_stats(REPORTED_FUNCTIONS)
+        logger.warning(
+            f"Profile of the slow tick written to {path}.\n"
+            f"{stats_text.getvalue()}"
+        )
@@ -0,0 +1,166 @@
+import asyncio
+import re
+import threading
+import time
+from dataclasses import dataclass
+
+import requests
+from loguru import logger
+
+WEBHOOK_PATTERN = re.compile(r"/webhooks/(\d+)/")
+
+
+def webhook_id(url: str) -> str | None:
+    match = WEBHOOK_PATTERN.search(url)
+    return match.group(1) if match else None
+
+
+# Reservations on a bucket we have no reset time for free up after this long,
+# in case the response that would have told us never arrives.
+PROVISIONAL_RESET_SECONDS = 1.0
+
+
+@dataclass
+class Bucket:
+    # Unknown buckets allow one request, whose response tells us the rest.
+    limit: int = 1
+    remaining: int = 1
+    reset_at: float = 0.0
+
+    def replenish(self, now: float) -> None:
+        if self.reset_at and self.reset_at <= now:
+            self.remaining = self.limit
+            self.reset_at = 0.0
+
+
+# Tracks Discord's rate limit bucket of every webhook from the headers of its
+# responses, so requests can be held until their bucket resets instead of
+# running into a 429.
+class WebhookRateLimiter:
+    def __init__(self):
+        self._buckets: dict[str, Bucket] = dict()
+        self._global_reset_at = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, response: requests.Response, *args, **kwargs) -> None:
+        key = webhook_id(response.request.url)
+        if key is None:
+            return
+
+        now = time.time()
+        headers = response.headers
+        with self._lock:
+            bucket = self._buckets.setdefault(key, Bucket())
+            if "X-RateLimit-Limit" in headers:
+                bucket.limit = int(headers["X-RateLimit-Limit"])
+            if "X-RateLimit-Remaining" in headers:
+                bucket.remaining = int(headers["X-RateLimit-Remaining"])
+            if "X-RateLimit-Reset-After" in headers:
+                bucket.reset_at = now + float(
+                    headers["X-RateLimit-Reset-After"]
+                )
+
+            if response.status_code != 429:
+                return
+
+            retry_after = float(headers.get("Retry-After", 1))
+            logger.warning(
+                f"Discord rate limited webhook {key} for {retry_after}s."
+            )
+            if (
+                headers.get("X-RateLimit-Global")
+                or headers.get("X-RateLimit-Scope") == "global"
+            ):
+                self._global_reset_at = now + retry_after
+            else:
+                bucket.remaining = 0
+                bucket.reset_at = max(bucket.reset_at, now + retry_after)
+
+    def delay(self, url: str) -> float:
+        now = time.time()
+        with self._lock:
+            delay = max(self._global_reset_at - now, 0)
+            bucket = self._buckets.get(webhook_id(url) or "")
+            if bucket:
+                bucket.replenish(now=now)
+                if bucket.remaining <= 0:
+                    delay = max(delay, bucket.reset_at - now)
+            return delay
+
+    def reserve(self, url: str) -> bool:
+        # Takes one request out of the bucket before it is sent, so requests
+        # running concurrently can not overdraw it.
+        now = time.time()
+        with self._lock:
+            if self._global_reset_at > now:
+                return False
+
+            bucket = self._buckets.setdefault(webhook_id(url) or "", Bucket())
+            bucket.replenish(now=now)
+            if bucket.remaining <= 0:
+                return False
+
+            bucket.remaining -= 1
+            if not bucket.reset_at:
+                bucket.reset_at = now + PROVISIONAL_RESET_SECONDS
+            return True
+
+
+STREAM_POLL = 0
+BACKGROUND = 1
+
+
+# Mirrors Twitch's token bucket for Helix from the Ratelimit-* headers, and
+# refills it at the rate Twitch does in between. Background calls like profile
+# refreshes only spend points above the reserve kept for stream polls.
+class HelixBudget:
+    def __init__(self, limit: int = 800, reserve: float = 0.2):
+        self.limit = limit
+        self.reserve = reserve
+        self._points = float(limit)
+        self._updated_at = time.time()
+        self._lock = threading.Lock()
+
+    def observe(self, response: requests.Response, *args, **kwargs) -> None:
+        if "Ratelimit-Remaining" not in response.headers:
+            return
+
+        with self._lock:
+            self.limit = int(
+                response.headers.get("Ratelimit-Limit", self.limit)
+            )
+            self._points = float(response.headers["Ratelimit-Remaining"])
+            self._updated_at = time.time()
+            if response.status_code == 429:
+                logger.warning("Twitch rate limited us.")
+
+    def _refill(self, now: float) -> None:
+        # Twitch refills the whole bucket over a minute.
+        self._points = min(
+            self._points + (now - self._updated_at) * self.limit / 60,
+            self.limit,
+        )
+        self._updated_at = now
+
+    def _threshold(self, priority: int) -> float:
+        return 0 if priority == STREAM_POLL else self.limit * self.reserve
+
+    def wait_time(self, priority: int = STREAM_POLL, points: int = 1) -> float:
+        with self._lock:
+            self._refill(now=time.time())
+            missing = self._threshold(priority) + points - self._points
+            return max(missing, 0) * 60 / self.limit
+
+    def is_low(self) -> bool:
+        return self.wait_time(priority=BACKGROUND) > 0
+
+    async def acquire(self, priority: int = STREAM_POLL) -> None:
+        # Waits in the event loop until the point is there, so no thread
+        # sleeps on it.
+        while True:
+            with self._lock:
+                self._refill(now=time.time())
+                if self._points - 1 >= self._threshold(priority):
+                    self._points -= 1
+                    return
+            await asyncio.sleep(self.wait_time(priority=priority))
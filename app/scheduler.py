@@ -0,0 +1,157 @@
+import heapq
+import math
+import random
+import time
+
+HOUR_SECONDS = 3600
+WEEK_HOURS = 7 * 24
+
+
+def hour_of_week(timestamp: float) -> int:
+    return int(timestamp // HOUR_SECONDS) % WEEK_HOURS
+
+
+# Decides when each streamer is polled next, keeping next-due times in a
+# min-heap. Live streamers, streamers that just went offline and streamers
+# around the hours they usually go live in are polled every live_interval.
+# Everyone else backs off the longer they stay offline, up to max_interval.
+class PollScheduler:
+    def __init__(
+        self,
+        live_interval: float,
+        max_interval: float = 300,
+        jitter: float = 0.1,
+        batch_window: float = 1,
+        recently_live_seconds: float = 600,
+    ):
+        self.live_interval = live_interval
+        self.max_interval = max(max_interval, live_interval)
+        self.jitter = jitter
+        self.batch_window = batch_window
+        self.recently_live_seconds = recently_live_seconds
+        # Entries are (due_at, sequence, streamer). Rescheduling pushes a new
+        # entry, older ones are skipped when popped as they no longer match.
+        self._heap: list[tuple[float, int, str]] = []
+        self._sequence = 0
+        self._due_at: dict[str, float] = dict()
+        self._live: set[str] = set()
+        self._offline_since: dict[str, float] = dict()
+        self._usual_start_hours: dict[str, set[int]] = dict()
+        # Due times are lined up with a grid of live intervals, so streamers
+        # polled in different batches meet again instead of drifting apart.
+        # Jitter moves a whole tick of the grid, everyone due at it stays in
+        # one batch.
+        self._grid_start: float | None = None
+        self._tick_offsets: dict[int, float] = dict()
+
+    def __contains__(self, streamer: str) -> bool:
+        return streamer in self._due_at
+
+    def __len__(self) -> int:
+        return len(self._due_at)
+
+    def add(self, streamer: str, due_at: float | None = None) -> None:
+        due_at = time.time() if due_at is None else due_at
+        if self._due_at.get(streamer, float("inf")) <= due_at:
+            return
+        self._offline_since.setdefault(streamer, due_at)
+        self._push(streamer=streamer, due_at=due_at)
+
+    def remove(self, streamer: str) -> None:
+        self._due_at.pop(streamer, None)
+        self._live.discard(streamer)
+        self._offline_since.pop(streamer, None)
+        self._usual_start_hours.pop(streamer, None)
+
+    def _push(self, streamer: str, due_at: float) -> None:
+        self._due_at[streamer] = due_at
+        self._sequence += 1
+        heapq.heappush(self._heap, (due_at, self._sequence, streamer))
+
+    def pop_due(self, now: float | None = None) -> list[str]:
+        # Everyone due within the batch window is polled together.
+        now = time.time() if now is None else now
+        due_streamers = []
+        while self._heap and self._heap[0][0] <= now + self.batch_window:
+            due_at, _, streamer = heapq.heappop(self._heap)
+            if self._due_at.get(streamer) != due_at:
+                continue
+            del self._due_at[streamer]
+            due_streamers.append(streamer)
+        return due_streamers
+
+    def next_due_at(self) -> float:
+        while self._heap and self._due_at.get(self._heap[0][2]) != (
+            self._heap[0][0]
+        ):
+            heapq.heappop(self._heap)
+        if not self._heap:
+            return float("inf")
+        return self._heap[0][0]
+
+    def seconds_until_next(self, now: float | None = None) -> float:
+        now = time.time() if now is None else now
+        return max(self.next_due_at() - now, 0)
+
+    def reschedule(
+        self, streamer: str, is_live: bool, now: float | None = None
+    ) -> None:
+        now = time.time() if now is None else now
+        if is_live and streamer not in self._live:
+            self._live.add(streamer)
+            self._usual_start_hours.setdefault(streamer, set()).add(
+                hour_of_week(now)
+            )
+        elif not is_live and streamer in self._live:
+            self._live.discard(streamer)
+            self._offline_since[streamer] = now
+        self._offline_since.setdefault(streamer, now)
+
+        interval = self.interval(streamer=streamer, now=now)
+        self._push(
+            streamer=streamer, due_at=self._tick_due_at(now + interval, now=now)
+        )
+
+    def _tick_due_at(self, due_at: float, now: float) -> float:
+        if self._grid_start is None:
+            self._grid_start = now
+        current_tick = math.floor((now - self._grid_start) / self.live_interval)
+        tick = max(
+            round((due_at - self._grid_start) / self.live_interval),
+            current_tick + 1,
+        )
+        if tick not in self._tick_offsets:
+            for past_tick in [
+                t for t in self._tick_offsets if t <= current_tick
+            ]:
+                del self._tick_offsets[past_tick]
+            self._tick_offsets[tick] = self.live_interval * random.uniform(
+                -self.jitter, self.jitter
+            )
+        return (
+            self._grid_start
+            + tick * self.live_interval
+            + self._tick_offsets[tick]
+        )
+
+    def interval(self, streamer: str, now: float) -> float:
+        if streamer in self._live:
+            return self.live_interval
+
+        offline_seconds = now - self._offline_since.get(streamer, now)
+        if offline_seconds < self.recently_live_seconds:
+            return self.live_interval
+
+        # The hour before a usual start counts as well, to catch it early.
+        usual_start_hours = self._usual_start_hours.get(streamer, set())
+        if (
+            hour_of_week(now) in usual_start_hours
+            or hour_of_week(now + HOUR_SECONDS) in usual_start_hours
+        ):
+            return self.live_interval
+
+        # Backs off by one live interval for every hour spent offline.
+        return min(
+            self.live_interval * (1 + offline_seconds / HOUR_SECONDS),
+            self.max_interval,
+        )
@@ -0,0 +1,206 @@
+import json
+import os
+import sqlite3
+import time
+from json import JSONDecodeError
+
+from loguru import logger
+
+from app.twitch_client import StreamInformation
+
+
+# Keeps the streams in SQLite, writing only the ones that changed since the
+# last flush in a single transaction, so a crash never leaves half a state.
+# Finalized streams are evicted once the retention window has passed.
+class StateStore:
+    def __init__(
+        self, path: str | None = None, retention_seconds: float | None = None
+    ):
+        self._db = sqlite3.connect(
+            path or os.environ.get("STATE_DB_PATH", "state.db")
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS streams (
+                id TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                finalized_at REAL
+            )
+            """
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS streams_finalized_at "
+            "ON streams (finalized_at)"
+        )
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS users (
+                login TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                fetched_at REAL NOT NULL
+            )
+            """
+        )
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS vod_lookups (
+                stream_id TEXT PRIMARY KEY,
+                user_id TEXT NOT NULL,
+                attempts INTEGER NOT NULL,
+                due_at REAL NOT NULL
+            )
+            """
+        )
+        self._db.commit()
+        self.retention_seconds = retention_seconds or float(
+            os.environ.get("STATE_RETENTION_SECONDS", 7 * 24 * 3600)
+        )
+        self._changed: dict[str, StreamInformation] = dict()
+        self._finalized: dict[str, float | None] = dict()
+
+    def load(self) -> dict[str, StreamInformation]:
+        return {
+            stream_id: StreamInformation(**json.loads(data))
+            for stream_id, data in self._db.execute(
+                "SELECT id, data FROM streams"
+            )
+        }
+
+    def load_live(self) -> dict[str, StreamInformation]:
+        # Streams that were not finalized before the last shutdown or crash.
+        return {
+            stream_id: StreamInformation(**json.loads(data))
+            for stream_id, data in self._db.execute(
+                "SELECT id, data FROM streams WHERE finalized_at IS NULL"
+            )
+        }
+
+    def import_snapshot(self, path: str) -> None:
+        # Moves streams over from the streams.json snapshot older versions
+        # wrote. Which of them had ended is unknown, so all are finalized
+        # and only used to recognize a stream that is still going.
+        try:
+            with open(path, "r") as file:
+                saved_streams = json.load(file)
+        except FileNotFoundError:
+            return
+        except JSONDecodeError:
+            logger.warning(f"Could not read {path}, not importing it.")
+            return
+
+        for saved_stream in saved_streams.values():
+            stream = StreamInformation(**saved_stream)
+            self.put(stream)
+            self.mark_finalized(stream_id=stream.id)
+        self.flush()
+        os.replace(path, f"{path}.imported")
+        logger.info(f"Imported {len(saved_streams)} streams from {path}.")
+
+    def load_users(self) -> list[tuple[dict, float]]:
+        return [
+            (json.loads(data), fetched_at)
+            for data, fetched_at in self._db.execute(
+                "SELECT data, fetched_at FROM users ORDER BY fetched_at"
+            )
+        ]
+
+    def save_users(self, users: list[tuple[dict, float]]) -> None:
+        with self._db:
+            self._db.executemany(
+                "INSERT INTO users (login, data, fetched_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (login) DO UPDATE SET "
+                "data = excluded.data, fetched_at = excluded.fetched_at",
+                [
+                    (user["login"], json.dumps(user), fetched_at)
+                    for user, fetched_at in users
+                ],
+            )
+
+    def delete_users(self, logins: list[str]) -> None:
+        with self._db:
+            self._db.executemany(
+                "DELETE FROM users WHERE login = ?",
+                [(login,) for login in logins],
+            )
+
+    def load_vod_lookups(self) -> list[tuple[str, str, int, float]]:
+        return self._db.execute(
+            "SELECT stream_id, user_id, attempts, due_at FROM vod_lookups"
+        ).fetchall()
+
+    def save_vod_lookup(
+        self, stream_id: str, user_id: str, attempts: int, due_at: float
+    ) -> None:
+        with self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO vod_lookups VALUES (?, ?, ?, ?)",
+                (stream_id, user_id, attempts, due_at),
+            )
+
+    def delete_vod_lookup(self, stream_id: str) -> None:
+        with self._db:
+            self._db.execute(
+                "DELETE FROM vod_lookups WHERE stream_id = ?", (stream_id,)
+            )
+
+    def put(self, stream: StreamInformation) -> None:
+        self._changed[stream.id] = stream
+
+    def mark_finalized(self, stream_id: str) -> None:
+        self._finalized[stream_id] = time.time()
+
+    def mark_live(self, stream_id: str) -> None:
+        # Takes back the finalized mark of a stream that turned out to go on.
+        self._finalized[stream_id] = None
+
+    def flush(self) -> int:
+        if not self._changed and not self._finalized:
+            return 0
+
+        with self._db:
+            self._db.executemany(
+                "INSERT INTO streams (id, data) VALUES (?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET data = excluded.data",
+                [
+                    (stream_id, json.dumps(stream.as_dict()))
+                    for stream_id, stream in self._changed.items()
+                ],
+            )
+            self._db.executemany(
+                "UPDATE streams SET finalized_at = ? WHERE id = ?",
+                [
+                    (finalized_at, stream_id)
+                    for stream_id, finalized_at in self._finalized.items()
+                ],
+            )
+        written = len(self._changed) + len(self._finalized)
+        self._changed.clear()
+        self._finalized.clear()
+        return written
+
+    def evict(self) -> list[str]:
+        cutoff = time.time() - self.retention_seconds
+        with self._db:
+            evicted = [
+                row[0]
+                for row in self._db.execute(
+                    "SELECT id FROM streams WHERE finalized_at < ?", (cutoff,)
+                )
+            ]
+            self._db.execute(
+                "DELETE FROM streams WHERE finalized_at < ?", (cutoff,)
+            )
+        if evicted:
+            logger.info(f"Evicted {len(evicted)} finalized streams.")
+        return evicted
+
+    def compact(self) -> None:
+        # Folds the write-ahead log back into the database file and shrinks it.
+        self._db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self._db.execute("VACUUM")
+
+    def close(self) -> None:
+        self.flush()
+        self._db.close()
@@ -0,0 +1,241 @@
+import json
+import re
+from dataclasses import dataclass
+
+from app.twitch_client import StreamInformation
+from app.viewer_history import ViewerSummary
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    # Without orjson, the standard library serializes a little slower.
+    orjson = None
+
+# Discord allows at most 10 embeds per message.
+MAX_EMBEDS = 10
+
+
+def format_duration(seconds: float) -> str:
+    hours, minutes = divmod(round(seconds / 60), 60)
+    return f"{hours}h {minutes}m" if hours else f"{minutes}m"
+
+
+def dumps(value) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+# Marks where a template is filled in.
+@dataclass(frozen=True)
+class Slot:
+    name: str
+
+
+SLOT_PATTERN = re.compile(r'"\\u0000(\w+)\\u0000"')
+
+
+# A message skeleton serialized once, with the slots cut out. Rendering only
+# serializes the values of the slots and joins them with the static parts.
+# Values that are bytes are inserted as they are, to nest rendered templates.
+class Template:
+    def __init__(self, skeleton: dict):
+        text = json.dumps(
+            skeleton,
+            separators=(",", ":"),
+            ensure_ascii=False,
+            default=lambda slot: f"\0{slot.name}\0",
+        )
+        pieces = SLOT_PATTERN.split(text)
+        self._parts = [piece.encode() for piece in pieces[::2]]
+        self._slots = pieces[1::2]
+
+    def render(self, **values) -> bytes:
+        chunks = [self._parts[0]]
+        for slot, part in zip(self._slots, self._parts[1:]):
+            value = values[slot]
+            chunks.append(value if isinstance(value, bytes) else dumps(value))
+            chunks.append(part)
+        return b"".join(chunks)
+
+
+# Values of the kind each text is formatted with, to check the texts when the
+# config is loaded instead of when the first message is sent.
+CONTENT_VALUES = {
+    "live_content": dict.fromkeys(
+        ("user_name", "user_login", "title", "game_name"), "text"
+    ),
+    "offline_content": dict.fromkeys(("user_name", "vod_url"), "text"),
+    "stats_content": {
+        "peak_viewers": 1,
+        "average_viewers": 1,
+        "duration": "1m",
+    },
+    "digest_content": dict.fromkeys(("group", "user_names"), "text"),
+    "digest_offline_content": {"group": "text"},
+}
+
+
+@dataclass(frozen=True)
+class MessageStyle:
+    username: str = "Oak Tree"
+    avatar_url: str = "https://i.imgur.com/DBOuwjx.png"
+    color: int = 8388863
+    mention: str = "@everyone"
+    live_content: str = "{user_name} went live!"
+    offline_content: str = (
+        "{user_name} stopped the stream. Check out the VOD!\n{vod_url}"
+    )
+    stats_content: str = (
+        "Peaked at {peak_viewers} viewers with {average_viewers} on average "
+        "over {duration}."
+    )
+    digest_content: str = "{group} is live with {user_names}!"
+    digest_offline_content: str = "{group} stopped streaming."
+
+    def __post_init__(self):
+        for name, values in CONTENT_VALUES.items():
+            try:
+                getattr(self, name).format(**values)
+            except (AttributeError, IndexError, KeyError, ValueError) as err:
+                raise ValueError(
+                    f"message.{name} can not be filled in: {err!r}"
+                ) from err
+
+
+# Renders every message sent to Discord from templates built once per style,
+# shared by all streamers and webhooks.
+class MessageTemplates:
+    def __init__(self, style: MessageStyle | None = None):
+        self.style = style or MessageStyle()
+        self._embed = Template(
+            {
+                "title": Slot("title"),
+                "color": self.style.color,
+                "timestamp": Slot("started_at"),
+                "url": Slot("url"),
+                "author": {
+                    "name": Slot("user_name"),
+                    "url": Slot("url"),
+                    "icon_url": Slot("profile_image"),
+                },
+                "image": {"url": Slot("thumbnail_url")},
+                "fields": [
+                    {
+                        "name": "Game",
+                        "value": Slot("game_name"),
+                        "inline": True,
+                    },
+                    {
+                        "name": "Viewers",
+                        "value": Slot("viewer_count"),
+                        "inline": True,
+                    },
+                ],
+            }
+        )
+        self._message = Template(
+            {
+                "username": self.style.username,
+                "avatar_url": self.style.avatar_url,
+                "content": Slot("content"),
+                "embeds": Slot("embeds"),
+            }
+        )
+        self._embeds_only = Template({"embeds": Slot("embeds")})
+
+    def _content(self, template: str, mention: bool, **values) -> str:
+        content = template.format(**values)
+        if mention and self.style.mention:
+            return f"{self.style.mention} {content}"
+        return content
+
+    def embed(
+        self, stream: StreamInformation, profile_image: str | None
+    ) -> bytes:
+        return self._embed.render(
+            title=stream.title,
+            started_at=stream.started_at,
+            url=f"https://www.twitch.tv/{stream.user_login}",
+            user_name=stream.user_name,
+            profile_image=profile_image,
+            thumbnail_url=stream.thumbnail_url,
+            game_name=stream.game_name,
+            viewer_count=stream.viewer_count,
+        )
+
+    def live_message(
+        self, stream: StreamInformation, profile_image: str | None
+    ) -> bytes:
+        return self._message.render(
+            content=self._content(
+                self.style.live_content,
+                mention=True,
+                user_name=stream.user_name,
+                user_login=stream.user_login,
+                title=stream.title,
+                game_name=stream.game_name,
+            ),
+            embeds=b"[" + self.embed(stream, profile_image) + b"]",
+        )
+
+    def update_message(
+        self, stream: StreamInformation, profile_image: str | None
+    ) -> bytes:
+        return self._embeds_only.render(
+            embeds=b"[" + self.embed(stream, profile_image) + b"]"
+        )
+
+    def finalized_message(
+        self,
+        user_name: str,
+        vod_url: str | None,
+        summary: ViewerSummary | None = None,
+    ) -> bytes:
+        content = self._content(
+            self.style.offline_content,
+            mention=False,
+            user_name=user_name,
+            vod_url=vod_url or "None available.",
+        )
+        if summary and self.style.stats_content:
+            stats = self.style.stats_content.format(
+                peak_viewers=summary.peak,
+                average_viewers=summary.average,
+                duration=format_duration(summary.duration_seconds),
+            )
+            content = f"{content}\n{stats}"
+        return self._message.render(content=content, embeds=b"[]")
+
+    def digest_message(
+        self,
+        group: str,
+        streams: list[tuple[StreamInformation, str | None]],
+        mention: bool = False,
+    ) -> bytes:
+        # Shows the members with the most viewers first.
+        streams = sorted(
+            streams, key=lambda entry: entry[0].viewer_count, reverse=True
+        )[:MAX_EMBEDS]
+        return self._message.render(
+            content=self._content(
+                self.style.digest_content,
+                mention=mention,
+                group=group,
+                user_names=", ".join(stream.user_name for stream, _ in streams),
+            ),
+            embeds=b"["
+            + b",".join(
+                self.embed(stream, profile_image)
+                for stream, profile_image in streams
+            )
+            + b"]",
+        )
+
+    def finalized_digest_message(self, group: str) -> bytes:
+        return self._message.render(
+            content=self._content(
+                self.style.digest_offline_content, mention=False, group=group
+            ),
+            embeds=b"[]",
+        )
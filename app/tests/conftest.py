@@ -3,6 +3,8 @@ from unittest import mock
 
 import pytest
 
+from app.twitch_client import StreamInformation
+
 
 @pytest.fixture
 def mock_loggers():
@@ -15,3 +17,33 @@ def mock_loggers():
             "mocked_loggers", ["info_logger", "warning_logger", "error_logger"]
         )
         yield mocked_loggers(info_logger, warning_logger, error_logger)
+
+
+@pytest.fixture
+def create_stream():
+    # Builds the stream of a streamer, with only the fields a test cares
+    # about given.
+    def create(login: str = "streamer", **fields) -> StreamInformation:
+        return StreamInformation(
+            **{
+                "id": f"{login}_stream",
+                "user_id": f"{login}_id",
+                "user_name": login.title(),
+                "user_login": login,
+                "title": "title",
+                "game_name": "game",
+                "viewer_count": 100,
+                "started_at": "2021-03-10T15:04:21Z",
+                "_thumbnail_url": "thumbnail",
+                **fields,
+            }
+        )
+
+    return create
+
+
+@pytest.fixture(autouse=True)
+def working_directory(tmp_path, monkeypatch):
+    # Keeps token caches and saved streams of one test away from the others.
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
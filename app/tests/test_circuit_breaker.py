@@ -0,0 +1,71 @@
+import time
+
+import pytest
+import requests_mock
+from requests import exceptions
+
+from app import metrics
+from app.circuit_breaker import CircuitBreakers, CircuitOpenError
+from app.transport import Transport
+
+STREAMS_URL = "https://api.twitch.tv/helix/streams"
+LABELS = {"upstream": "api.twitch.tv", "endpoint": "helix/streams"}
+
+
+def test_circuit_opens_and_fails_fast(mock_loggers):
+    transport = Transport(
+        circuit_breakers=CircuitBreakers(failure_threshold=2, reset_seconds=60)
+    )
+
+    with requests_mock.Mocker() as requests_mocker:
+        requests_mocker.get(STREAMS_URL, exc=exceptions.ConnectTimeout)
+        requests_mocker.get("https://api.twitch.tv/helix/users", json={})
+        for _ in range(2):
+            with pytest.raises(exceptions.ConnectTimeout):
+                transport.get(STREAMS_URL)
+
+        with pytest.raises(CircuitOpenError) as error:
+            transport.get(STREAMS_URL)
+        # Other endpoints have their own circuit
+        transport.get("https://api.twitch.tv/helix/users")
+
+    assert len(requests_mocker.request_history) == 3
+    assert isinstance(error.value, exceptions.ConnectionError)
+    assert 0 < error.value.retry_after <= 60
+    assert transport.circuit_breakers.retry_in(STREAMS_URL) > 0
+    assert transport.circuit_breakers.states() == {
+        "api.twitch.tv/helix/streams": "open",
+        "api.twitch.tv/helix/users": "closed",
+    }
+    assert metrics.CIRCUIT_STATE.value(**LABELS) == 2
+
+
+def test_half_open_circuit_lets_one_probe_through(mock_loggers):
+    breakers = CircuitBreakers(failure_threshold=1, reset_seconds=0.05)
+    transport = Transport(circuit_breakers=breakers)
+    breaker = breakers.get(STREAMS_URL)
+
+    with requests_mock.Mocker() as requests_mocker:
+        requests_mocker.get(
+            STREAMS_URL,
+            [{"status_code": 503}, {"json": {}}],
+        )
+        transport.get(STREAMS_URL)
+        assert breaker.state == "open"
+
+        time.sleep(0.06)
+        # The failed probe opens the circuit again
+        breaker.before_call()
+        assert breaker.state == "half_open"
+        with pytest.raises(CircuitOpenError):
+            transport.get(STREAMS_URL)
+        breaker.record_failure()
+        assert breaker.state == "open"
+
+        time.sleep(0.06)
+        transport.get(STREAMS_URL)
+
+    assert breaker.state == "closed"
+    assert breakers.retry_in(STREAMS_URL) == 0
+    assert len(requests_mocker.request_history) == 2
+    assert metrics.CIRCUIT_STATE.value(**LABELS) == 0
@@ -0,0 +1,114 @@
+import os
+from unittest import mock
+
+import pytest
+
+from app.config import (
+    Config,
+    ConfigDiff,
+    ConfigWatcher,
+    Group,
+    diff_config,
+    load_config,
+)
+
+
+def test_config_combines_environment_and_file(mock_loggers):
+    with open("config.toml", "w") as file:
+        file.write(
+            """
+            [streamers.Other_Streamer]
+            webhooks = ["https://first", "https://second"]
+
+            [streamers.third_streamer]
+            """
+        )
+
+    with mock.patch.dict(
+        os.environ,
+        {
+            "STREAMER_NAME": "streamer_name",
+            "DISCORD_WEBHOOK_URL": "https://url",
+        },
+    ):
+        config = load_config()
+
+    assert config.streamers == [
+        "streamer_name",
+        "other_streamer",
+        "third_streamer",
+    ]
+    assert config.targets("streamer_name") == ["https://url"]
+    assert config.targets("other_streamer") == [
+        "https://first",
+        "https://second",
+    ]
+    assert config.targets("third_streamer") == ["https://url"]
+
+
+def test_config_warns_about_streamers_without_webhooks(mock_loggers):
+    with mock.patch.dict(
+        os.environ, {"STREAMER_NAME": "streamer_name"}, clear=True
+    ):
+        config = load_config()
+
+    assert config.targets("streamer_name") == []
+    assert mock_loggers.warning_logger.call_args.args[0] == (
+        "streamer_name has no webhook to be announced on."
+    )
+
+
+def test_config_rejects_texts_that_can_not_be_filled_in(mock_loggers):
+    with open("config.toml", "w") as file:
+        file.write(
+            """
+            [message]
+            live_content = "{username} is live!"
+            """
+        )
+
+    with pytest.raises(ValueError, match="message.live_content"):
+        load_config()
+
+
+def test_config_diff_holds_only_changes():
+    old_config = Config(
+        webhooks={"kept": ["https://a", "https://b"], "removed": ["https://a"]},
+        groups={
+            "team": Group(members=["kept"], webhooks=["https://team"]),
+            "old_team": Group(members=["kept"], webhooks=[]),
+        },
+    )
+    new_config = Config(
+        webhooks={"kept": ["https://b", "https://c"], "added": ["https://a"]},
+        groups={
+            "team": Group(members=["kept", "added"], webhooks=["https://new"]),
+            "new_team": Group(members=["added"], webhooks=[]),
+        },
+    )
+
+    assert diff_config(old_config, new_config) == ConfigDiff(
+        added_streamers=["added"],
+        removed_streamers=["removed"],
+        added_targets={"kept": ["https://c"]},
+        removed_targets={"kept": ["https://a"]},
+        added_groups=["new_team"],
+        removed_groups=["old_team"],
+        changed_groups=["team"],
+        added_group_targets={"team": ["https://new"]},
+        removed_group_targets={"team": ["https://team"]},
+    )
+    assert diff_config(new_config, new_config) == ConfigDiff()
+
+
+def test_config_watcher_notices_changes():
+    watcher = ConfigWatcher(path="config.toml")
+    assert not watcher.changed()
+
+    with open("config.toml", "w") as file:
+        file.write("[streamers.streamer_name]\n")
+    assert watcher.changed()
+    assert not watcher.changed()
+
+    os.remove("config.toml")
+    assert watcher.changed()
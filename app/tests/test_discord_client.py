@@ -1,20 +1,15 @@
 import json
-import os
 from typing import Any
-from unittest import mock
 
 import pytest
 import requests_mock
+from requests import HTTPError
 
 from app.discord_client import DiscordClient
+from app.templates import MessageTemplates
 from app.twitch_client import StreamInformation
 
 
-def test_require_webhook_url():
-    with pytest.raises(KeyError):
-        DiscordClient()
-
-
 def test_send_information_to_discord(mock_loggers):
     stream = StreamInformation(
         id="0",
@@ -28,17 +23,15 @@ def test_send_information_to_discord(mock_loggers):
         _thumbnail_url="https://thumbnail.com/{width}-{height}.png",
     )
 
-    with (
-        mock.patch.dict(
-            os.environ, {"DISCORD_WEBHOOK_URL": "https://test/url"}
-        ),
-        requests_mock.Mocker() as requests_mocker,
-    ):
+    with requests_mock.Mocker() as requests_mocker:
         requests_mocker.post(url="https://test/url", json={"id": "0"})
 
         discord_client = DiscordClient()
         discord_client.send_information_to_discord(
-            stream=stream, profile_image="profile_image.png"
+            webhook_url="https://test/url",
+            message=MessageTemplates().live_message(
+                stream=stream, profile_image="profile_image.png"
+            ),
         )
 
     webhook_call = requests_mocker.request_history[0]
@@ -68,22 +61,19 @@ def test_send_information_to_discord_fails(mock_loggers):
         _thumbnail_url="",
     )
 
-    with (
-        mock.patch.dict(os.environ, {"DISCORD_WEBHOOK_URL": "https://test"}),
-        requests_mock.Mocker() as requests_mocker,
-    ):
+    with requests_mock.Mocker() as requests_mocker:
         requests_mocker.post(url="https://test", status_code=400)
 
         discord_client = DiscordClient()
-        discord_client.send_information_to_discord(
-            stream=stream, profile_image="", retry_count=6
-        )
+        with pytest.raises(HTTPError):
+            discord_client.send_information_to_discord(
+                webhook_url="https://test",
+                message=MessageTemplates().live_message(
+                    stream=stream, profile_image=""
+                ),
+            )
 
     assert len(mock_loggers.info_logger.call_args_list) == 1
     assert mock_loggers.info_logger.call_args.args[0] == (
         "Sending a message with an embed to the webhook..."
     )
-    assert len(mock_loggers.warning_logger.call_args_list) == 1
-    assert mock_loggers.warning_logger.call_args.args[0] == (
-        "Aborted sending the embed to Discord."
-    )
@@ -0,0 +1,60 @@
+from dataclasses import replace
+
+from app.embed_cache import EmbedDiffCache, round_significant
+from app.twitch_client import StreamInformation
+
+STREAM = StreamInformation(
+    id="0",
+    user_id="0",
+    user_name="Test",
+    user_login="test",
+    game_name="game",
+    started_at="never",
+    title="title",
+    viewer_count=78365,
+    _thumbnail_url="https://thumbnail.com/{width}-{height}.png?0",
+)
+
+
+def test_round_significant():
+    assert round_significant(0, 2) == 0
+    assert round_significant(7, 2) == 7
+    assert round_significant(123, 2) == 120
+    assert round_significant(78365, 2) == 78000
+    assert round_significant(78365, 3) == 78400
+
+
+def test_embed_cache_skips_unchanged_embeds():
+    embed_cache = EmbedDiffCache(viewer_count_digits=2)
+
+    assert embed_cache.has_changed(key="0", stream=STREAM, profile_image="")
+    assert not embed_cache.has_changed(
+        key="0", stream=replace(STREAM, viewer_count=78100), profile_image=""
+    )
+    assert embed_cache.has_changed(
+        key="0", stream=replace(STREAM, viewer_count=79000), profile_image=""
+    )
+    assert embed_cache.has_changed(
+        key="0",
+        stream=replace(STREAM, viewer_count=79000, title="new title"),
+        profile_image="",
+    )
+    assert embed_cache.has_changed(
+        key="0",
+        stream=replace(
+            STREAM,
+            viewer_count=79000,
+            title="new title",
+            _thumbnail_url="https://thumbnail.com/{width}-{height}.png?1",
+        ),
+        profile_image="",
+    )
+
+
+def test_embed_cache_forget():
+    embed_cache = EmbedDiffCache(viewer_count_digits=2)
+    embed_cache.has_changed(key="0", stream=STREAM, profile_image="")
+
+    embed_cache.forget(key="0")
+
+    assert embed_cache.has_changed(key="0", stream=STREAM, profile_image="")
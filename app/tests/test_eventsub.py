@@ -0,0 +1,293 @@
+import asyncio
+import json
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+import pytest
+import requests
+
+from app.eventsub import STREAM_OFFLINE, STREAM_ONLINE, EventSubServer, sign
+from app.main import Main
+
+SECRET = "eventsub_secret"
+
+
+@pytest.fixture
+def eventsub_server():
+    on_event = mock.Mock()
+    server = EventSubServer(
+        secret=SECRET, on_event=on_event, port=0, host="127.0.0.1"
+    )
+    server.start()
+    yield server
+    server.stop()
+
+
+def post_message(
+    server: EventSubServer,
+    message_type: str,
+    message: dict,
+    message_id: str = "message",
+    secret: str = SECRET,
+    sent_at: datetime | None = None,
+) -> requests.Response:
+    # Sends a message the way Twitch's EventSub webhook transport does.
+    body = json.dumps(message).encode()
+    timestamp = (sent_at or datetime.now(timezone.utc)).strftime(
+        "%Y-%m-%dT%H:%M:%S.%f123Z"
+    )
+    return requests.post(
+        f"http://127.0.0.1:{server.server_port}/",
+        data=body,
+        headers={
+            "Twitch-Eventsub-Message-Id": message_id,
+            "Twitch-Eventsub-Message-Timestamp": timestamp,
+            "Twitch-Eventsub-Message-Signature": sign(
+                secret, message_id, timestamp, body
+            ),
+            "Twitch-Eventsub-Message-Type": message_type,
+        },
+    )
+
+
+def online_notification(login: str) -> dict:
+    return {
+        "subscription": {"type": STREAM_ONLINE},
+        "event": {"broadcaster_user_login": login, "type": "live"},
+    }
+
+
+def test_eventsub_answers_verification_challenge(mock_loggers, eventsub_server):
+    response = post_message(
+        eventsub_server,
+        message_type="webhook_callback_verification",
+        message={
+            "subscription": {"type": STREAM_ONLINE},
+            "challenge": "challenge",
+        },
+    )
+
+    assert response.status_code == 200
+    assert response.text == "challenge"
+
+
+def test_eventsub_passes_on_notifications_once(mock_loggers, eventsub_server):
+    for _ in range(2):
+        response = post_message(
+            eventsub_server,
+            message_type="notification",
+            message=online_notification("streamer_name"),
+        )
+        assert response.status_code == 204
+
+    eventsub_server.on_event.assert_called_once_with(
+        STREAM_ONLINE,
+        {"broadcaster_user_login": "streamer_name", "type": "live"},
+    )
+
+
+def test_eventsub_rejects_bad_signatures(mock_loggers, eventsub_server):
+    response = post_message(
+        eventsub_server,
+        message_type="notification",
+        message=online_notification("streamer_name"),
+        secret="wrong_secret",
+    )
+
+    assert response.status_code == 403
+    eventsub_server.on_event.assert_not_called()
+
+
+def test_eventsub_rejects_old_messages(mock_loggers, eventsub_server):
+    response = post_message(
+        eventsub_server,
+        message_type="notification",
+        message=online_notification("streamer_name"),
+        sent_at=datetime.now(timezone.utc) - timedelta(minutes=11),
+    )
+
+    assert response.status_code == 403
+    eventsub_server.on_event.assert_not_called()
+
+
+@pytest.fixture
+def eventsub_environment():
+    with mock.patch.dict(
+        os.environ,
+        {
+            "STREAMER_NAME": "streamer_name",
+            "DISCORD_WEBHOOK_URL": "URL",
+            "TWITCH_CLIENT_ID": "id",
+            "TWITCH_CLIENT_SECRET": "secret",
+            "EVENTSUB_CALLBACK_URL": "https://callback",
+            "EVENTSUB_SECRET": SECRET,
+        },
+    ):
+        yield
+
+
+def test_main_polls_only_live_and_announced_streamers(
+    mock_loggers, eventsub_environment
+):
+    with mock.patch.dict(
+        os.environ, {"STREAMER_NAME": "streamer_name,other_streamer"}
+    ):
+        main = Main()
+    main.twitch_client = mock.AsyncMock()
+    main.twitch_client.get_users.return_value = {
+        login: {"id": f"{login}_id", "login": login}
+        for login in ("streamer_name", "other_streamer")
+    }
+    main.twitch_client.get_stream.side_effect = lambda streamers: dict.fromkeys(
+        streamers
+    )
+
+    async def run_ticks():
+        await main.subscribe_eventsub()
+        await main.update_status()
+        # Nobody is live, so there is nothing left to poll
+        await main.update_status()
+        main.on_eventsub_event(
+            STREAM_ONLINE, {"broadcaster_user_login": "streamer_name"}
+        )
+        await main.update_status()
+
+    asyncio.run(run_ticks())
+
+    assert main.twitch_client.get_stream.await_args_list == [
+        mock.call(streamers=["streamer_name", "other_streamer"]),
+        mock.call(streamers=["streamer_name"]),
+    ]
+    assert main.wake.is_set()
+
+
+def create_eventsub_main() -> Main:
+    main = Main()
+    main.outbox = mock.MagicMock()
+    main.twitch_client = mock.AsyncMock()
+    main.twitch_client.get_users.return_value = {
+        "streamer_name": {
+            "id": "streamer_id",
+            "login": "streamer_name",
+            "profile_image_url": "",
+        }
+    }
+    return main
+
+
+def test_main_ignores_streams_ended_by_eventsub(
+    mock_loggers, eventsub_environment, create_stream
+):
+    main = create_eventsub_main()
+    stream = create_stream("streamer_name", user_id="streamer_id")
+    main.twitch_client.get_stream.return_value = {"streamer_name": stream}
+
+    async def run_ticks():
+        await main.subscribe_eventsub()
+        await main.update_status()
+        main.on_eventsub_event(
+            STREAM_OFFLINE, {"broadcaster_user_login": "streamer_name"}
+        )
+        # A poll that went out before the event still lists the stream.
+        await main._poll_streamers(streamers=["streamer_name"], now=time.time())
+        await main.update_status()
+
+    asyncio.run(run_ticks())
+
+    assert [
+        method
+        for method, _, _ in main.outbox.method_calls
+        if method != "transaction"
+    ] == ["send", "end"]
+    assert main.twitch_client.get_stream.await_count == 2
+    assert "streamer_name" not in main.scheduler
+    assert not main.live_streams
+
+
+def test_main_polls_streamers_whose_subscription_was_revoked(
+    mock_loggers, eventsub_environment
+):
+    main = create_eventsub_main()
+    main.twitch_client.get_stream.side_effect = lambda streamers: dict.fromkeys(
+        streamers
+    )
+
+    async def revoke():
+        await main.subscribe_eventsub()
+        await main.update_status()
+        assert "streamer_name" not in main.scheduler
+
+        main.twitch_client.create_eventsub_subscription.side_effect = (
+            requests.ConnectionError
+        )
+        main.on_eventsub_revocation(
+            {
+                "type": STREAM_ONLINE,
+                "status": "notification_failures_exceeded",
+                "condition": {"broadcaster_user_id": "streamer_id"},
+            }
+        )
+        await asyncio.gather(*main._setup_tasks)
+        await main.update_status()
+
+    asyncio.run(revoke())
+
+    # Subscribing again failed, so they keep being polled.
+    assert main.twitch_client.create_eventsub_subscription.await_count == 4
+    assert main.twitch_client.get_stream.await_count == 2
+    assert "streamer_name" in main.scheduler
+
+
+def test_main_unsubscribes_removed_streamers(
+    mock_loggers, eventsub_environment
+):
+    with open("config.toml", "w") as file:
+        file.write(
+            """
+            [streamers.streamer_name]
+            webhooks = ["https://discord.com/api/webhooks/1/a"]
+            """
+        )
+    with mock.patch.dict(os.environ, {"STREAMER_NAME": ""}):
+        main = create_eventsub_main()
+
+    async def remove_streamer():
+        await main.subscribe_eventsub()
+        with open("config.toml", "w") as file:
+            file.write("[streamers]")
+        with mock.patch.dict(os.environ, {"STREAMER_NAME": ""}):
+            main.reload_config()
+        await asyncio.gather(*main._setup_tasks)
+        # Twitch may still send events of the deleted subscriptions.
+        main.on_eventsub_event(
+            STREAM_ONLINE, {"broadcaster_user_login": "streamer_name"}
+        )
+
+    asyncio.run(remove_streamer())
+
+    main.twitch_client.delete_eventsub_subscriptions.assert_awaited_once_with(
+        broadcaster_user_id="streamer_id", callback_url="https://callback"
+    )
+    assert "streamer_name" not in main.scheduler
+    assert not main._announced_streamers
+    assert not main.wake.is_set()
+
+
+def test_eventsub_passes_on_revocations(mock_loggers, eventsub_server):
+    eventsub_server.on_revocation = mock.Mock()
+    subscription = {
+        "type": STREAM_ONLINE,
+        "status": "authorization_revoked",
+        "condition": {"broadcaster_user_id": "streamer_id"},
+    }
+
+    response = post_message(
+        eventsub_server,
+        message_type="revocation",
+        message={"subscription": subscription},
+    )
+
+    assert response.status_code == 204
+    eventsub_server.on_revocation.assert_called_once_with(subscription)
@@ -1,11 +1,17 @@
+import asyncio
+import json
 import os
+import signal
 import threading
+import time
 from unittest import mock
 
 import pytest
 import requests_mock
 
-from app.main import Main, entry
+from app.main import DaemonThreadExecutor, Main, entry
+from app.state_store import StateStore
+from app.viewer_history import ViewerHistory
 
 
 def test_create_main(mock_loggers):
@@ -23,19 +29,31 @@ def test_create_main(mock_loggers):
     ):
         # We authorize
         requests_mocker.post(
-            "https://id.twitch.tv/oauth2/token", json={"access_token": "token"}
+            "https://id.twitch.tv/oauth2/token",
+            json={"access_token": "token", "expires_in": 3600},
         )
         # We cache the profile image URL of the streamer
         requests_mocker.get(
             "https://api.twitch.tv/helix/users?login=streamer_name",
-            json={"data": [{"profile_image_url": "image"}]},
+            json={
+                "data": [
+                    {"login": "streamer_name", "profile_image_url": "image"}
+                ]
+            },
         )
 
         main = Main()
+        assert "streamer_name" not in main.user_cache
+
+        async def set_up():
+            await main.setup()
+            await main.interrupt()
+
+        asyncio.run(set_up())
 
     assert main.discord_client
     assert main.twitch_client
-    assert main.profile_image == "image"
+    assert main.user_cache.profile_image("streamer_name") == "image"
 
 
 def test_run_main_one_iteration(mock_loggers):
@@ -58,11 +76,16 @@ def test_run_main_one_iteration(mock_loggers):
         requests_mock.Mocker() as requests_mocker,
     ):
         requests_mocker.post(
-            "https://id.twitch.tv/oauth2/token", json={"access_token": "token"}
+            "https://id.twitch.tv/oauth2/token",
+            json={"access_token": "token", "expires_in": 3600},
         )
         requests_mocker.get(
             "https://api.twitch.tv/helix/users?login=streamer_name",
-            json={"data": [{"profile_image_url": "image"}]},
+            json={
+                "data": [
+                    {"login": "streamer_name", "profile_image_url": "image"}
+                ]
+            },
         )
         requests_mocker.get(
             "https://api.twitch.tv/helix/streams?user_login=streamer_name",
@@ -100,39 +123,45 @@ def test_run_main_streamer_already_live(mock_loggers):
         requests_mock.Mocker() as requests_mocker,
     ):
         requests_mocker.post(
-            "https://id.twitch.tv/oauth2/token", json={"access_token": "token"}
+            "https://id.twitch.tv/oauth2/token",
+            json={"access_token": "token", "expires_in": 3600},
         )
         requests_mocker.get(
             "https://api.twitch.tv/helix/users?login=streamer_name",
-            json={"data": [{"profile_image_url": "image"}]},
-        )
-        requests_mocker.get(
-            "https://api.twitch.tv/helix/streams?user_login=streamer_name",
             json={
                 "data": [
-                    {
-                        "id": "123456789",
-                        "user_id": "98765",
-                        "user_login": "streamer_name",
-                        "user_name": "Streamer_Name",
-                        "game_id": "494131",
-                        "game_name": "Little Nightmares",
-                        "type": "live",
-                        "title": "hablamos y le damos a Little Nightmares 1",
-                        "tags": ["Español"],
-                        "viewer_count": 78365,
-                        "started_at": "2021-03-10T15:04:21Z",
-                        "language": "es",
-                        "thumbnail_url": (
-                            "https://static-cdn.jtvnw.net/previews-ttv/"
-                            "live_user_auronplay-{width}x{height}.jpg"
-                        ),
-                        "tag_ids": [],
-                        "is_mature": False,
-                    }
+                    {"login": "streamer_name", "profile_image_url": "image"}
                 ]
             },
         )
+        stream_data = {
+            "id": "123456789",
+            "user_id": "98765",
+            "user_login": "streamer_name",
+            "user_name": "Streamer_Name",
+            "game_id": "494131",
+            "game_name": "Little Nightmares",
+            "type": "live",
+            "title": "hablamos y le damos a Little Nightmares 1",
+            "tags": ["Español"],
+            "viewer_count": 78365,
+            "started_at": "2021-03-10T15:04:21Z",
+            "language": "es",
+            "thumbnail_url": (
+                "https://static-cdn.jtvnw.net/previews-ttv/"
+                "live_user_auronplay-{width}x{height}.jpg"
+            ),
+            "tag_ids": [],
+            "is_mature": False,
+        }
+        requests_mocker.get(
+            "https://api.twitch.tv/helix/streams?user_login=streamer_name",
+            [
+                {"json": {"data": [stream_data]}},
+                # Viewers changed, so the second loop updates the embed
+                {"json": {"data": [{**stream_data, "viewer_count": 95000}]}},
+            ],
+        )
         requests_mocker.post(
             "https://discord.com/webhook?wait=true", json={"id": "123456"}
         )
@@ -170,7 +199,7 @@ def test_run_main_streamer_already_live(mock_loggers):
     assert get_streams_request.scheme == "https"
     assert get_streams_request.netloc == "api.twitch.tv"
     assert get_streams_request.path == "/helix/streams"
-    assert get_streams_request.query == "user_login=streamer_name"
+    assert get_streams_request.query == "user_login=streamer_name&first=100"
 
     create_notification_request = requests_mocker.request_history[3]
     assert create_notification_request.query == "wait=true"
@@ -181,20 +210,388 @@ def test_run_main_streamer_already_live(mock_loggers):
     assert second_loop_get_streams_request.scheme == "https"
     assert second_loop_get_streams_request.netloc == "api.twitch.tv"
     assert second_loop_get_streams_request.path == "/helix/streams"
-    assert second_loop_get_streams_request.query == "user_login=streamer_name"
+    assert second_loop_get_streams_request.query == (
+        "user_login=streamer_name&first=100"
+    )
 
     update_notification_request = requests_mocker.request_history[5]
     assert update_notification_request.path == "/webhook/messages/123456"
     assert update_notification_request.json()
 
-    get_vod_request = requests_mocker.request_history[-2]
-    assert get_vod_request.scheme == "https"
-    assert get_vod_request.netloc == "api.twitch.tv"
-    assert get_vod_request.path == "/helix/videos"
-    assert get_vod_request.query == "user_id=98765"
-
     finalize_notification_request = requests_mocker.request_history[-1]
     assert finalize_notification_request.path == "/webhook/messages/123456"
-    assert finalize_notification_request.json()
+    assert finalize_notification_request.json()["embeds"] == []
+    assert "Peaked at 95000 viewers" in (
+        finalize_notification_request.json()["content"]
+    )
+    # Viewers are kept for the final message once the VOD is found, later
+    # loops may have polled again
+    assert ViewerHistory().samples("123456789")[:2] == [78365, 95000]
+
+    state_store = StateStore(path="state.db")
+    saved_streams = state_store.load()
+    assert saved_streams["123456789"].discord_message_id == "123456"
+    # The VOD is looked up again after the next start
+    assert [lookup[:2] for lookup in state_store.load_vod_lookups()] == [
+        ("123456789", "98765")
+    ]
+
+
+def test_main_resumes_live_stream_after_crash(mock_loggers, create_stream):
+    stream = create_stream(
+        "streamer_name",
+        id="123456789",
+        user_id="98765",
+        discord_message_id="123456",
+    )
+    state_store = StateStore(path="state.db")
+    state_store.put(stream)
+    state_store.save_users(
+        [
+            (
+                {"login": "streamer_name", "profile_image_url": "image"},
+                time.time(),
+            )
+        ]
+    )
+    state_store.close()
+
+    with (
+        mock.patch.dict(
+            os.environ,
+            {
+                "STREAMER_NAME": "streamer_name",
+                "DISCORD_WEBHOOK_URL": "https://discord.com/webhook",
+                "TWITCH_CLIENT_ID": "id",
+                "TWITCH_CLIENT_SECRET": "secret",
+            },
+        ),
+        requests_mock.Mocker() as requests_mocker,
+    ):
+        main = Main()
+        # Nothing but local state is read before the first poll
+        assert not requests_mocker.request_history
+
+    assert main.live_streams == {"streamer_name": "123456789"}
+    assert main.user_cache.profile_image("streamer_name") == "image"
+
+    main.twitch_client = mock.AsyncMock()
+    main.twitch_client.get_stream.return_value = {"streamer_name": stream}
+    main.outbox = mock.MagicMock()
+
+    asyncio.run(main.update_status())
+
+    main.outbox.send.assert_not_called()
+    main.outbox.update.assert_called_once_with(
+        stream=stream,
+        profile_image="image",
+        targets=["https://discord.com/webhook"],
+    )
+
+
+def test_main_imports_legacy_snapshot(mock_loggers):
+    with open("streams.json", "w") as file:
+        json.dump(
+            {
+                "123456789": {
+                    "id": "123456789",
+                    "user_id": "98765",
+                    "user_name": "Streamer_Name",
+                    "user_login": "streamer_name",
+                    "title": "title",
+                    "game_name": "game",
+                    "viewer_count": 100,
+                    "started_at": "2021-03-10T15:04:21Z",
+                    "_thumbnail_url": "thumbnail",
+                    "discord_message_id": "123456",
+                }
+            },
+            file,
+        )
+
+    with mock.patch.dict(
+        os.environ,
+        {
+            "STREAMER_NAME": "streamer_name",
+            "DISCORD_WEBHOOK_URL": "URL",
+            "TWITCH_CLIENT_ID": "id",
+            "TWITCH_CLIENT_SECRET": "secret",
+        },
+    ):
+        main = Main()
+
+    assert main.streams["123456789"].discord_message_id == "123456"
+    assert not os.path.exists("streams.json")
+
+
+def test_main_keeps_one_digest_per_group(mock_loggers, create_stream):
+    with open("config.toml", "w") as file:
+        file.write(
+            """
+            [groups.team]
+            members = ["first", "second"]
+            webhooks = ["https://discord.com/team"]
+            """
+        )
+
+    with mock.patch.dict(
+        os.environ,
+        {"TWITCH_CLIENT_ID": "id", "TWITCH_CLIENT_SECRET": "secret"},
+    ):
+        main = Main()
+    main.twitch_client = mock.AsyncMock()
+    main.outbox = mock.MagicMock()
+
+    for streamer, stream in [
+        ("first", create_stream("first")),
+        ("second", create_stream("second")),
+        # Nothing changed, so the digest is left alone
+        ("second", create_stream("second")),
+        ("first", None),
+        ("second", None),
+    ]:
+        main.handle_streams(streams={streamer: stream})
+
+    # Members of groups only have no webhooks of their own
+    assert all(
+        call.kwargs["targets"] == [] for call in main.outbox.send.call_args_list
+    )
+    main.outbox.send_digest.assert_called_once()
+    assert [
+        [stream.user_login for stream, _ in call.kwargs["streams"]]
+        for call in main.outbox.update_digest.call_args_list
+    ] == [["first", "second"], ["second"]]
+    main.outbox.finalize_digest.assert_called_once_with(
+        group="team", targets=["https://discord.com/team"]
+    )
+
+
+def test_interrupt_keeps_unsent_messages_past_the_timeout(
+    mock_loggers, create_stream
+):
+    with open("config.toml", "w") as file:
+        file.write(
+            """
+            [streamers.first]
+            webhooks = ["https://discord.com/api/webhooks/1/first"]
+            [streamers.second]
+            webhooks = ["https://discord.com/api/webhooks/2/second"]
+            """
+        )
+
+    with mock.patch.dict(
+        os.environ,
+        {
+            "TWITCH_CLIENT_ID": "id",
+            "TWITCH_CLIENT_SECRET": "secret",
+            "SHUTDOWN_TIMEOUT_SECONDS": "0.2",
+        },
+    ):
+        main = Main()
+    for streamer in ("first", "second"):
+        main.handle_streams(streams={streamer: create_stream(streamer)})
+
+    async def hang(**kwargs):
+        await asyncio.Event().wait()
+
+    main.discord_client.send_information_to_discord = mock.AsyncMock(
+        side_effect=hang
+    )
+    started_at = time.monotonic()
+    asyncio.run(main.interrupt())
+
+    assert time.monotonic() - started_at < 1
+    # Both streams were sent at once and stay queued with their endings
+    assert main.discord_client.send_information_to_discord.await_count == 2
+    assert main.outbox.pending() == 4
+    assert [lookup[0] for lookup in StateStore().load_vod_lookups()] == [
+        "first_stream",
+        "second_stream",
+    ]
+
+
+def test_stream_resumed_after_restart_keeps_its_message(
+    mock_loggers, create_stream
+):
+    with open("config.toml", "w") as file:
+        file.write(
+            """
+            [streamers.streamer]
+            webhooks = ["https://discord.com/api/webhooks/1/a"]
+            """
+        )
+    environment = {"TWITCH_CLIENT_ID": "id", "TWITCH_CLIENT_SECRET": "secret"}
+    stream = create_stream()
+
+    with mock.patch.dict(os.environ, environment):
+        main = Main()
+    main.discord_client = mock.AsyncMock()
+    main.discord_client.send_information_to_discord.return_value = "message"
+    main.outbox._discord_client = main.discord_client
+    main.handle_streams(streams={"streamer": stream})
+    asyncio.run(main.interrupt())
+
+    # Helix still lists the stream after the deploy.
+    with mock.patch.dict(os.environ, environment):
+        restarted_main = Main()
+    assert restarted_main.vod_resolver.pending() == 1
+    restarted_main.twitch_client = mock.AsyncMock()
+    restarted_main.twitch_client.get_stream.return_value = {
+        "streamer": create_stream(viewer_count=200)
+    }
+    restarted_main.outbox = mock.MagicMock()
+    asyncio.run(restarted_main.update_status())
+    restarted_main.save_state()
+
+    assert restarted_main.vod_resolver.pending() == 0
+    assert restarted_main.state_store.load_live().keys() == {stream.id}
+    assert restarted_main.state_store.load_vod_lookups() == []
+    assert restarted_main.viewer_history.samples(stream.id) == [100, 200]
+    restarted_main.outbox.update.assert_called_once()
+
+
+def test_sigterm_shuts_down_gracefully(mock_loggers):
+    with (
+        mock.patch.dict(
+            os.environ,
+            {
+                "STREAMER_NAME": "streamer_name",
+                "DISCORD_WEBHOOK_URL": "URL",
+                "TWITCH_CLIENT_ID": "id",
+                "TWITCH_CLIENT_SECRET": "secret",
+            },
+        ),
+        mock.patch("app.main.Main.interrupt", autospec=True) as interrupt,
+        requests_mock.Mocker() as requests_mocker,
+    ):
+        requests_mocker.post(
+            "https://id.twitch.tv/oauth2/token",
+            json={"access_token": "token", "expires_in": 3600},
+        )
+        requests_mocker.get(
+            "https://api.twitch.tv/helix/users?login=streamer_name",
+            json={"data": []},
+        )
+        requests_mocker.get(
+            "https://api.twitch.tv/helix/streams?user_login=streamer_name",
+            json={"data": []},
+        )
+
+        thread = threading.Timer(
+            1, lambda: os.kill(os.getpid(), signal.SIGTERM)
+        )
+        thread.start()
+
+        entry()
+
+    interrupt.assert_awaited_once()
+    mock_loggers.info_logger.assert_called_with("Stopped after SIGTERM.")
+
+
+def test_daemon_thread_executor_does_not_hold_up_exit():
+    async def start_slow_call():
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(DaemonThreadExecutor())
+        assert await asyncio.to_thread(sum, [1, 2]) == 3
+        loop.run_in_executor(None, time.sleep, 5)
+
+    started_at = time.monotonic()
+    asyncio.run(start_slow_call())
+
+    assert time.monotonic() - started_at < 1
+
+
+def test_reload_config_applies_only_changes(mock_loggers, create_stream):
+    with open("config.toml", "w") as file:
+        file.write(
+            """
+            [streamers.first]
+            webhooks = ["https://discord.com/api/webhooks/1/a"]
+            [streamers.second]
+            webhooks = ["https://discord.com/api/webhooks/2/a"]
+            """
+        )
+
+    with mock.patch.dict(
+        os.environ,
+        {"TWITCH_CLIENT_ID": "id", "TWITCH_CLIENT_SECRET": "secret"},
+    ):
+        main = Main()
+    twitch_client = main.twitch_client
+    main.outbox = mock.MagicMock()
+    streams = {
+        streamer: create_stream(streamer) for streamer in ("first", "second")
+    }
+    main.handle_streams(streams=streams)
+    main.outbox.reset_mock()
+
+    with open("config.toml", "w") as file:
+        file.write(
+            """
+            [streamers.first]
+            webhooks = ["https://discord.com/api/webhooks/1/b"]
+            [streamers.third]
+            webhooks = ["https://discord.com/api/webhooks/3/a"]
+            """
+        )
+    assert main.config_watcher.changed()
+
+    async def reload():
+        main.reload_config()
+        for task in main._setup_tasks:
+            task.cancel()
+
+    asyncio.run(reload())
+
+    assert main.streamers == ["first", "third"]
+    assert "second" not in main.scheduler
+    assert "third" in main.scheduler
+    assert main.live_streams == {"first": "first_stream"}
+    # First moved webhooks, second was removed while live
+    assert main.outbox.end.call_args_list == [
+        mock.call(
+            stream=streams["second"],
+            targets=["https://discord.com/api/webhooks/2/a"],
+            summary=mock.ANY,
+        ),
+        mock.call(
+            stream=streams["first"],
+            targets=["https://discord.com/api/webhooks/1/a"],
+        ),
+    ]
+    main.outbox.send.assert_called_once_with(
+        stream=streams["first"],
+        profile_image=None,
+        targets=["https://discord.com/api/webhooks/1/b"],
+    )
+    assert main.twitch_client is twitch_client
+
+
+def test_reload_config_keeps_config_while_file_is_broken(mock_loggers):
+    with open("config.toml", "w") as file:
+        file.write(
+            """
+            [streamers.first]
+            webhooks = ["https://discord.com/api/webhooks/1/a"]
+            """
+        )
+
+    with mock.patch.dict(
+        os.environ,
+        {"TWITCH_CLIENT_ID": "id", "TWITCH_CLIENT_SECRET": "secret"},
+    ):
+        main = Main()
+    main.outbox = mock.MagicMock()
+    config = main.config
+
+    # Truncated by an editor, then saved with a malformed shape
+    for content in ("", 'streamers = ["first"]'):
+        with open("config.toml", "w") as file:
+            file.write(content)
+        main.reload_config()
+    os.remove("config.toml")
+    main.reload_config()
 
-    os.remove("streams.json")
+    assert main.config is config
+    assert main.streamers == ["first"]
+    main.outbox.end.assert_not_called()
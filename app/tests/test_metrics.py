@@ -0,0 +1,72 @@
+import requests
+import requests_mock
+
+from app import metrics
+from app.metrics import Histogram, MetricsServer, endpoint
+from app.transport import Transport
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = Histogram(
+        "test_seconds", "Test histogram.", labels=("name",), buckets=(1, 5)
+    )
+    for value in (0.5, 2, 10):
+        histogram.observe(value, name='quoted "name"')
+    metrics.REGISTRY.remove(histogram)
+
+    assert histogram.render() == [
+        "# HELP test_seconds Test histogram.",
+        "# TYPE test_seconds histogram",
+        'test_seconds_bucket{name="quoted \\"name\\"",le="1"} 1',
+        'test_seconds_bucket{name="quoted \\"name\\"",le="5"} 2',
+        'test_seconds_bucket{name="quoted \\"name\\"",le="+Inf"} 3',
+        'test_seconds_sum{name="quoted \\"name\\""} 12.5',
+        'test_seconds_count{name="quoted \\"name\\""} 3',
+    ]
+
+
+def test_endpoints_leave_out_webhook_secrets():
+    assert endpoint("/helix/streams") == "helix/streams"
+    assert endpoint("/api/webhooks/1/token") == "webhook"
+    assert endpoint("/api/webhooks/1/token/messages/2") == "messages"
+
+
+def test_responses_are_recorded():
+    transport = Transport()
+    transport.add_response_hook(metrics.observe_response)
+    url = "https://api.twitch.tv/helix/users"
+    labels = {"upstream": "api.twitch.tv", "endpoint": "helix/users"}
+    requests_before = metrics.REQUEST_SECONDS.count(**labels, method="GET")
+    errors_before = metrics.ERROR_RESPONSES.value(
+        upstream="api.twitch.tv", status="5xx"
+    )
+
+    with requests_mock.Mocker() as requests_mocker:
+        requests_mocker.get(url, status_code=503)
+        transport.get(url)
+
+    assert (
+        metrics.REQUEST_SECONDS.count(**labels, method="GET")
+        == requests_before + 1
+    )
+    assert (
+        metrics.ERROR_RESPONSES.value(upstream="api.twitch.tv", status="5xx")
+        == errors_before + 1
+    )
+
+
+def test_metrics_server_serves_metrics(mock_loggers):
+    server = MetricsServer(port=0, host="127.0.0.1")
+    server.start()
+    try:
+        metrics.LIVE_STREAMERS.set(3)
+        response = requests.get(
+            f"http://127.0.0.1:{server.server_port}/metrics"
+        )
+        missing = requests.get(f"http://127.0.0.1:{server.server_port}/")
+    finally:
+        server.stop()
+
+    assert response.status_code == 200
+    assert "notifier_live_streamers 3" in response.text.splitlines()
+    assert missing.status_code == 404
@@ -0,0 +1,221 @@
+import asyncio
+import json
+import sqlite3
+from unittest import mock
+
+import pytest
+import requests
+from requests import ConnectionError
+
+from app import metrics
+from app.outbox import Outbox
+from app.rate_limit import WebhookRateLimiter
+
+WEBHOOK_URL = "https://discord.com/api/webhooks/1/token"
+OTHER_WEBHOOK_URL = "https://discord.com/api/webhooks/2/token"
+
+
+def test_outbox_coalesces_updates(mock_loggers, create_stream):
+    outbox = Outbox(discord_client=mock.AsyncMock())
+    stream = create_stream()
+
+    outbox.send(stream=stream, profile_image="", targets=[WEBHOOK_URL])
+    outbox.update(stream=stream, profile_image="", targets=[WEBHOOK_URL])
+    outbox.update(stream=stream, profile_image="", targets=[WEBHOOK_URL])
+    assert outbox.pending() == 2
+
+    outbox.finalize(stream=stream, vod_url=None, targets=[WEBHOOK_URL])
+    assert outbox.pending() == 2
+
+
+def test_outbox_queues_messages_of_a_transaction_at_once(
+    mock_loggers, create_stream
+):
+    outbox = Outbox(discord_client=mock.AsyncMock())
+    reader = sqlite3.connect("outbox.db")
+
+    with outbox.transaction():
+        for login in ("first", "second"):
+            outbox.send(
+                stream=create_stream(login),
+                profile_image="",
+                targets=[WEBHOOK_URL],
+            )
+        # Nothing is committed before the transaction ends.
+        assert reader.execute("SELECT COUNT(*) FROM jobs").fetchone()[0] == 0
+    assert reader.execute("SELECT COUNT(*) FROM jobs").fetchone()[0] == 2
+
+    with pytest.raises(ValueError), outbox.transaction():
+        outbox.send(
+            stream=create_stream("third"),
+            profile_image="",
+            targets=[WEBHOOK_URL],
+        )
+        raise ValueError
+    assert outbox.pending() == 2
+
+
+def test_outbox_retries_and_resolves_message_id(mock_loggers, create_stream):
+    discord_client = mock.AsyncMock()
+    discord_client.send_information_to_discord.side_effect = [
+        ConnectionError(),
+        "message",
+    ]
+    on_sent = mock.Mock()
+    outbox = Outbox(discord_client=discord_client, on_sent=on_sent)
+    stream = create_stream()
+
+    outbox.send(stream=stream, profile_image="", targets=[WEBHOOK_URL])
+    outbox.finalize(stream=stream, vod_url="vod", targets=[WEBHOOK_URL])
+    asyncio.run(outbox.drain(timeout=5))
+
+    assert outbox.pending() == 0
+    assert discord_client.send_information_to_discord.await_count == 2
+    on_sent.assert_called_once_with(stream.id, "message")
+    finalize_call = discord_client.finalize_information_on_discord.call_args
+    assert finalize_call.kwargs["message_id"] == "message"
+    assert "vod" in json.loads(finalize_call.kwargs["message"])["content"]
+
+
+def test_outbox_survives_restart(mock_loggers, create_stream):
+    Outbox(discord_client=mock.AsyncMock()).send(
+        stream=create_stream(), profile_image="", targets=[WEBHOOK_URL]
+    )
+
+    discord_client = mock.AsyncMock()
+    discord_client.send_information_to_discord.return_value = "message"
+    outbox = Outbox(discord_client=discord_client)
+    assert outbox.pending() == 1
+
+    async def run_worker():
+        worker = asyncio.create_task(outbox.run())
+        while outbox.pending():
+            await asyncio.sleep(0.01)
+        worker.cancel()
+
+    asyncio.run(asyncio.wait_for(run_worker(), timeout=5))
+
+    discord_client.send_information_to_discord.assert_awaited_once()
+
+
+def test_outbox_worker_survives_unexpected_errors(mock_loggers, create_stream):
+    discord_client = mock.AsyncMock()
+    discord_client.send_information_to_discord.side_effect = [
+        KeyError("id"),
+        "message",
+    ]
+    outbox = Outbox(discord_client=discord_client)
+    outbox.send(stream=create_stream(), profile_image="", targets=[WEBHOOK_URL])
+
+    async def run_worker():
+        worker = asyncio.create_task(outbox.run())
+        while outbox.pending():
+            assert not worker.done()
+            await asyncio.sleep(0.01)
+        worker.cancel()
+
+    with mock.patch("app.outbox.BACKOFF_BASE_SECONDS", 0):
+        asyncio.run(asyncio.wait_for(run_worker(), timeout=5))
+
+    assert discord_client.send_information_to_discord.await_count == 2
+    assert metrics.OUTBOX_ERRORS.value(kind="send") == 1
+
+
+def test_outbox_finishes_sends_of_cancelled_worker(mock_loggers, create_stream):
+    async def send(webhook_url, message):
+        await asyncio.sleep(0.1)
+        return "message"
+
+    discord_client = mock.AsyncMock()
+    discord_client.send_information_to_discord.side_effect = send
+    outbox = Outbox(discord_client=discord_client)
+    stream = create_stream()
+    outbox.send(stream=stream, profile_image="", targets=[WEBHOOK_URL])
+
+    async def shut_down_while_sending():
+        worker = asyncio.create_task(outbox.run())
+        await asyncio.sleep(0.01)
+        worker.cancel()
+        await asyncio.gather(worker, return_exceptions=True)
+        await outbox.drain(timeout=5)
+
+    asyncio.run(shut_down_while_sending())
+
+    assert discord_client.send_information_to_discord.await_count == 1
+    assert outbox.pending() == 0
+    assert outbox._message_id(key=stream.id, target=WEBHOOK_URL) == "message"
+
+
+def test_outbox_holds_jobs_until_rate_limit_resets(mock_loggers, create_stream):
+    rate_limiter = WebhookRateLimiter()
+    response = requests.Response()
+    response.status_code = 200
+    response.headers.update(
+        {
+            "X-RateLimit-Limit": "5",
+            "X-RateLimit-Remaining": "0",
+            "X-RateLimit-Reset-After": "60",
+        }
+    )
+    response.request = requests.Request("POST", WEBHOOK_URL).prepare()
+    rate_limiter.observe(response)
+    outbox = Outbox(discord_client=mock.AsyncMock(), rate_limiter=rate_limiter)
+
+    outbox.send(stream=create_stream(), profile_image="", targets=[WEBHOOK_URL])
+    ready_jobs, wait_seconds = outbox._ready_jobs(ignore_backoff=False)
+
+    assert ready_jobs == []
+    assert 59 < wait_seconds <= 60
+
+
+def test_outbox_sends_to_every_target(mock_loggers, create_stream):
+    discord_client = mock.AsyncMock()
+    discord_client.send_information_to_discord.side_effect = (
+        lambda webhook_url, message: f"{webhook_url}/message"
+    )
+    outbox = Outbox(discord_client=discord_client)
+    stream = create_stream()
+
+    outbox.send(
+        stream=stream,
+        profile_image="",
+        targets=[WEBHOOK_URL, OTHER_WEBHOOK_URL],
+    )
+    ready_jobs, _ = outbox._ready_jobs(ignore_backoff=False)
+    # Both targets are sent to at once, with the same rendered message
+    assert len(ready_jobs) == 2
+    assert ready_jobs[0].payload == ready_jobs[1].payload
+
+    outbox.update(
+        stream=stream,
+        profile_image="",
+        targets=[WEBHOOK_URL, OTHER_WEBHOOK_URL],
+    )
+    asyncio.run(outbox.drain(timeout=5))
+
+    assert {
+        (call.kwargs["webhook_url"], call.kwargs["message_id"])
+        for call in discord_client.update_information_on_discord.call_args_list
+    } == {
+        (WEBHOOK_URL, f"{WEBHOOK_URL}/message"),
+        (OTHER_WEBHOOK_URL, f"{OTHER_WEBHOOK_URL}/message"),
+    }
+
+
+def test_outbox_finalizes_ended_message_later(mock_loggers, create_stream):
+    discord_client = mock.AsyncMock()
+    discord_client.send_information_to_discord.return_value = "message"
+    outbox = Outbox(discord_client=discord_client)
+    stream = create_stream()
+
+    outbox.send(stream=stream, profile_image="", targets=[WEBHOOK_URL])
+    outbox.end(stream=stream, targets=[WEBHOOK_URL])
+    asyncio.run(outbox.drain(timeout=5))
+    outbox.finalize(stream=stream, vod_url="vod", targets=[WEBHOOK_URL])
+    asyncio.run(outbox.drain(timeout=5))
+
+    assert [
+        call.kwargs["message_id"]
+        for call in discord_client.finalize_information_on_discord.call_args_list
+    ] == ["message", "message"]
+    assert outbox._message_id(key=stream.id, target=WEBHOOK_URL) is None
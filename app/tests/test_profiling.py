@@ -0,0 +1,79 @@
+import asyncio
+import os
+import signal
+from pathlib import Path
+
+import requests_mock
+
+from app.discord_client import AsyncDiscordClient, DiscordClient
+from app.profiling import TickProfiler, span, traced_arguments
+
+WEBHOOK_URL = "https://discord.com/api/webhooks/1/token"
+
+
+def test_traced_arguments_leave_out_webhooks():
+    assert traced_arguments(
+        {
+            "logins": ["a", "b", "c", "d", "e"],
+            "webhook_url": WEBHOOK_URL,
+            "message_id": "1",
+            "user_ids": None,
+        }
+    ) == {"logins": "a, b, c and 2 more", "message_id": "1"}
+
+
+def test_slow_tick_reports_spans_and_rate_limits_dumps(mock_loggers):
+    discord_client = AsyncDiscordClient(
+        client=DiscordClient(), semaphore=asyncio.Semaphore(1)
+    )
+    profiler = TickProfiler(
+        threshold_seconds=0, dump_interval_seconds=300, enabled=True
+    )
+
+    async def tick():
+        with profiler.tick():
+            await discord_client.update_information_on_discord(
+                webhook_url=WEBHOOK_URL,
+                message_id="message",
+                message=b"{}",
+            )
+
+    with requests_mock.Mocker() as mocker:
+        mocker.patch(f"{WEBHOOK_URL}/messages/message")
+        asyncio.run(tick())
+        asyncio.run(tick())
+
+    spans_report = mock_loggers.warning_logger.call_args_list[0].args[0]
+    assert "discord.update_information_on_discord message_id=message" in (
+        spans_report
+    )
+    assert "token" not in spans_report
+    # Both ticks are reported, but only the first one is dumped.
+    assert mock_loggers.warning_logger.call_count == 3
+    assert len(list(Path("profiles").glob("tick-*.prof"))) == 1
+
+
+def test_spans_are_not_recorded_while_disabled(mock_loggers):
+    profiler = TickProfiler(threshold_seconds=0, enabled=False)
+
+    with profiler.tick():
+        with span("call"):
+            pass
+
+    mock_loggers.warning_logger.assert_not_called()
+    assert not Path("profiles").exists()
+
+
+def test_signal_toggles_profiling(mock_loggers):
+    profiler = TickProfiler()
+    assert not profiler.enabled
+
+    async def send_signal():
+        profiler.install_signal_handler(loop=asyncio.get_running_loop())
+        os.kill(os.getpid(), signal.SIGUSR1)
+        await asyncio.sleep(0.01)
+        asyncio.get_running_loop().remove_signal_handler(signal.SIGUSR1)
+
+    asyncio.run(send_signal())
+
+    assert profiler.enabled
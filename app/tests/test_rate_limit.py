@@ -0,0 +1,102 @@
+import asyncio
+from unittest import mock
+
+import pytest
+import requests_mock
+
+from app.rate_limit import (
+    BACKGROUND,
+    STREAM_POLL,
+    HelixBudget,
+    WebhookRateLimiter,
+)
+from app.transport import Transport
+
+WEBHOOK_URL = "https://discord.com/api/webhooks/1/token"
+OTHER_WEBHOOK_URL = "https://discord.com/api/webhooks/2/token"
+
+
+def test_rate_limiter_tracks_buckets_per_webhook(mock_loggers):
+    rate_limiter = WebhookRateLimiter()
+    transport = Transport()
+    transport.add_response_hook(rate_limiter.observe)
+
+    with requests_mock.Mocker() as requests_mocker:
+        requests_mocker.post(
+            WEBHOOK_URL,
+            status_code=429,
+            headers={"Retry-After": "2.5", "X-RateLimit-Remaining": "0"},
+        )
+        requests_mocker.post(
+            OTHER_WEBHOOK_URL,
+            headers={
+                "X-RateLimit-Limit": "5",
+                "X-RateLimit-Remaining": "4",
+                "X-RateLimit-Reset-After": "2",
+            },
+        )
+
+        transport.post(WEBHOOK_URL)
+        transport.post(OTHER_WEBHOOK_URL)
+
+    assert 2 < rate_limiter.delay(f"{WEBHOOK_URL}/messages/0") <= 2.5
+    assert not rate_limiter.reserve(WEBHOOK_URL)
+    assert rate_limiter.delay(OTHER_WEBHOOK_URL) == 0
+    for _ in range(4):
+        assert rate_limiter.reserve(OTHER_WEBHOOK_URL)
+    assert not rate_limiter.reserve(OTHER_WEBHOOK_URL)
+
+
+def test_rate_limiter_global_limit_holds_every_webhook(mock_loggers):
+    rate_limiter = WebhookRateLimiter()
+    transport = Transport()
+    transport.add_response_hook(rate_limiter.observe)
+
+    with requests_mock.Mocker() as requests_mocker:
+        requests_mocker.post(
+            WEBHOOK_URL,
+            status_code=429,
+            headers={"Retry-After": "1", "X-RateLimit-Global": "true"},
+        )
+
+        transport.post(WEBHOOK_URL)
+
+    assert rate_limiter.delay(OTHER_WEBHOOK_URL) > 0
+    assert not rate_limiter.reserve(OTHER_WEBHOOK_URL)
+
+
+def test_helix_budget_follows_ratelimit_headers(mock_loggers):
+    budget = HelixBudget()
+    transport = Transport()
+    transport.add_response_hook(budget.observe)
+
+    with requests_mock.Mocker() as requests_mocker:
+        requests_mocker.get(
+            "https://api.twitch.tv/helix/streams",
+            headers={"Ratelimit-Limit": "800", "Ratelimit-Remaining": "100"},
+        )
+
+        transport.get("https://api.twitch.tv/helix/streams")
+
+    # Background calls have to leave 160 points for stream polls
+    assert budget.is_low()
+    assert budget.wait_time(priority=BACKGROUND) == pytest.approx(4.5, abs=0.1)
+    assert budget.wait_time(priority=STREAM_POLL, points=50) == 0
+    assert budget.wait_time(priority=STREAM_POLL, points=200) == pytest.approx(
+        7.5, abs=0.1
+    )
+
+
+def test_helix_budget_acquire_spends_points(mock_loggers):
+    budget = HelixBudget(limit=60, reserve=0.5)
+
+    async def acquire():
+        for _ in range(30):
+            await budget.acquire(priority=BACKGROUND)
+
+        assert budget.is_low()
+        with mock.patch("app.rate_limit.asyncio.sleep") as mock_sleep:
+            await budget.acquire(priority=STREAM_POLL)
+        mock_sleep.assert_not_called()
+
+    asyncio.run(acquire())
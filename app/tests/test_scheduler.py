@@ -0,0 +1,97 @@
+from app.scheduler import HOUR_SECONDS, PollScheduler
+
+
+def test_scheduler_groups_due_streamers_into_one_batch():
+    scheduler = PollScheduler(live_interval=30, batch_window=1)
+    scheduler.add(streamer="first", due_at=100)
+    scheduler.add(streamer="second", due_at=100.5)
+    scheduler.add(streamer="third", due_at=110)
+
+    assert scheduler.pop_due(now=98) == []
+    assert scheduler.pop_due(now=100) == ["first", "second"]
+    assert scheduler.seconds_until_next(now=100) == 10
+    assert scheduler.pop_due(now=100) == []
+    assert scheduler.pop_due(now=110) == ["third"]
+    assert scheduler.seconds_until_next(now=110) == float("inf")
+
+
+def test_scheduler_replaces_earlier_entries():
+    scheduler = PollScheduler(live_interval=30, jitter=0)
+    scheduler.add(streamer="streamer", due_at=100)
+    scheduler.add(streamer="streamer", due_at=50)
+
+    assert scheduler.pop_due(now=50) == ["streamer"]
+    assert scheduler.pop_due(now=100) == []
+
+    scheduler.reschedule(streamer="streamer", is_live=True, now=100)
+    scheduler.remove(streamer="streamer")
+    assert "streamer" not in scheduler
+    assert scheduler.pop_due(now=1000) == []
+
+
+def test_scheduler_backs_off_for_dormant_streamers():
+    scheduler = PollScheduler(
+        live_interval=30, max_interval=300, recently_live_seconds=600
+    )
+    scheduler.add(streamer="streamer", due_at=0)
+    scheduler.reschedule(streamer="streamer", is_live=True, now=0)
+    assert scheduler.interval(streamer="streamer", now=0) == 30
+
+    scheduler.reschedule(streamer="streamer", is_live=False, now=100)
+    # Just went offline, they might be back any moment
+    assert scheduler.interval(streamer="streamer", now=200) == 30
+    three_hours_later = 100 + 3 * HOUR_SECONDS
+    assert scheduler.interval(streamer="streamer", now=three_hours_later) == 120
+    two_days_later = 100 + 48 * HOUR_SECONDS
+    assert scheduler.interval(streamer="streamer", now=two_days_later) == 300
+
+
+def test_scheduler_polls_quickly_around_usual_start_times():
+    scheduler = PollScheduler(live_interval=30, recently_live_seconds=600)
+    week = 7 * 24 * HOUR_SECONDS
+    went_live_at = 20 * HOUR_SECONDS
+    scheduler.reschedule(streamer="streamer", is_live=True, now=went_live_at)
+    scheduler.reschedule(
+        streamer="streamer", is_live=False, now=went_live_at + HOUR_SECONDS
+    )
+
+    # An hour before the usual start a week later
+    before_usual_start = went_live_at + week - HOUR_SECONDS
+    assert scheduler.interval(streamer="streamer", now=before_usual_start) == 30
+    after_usual_start = went_live_at + week + 3 * HOUR_SECONDS
+    assert scheduler.interval(streamer="streamer", now=after_usual_start) == 300
+
+
+def test_scheduler_jitters_batches():
+    scheduler = PollScheduler(live_interval=30, jitter=0.1)
+    for index in range(100):
+        scheduler.reschedule(streamer=str(index), is_live=True, now=0)
+
+    due_times = set(scheduler._due_at.values())
+    assert len(due_times) == 1
+    assert 27 <= due_times.pop() <= 33
+
+    offsets = set()
+    for tick in range(1, 100):
+        scheduler.reschedule(streamer="0", is_live=True, now=tick * 30)
+        offsets.add(scheduler._due_at["0"] - (tick + 1) * 30)
+    assert len(offsets) > 1
+    assert all(-3 <= offset <= 3 for offset in offsets)
+
+
+def test_scheduler_keeps_live_streamers_in_one_batch():
+    scheduler = PollScheduler(live_interval=30, jitter=0.1)
+    for index in range(50):
+        scheduler.add(streamer=str(index), due_at=index * 0.5)
+
+    batch_sizes = []
+    now = 0
+    while now < 3600:
+        now = scheduler.next_due_at()
+        due_streamers = scheduler.pop_due(now=now)
+        batch_sizes.append(len(due_streamers))
+        for streamer in due_streamers:
+            scheduler.reschedule(streamer=streamer, is_live=True, now=now)
+
+    # The streamers added at different times join up after their first poll.
+    assert all(batch_size == 50 for batch_size in batch_sizes[-100:])
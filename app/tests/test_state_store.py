@@ -0,0 +1,38 @@
+import time
+from unittest import mock
+
+from app.state_store import StateStore
+
+
+def test_state_store_writes_only_changed_streams(mock_loggers, create_stream):
+    store = StateStore(path="state.db")
+    store.put(create_stream(id="1"))
+    store.put(create_stream(id="2"))
+    assert store.flush() == 2
+    assert store.flush() == 0
+
+    changed_stream = create_stream(id="2", title="new title")
+    store.put(changed_stream)
+    assert store.flush() == 1
+    store.close()
+
+    saved_streams = StateStore(path="state.db").load()
+    assert saved_streams.keys() == {"1", "2"}
+    assert saved_streams["2"] == changed_stream
+
+
+def test_state_store_evicts_finalized_streams(mock_loggers, create_stream):
+    store = StateStore(path="state.db", retention_seconds=60)
+    store.put(create_stream(id="1"))
+    store.put(create_stream(id="2"))
+    store.mark_finalized(stream_id="1")
+    store.flush()
+
+    assert store.evict() == []
+    with mock.patch(
+        "app.state_store.time.time", return_value=time.time() + 120
+    ):
+        assert store.evict() == ["1"]
+    store.compact()
+
+    assert store.load().keys() == {"2"}
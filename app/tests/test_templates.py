@@ -0,0 +1,97 @@
+import json
+from unittest import mock
+
+from app.templates import MessageStyle, MessageTemplates, Slot, Template, dumps
+from app.twitch_client import StreamInformation
+from app.viewer_history import ViewerSummary
+
+STREAM = StreamInformation(
+    id="0",
+    user_id="0",
+    user_name="Tést",
+    user_login="test",
+    game_name="game",
+    started_at="never",
+    title='title with "quotes"',
+    viewer_count=1234,
+    _thumbnail_url="https://thumbnail.com/{width}-{height}.png",
+)
+
+
+def test_template_fills_in_slots():
+    template = Template(
+        {"static": [1, "two"], "slot": Slot("slot"), "nested": Slot("nested")}
+    )
+
+    assert json.loads(
+        template.render(slot={"a": None}, nested=b'{"raw":true}')
+    ) == {"static": [1, "two"], "slot": {"a": None}, "nested": {"raw": True}}
+
+
+def test_templates_render_live_message():
+    message = json.loads(
+        MessageTemplates().live_message(stream=STREAM, profile_image="image")
+    )
+
+    assert message == {
+        "username": "Oak Tree",
+        "avatar_url": "https://i.imgur.com/DBOuwjx.png",
+        "content": "@everyone Tést went live!",
+        "embeds": [
+            {
+                "title": 'title with "quotes"',
+                "color": 8388863,
+                "timestamp": "never",
+                "url": "https://www.twitch.tv/test",
+                "author": {
+                    "name": "Tést",
+                    "url": "https://www.twitch.tv/test",
+                    "icon_url": "image",
+                },
+                "image": {"url": "https://thumbnail.com/1280-720.png"},
+                "fields": [
+                    {"name": "Game", "value": "game", "inline": True},
+                    {"name": "Viewers", "value": 1234, "inline": True},
+                ],
+            }
+        ],
+    }
+
+
+def test_templates_follow_style():
+    templates = MessageTemplates(
+        style=MessageStyle(
+            username="Notifier",
+            color=255,
+            mention="",
+            offline_content="{user_name} is gone: {vod_url}",
+        )
+    )
+
+    live_message = json.loads(
+        templates.live_message(stream=STREAM, profile_image=None)
+    )
+    assert live_message["username"] == "Notifier"
+    assert live_message["content"] == "Tést went live!"
+    assert live_message["embeds"][0]["color"] == 255
+    assert json.loads(
+        templates.finalized_message(user_name="Tést", vod_url=None)
+    )["content"] == ("Tést is gone: None available.")
+
+
+def test_finalized_message_reports_viewers():
+    message = MessageTemplates().finalized_message(
+        user_name="Tést",
+        vod_url="https://vod",
+        summary=ViewerSummary(peak=1500, average=900, duration_seconds=7500),
+    )
+
+    assert json.loads(message)["content"] == (
+        "Tést stopped the stream. Check out the VOD!\nhttps://vod\n"
+        "Peaked at 1500 viewers with 900 on average over 2h 5m."
+    )
+
+
+def test_dumps_without_orjson():
+    with mock.patch("app.templates.orjson", None):
+        assert json.loads(dumps({"name": "Tést"})) == {"name": "Tést"}
@@ -0,0 +1,98 @@
+import json
+import time
+
+import requests_mock
+
+from app.token_manager import TokenManager
+from app.transport import Transport
+
+
+def create_token_manager() -> TokenManager:
+    return TokenManager(
+        client_id="id", client_secret="secret", transport=Transport()
+    )
+
+
+def test_token_is_cached_across_instances(mock_loggers):
+    with requests_mock.Mocker() as requests_mocker:
+        requests_mocker.post(
+            "https://id.twitch.tv/oauth2/token",
+            json={"access_token": "token", "expires_in": 3600},
+        )
+
+        assert create_token_manager().get_token() == "token"
+        assert create_token_manager().get_token() == "token"
+
+    assert len(requests_mocker.request_history) == 1
+
+
+def test_token_is_refreshed_ahead_of_expiry(mock_loggers):
+    with open("twitch_token.json", "w") as file:
+        json.dump(
+            {
+                "client_id": "id",
+                "access_token": "old_token",
+                "expires_at": time.time() + 60,
+            },
+            file,
+        )
+
+    with requests_mock.Mocker() as requests_mocker:
+        requests_mocker.post(
+            "https://id.twitch.tv/oauth2/token",
+            json={"access_token": "new_token", "expires_in": 3600},
+        )
+
+        assert create_token_manager().get_token() == "new_token"
+
+    with open("twitch_token.json", "r") as file:
+        assert json.load(file)["access_token"] == "new_token"
+
+
+def test_invalidate_adopts_token_refreshed_by_other_process(mock_loggers):
+    with requests_mock.Mocker() as requests_mocker:
+        requests_mocker.post(
+            "https://id.twitch.tv/oauth2/token",
+            [
+                {"json": {"access_token": "first", "expires_in": 3600}},
+                {"json": {"access_token": "second", "expires_in": 3600}},
+            ],
+        )
+
+        token_manager = create_token_manager()
+        other_token_manager = create_token_manager()
+        assert token_manager.get_token() == "first"
+        assert other_token_manager.get_token() == "first"
+
+        # The first process finds out its token was revoked and mints a new
+        # one, the second one picks it up from the cache instead of minting.
+        token_manager.invalidate()
+        other_token_manager.invalidate()
+
+        assert token_manager.get_token() == "second"
+        assert other_token_manager.get_token() == "second"
+
+    assert len(requests_mocker.request_history) == 2
+
+
+def test_invalidate_refreshes_once_per_rejected_token(mock_loggers):
+    with requests_mock.Mocker() as requests_mocker:
+        requests_mocker.post(
+            "https://id.twitch.tv/oauth2/token",
+            [
+                {"json": {"access_token": "first", "expires_in": 3600}},
+                {"json": {"access_token": "second", "expires_in": 3600}},
+                {"json": {"access_token": "third", "expires_in": 3600}},
+            ],
+        )
+
+        token_manager = create_token_manager()
+        assert token_manager.get_token() == "first"
+
+        # Parallel requests were all rejected with the first token.
+        for _ in range(3):
+            token_manager.invalidate(rejected_token="first")
+
+        assert token_manager.get_token() == "second"
+
+    assert len(requests_mocker.request_history) == 2
@@ -0,0 +1,56 @@
+from app.transitions import compute_transitions
+
+
+def test_transitions_of_a_poll(create_stream):
+    transitions = compute_transitions(
+        streams={
+            "new": create_stream("new"),
+            "live": create_stream("live"),
+            "offline": None,
+            "restarted": create_stream("restarted", id="second"),
+            "crashed": create_stream("crashed"),
+            "never_live": None,
+        },
+        live_streams={
+            "live": "live_stream",
+            "offline": "offline_stream",
+            "restarted": "first",
+            "not_polled": "not_polled_stream",
+        },
+        known_stream_ids={"crashed_stream", "offline_stream"},
+    )
+
+    assert list(transitions.went_live) == ["new", "restarted"]
+    assert list(transitions.resumed) == ["crashed"]
+    assert list(transitions.still_live) == ["live"]
+    assert transitions.went_offline == {
+        "offline": "offline_stream",
+        "restarted": "first",
+    }
+    assert transitions.streamers == {
+        "new",
+        "live",
+        "offline",
+        "restarted",
+        "crashed",
+    }
+
+
+def test_transitions_of_a_large_fleet(create_stream):
+    streams = {
+        f"streamer_{i}": create_stream(f"streamer_{i}") if i % 2 else None
+        for i in range(20000)
+    }
+    live_streams = {
+        f"streamer_{i}": f"streamer_{i}_stream" for i in range(0, 20000, 3)
+    }
+
+    transitions = compute_transitions(
+        streams=streams, live_streams=live_streams, known_stream_ids={}
+    )
+
+    # Odd streamers are live, every third was tracked as live before.
+    assert len(transitions.still_live) == len(range(3, 20000, 6))
+    assert len(transitions.went_offline) == len(range(0, 20000, 6))
+    assert len(transitions.went_live) == 10000 - len(transitions.still_live)
+    assert not transitions.resumed
@@ -0,0 +1,55 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import pytest
+
+from app.transport import Transport
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def local_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_transport_reuses_connections(local_server):
+    transport = Transport(pool_sizes={local_server: 2})
+
+    for _ in range(5):
+        transport.get(f"{local_server}/").raise_for_status()
+
+    stats = transport.connection_stats()[local_server]
+    assert stats.requests == 5
+    assert stats.new_connections == 1
+    assert stats.reused_connections == 4
+    transport.close()
+
+
+def test_transport_sets_default_timeout():
+    transport = Transport()
+
+    with mock.patch.object(transport.session, "request") as mock_request:
+        mock_request.return_value.status_code = 200
+        transport.get("https://api.twitch.tv/helix/streams")
+        transport.patch("https://discord.com/webhook", timeout=1)
+
+    assert mock_request.call_args_list[0].kwargs["timeout"] == (3.05, 10.0)
+    assert mock_request.call_args_list[1].kwargs["timeout"] == 1
@@ -0,0 +1,381 @@
+import asyncio
+import os
+from unittest import mock
+
+import requests_mock
+from requests import exceptions
+
+from app.rate_limit import HelixBudget
+from app.twitch_client import AsyncTwitchClient, StreamInformation, TwitchClient
+
+
+def stream_data(login: str) -> dict:
+    return {
+        "id": f"{login}_stream",
+        "user_id": f"{login}_id",
+        "user_login": login,
+        "user_name": login.title(),
+        "game_name": "game",
+        "title": "title",
+        "viewer_count": 1,
+        "started_at": "never",
+        "thumbnail_url": "https://thumbnail.com/{width}-{height}.png",
+    }
+
+
+def stream_information(**changes) -> StreamInformation:
+    data = stream_data("streamer")
+    data["_thumbnail_url"] = data.pop("thumbnail_url")
+    # Built at runtime, as literals are interned anyway.
+    data["game_name"] = "".join(["ga", "me"])
+    return StreamInformation(**{**data, **changes})
+
+
+def test_stream_information_is_compact_and_updated_in_place():
+    stream = stream_information(discord_message_id="message")
+    other_stream = stream_information(viewer_count=5)
+
+    assert not hasattr(stream, "__dict__")
+    assert stream.game_name is other_stream.game_name
+    assert stream.thumbnail_url == "https://thumbnail.com/1280-720.png"
+    assert stream.thumbnail_url is stream.thumbnail_url
+
+    stream.update(
+        stream_information(
+            title="new title",
+            viewer_count=5,
+            _thumbnail_url="https://thumbnail.com/{width}-{height}.png?1",
+        )
+    )
+
+    assert stream.title == "new title"
+    assert stream.viewer_count == 5
+    assert stream.discord_message_id == "message"
+    assert stream.thumbnail_url == "https://thumbnail.com/1280-720.png?1"
+    assert StreamInformation(**stream.as_dict()) == stream
+
+
+def test_get_stream_batches_logins(mock_loggers):
+    streamers = [f"streamer_{i}" for i in range(250)]
+
+    with (
+        mock.patch.dict(
+            os.environ,
+            {"TWITCH_CLIENT_ID": "id", "TWITCH_CLIENT_SECRET": "secret"},
+        ),
+        requests_mock.Mocker() as requests_mocker,
+    ):
+        requests_mocker.post(
+            "https://id.twitch.tv/oauth2/token",
+            json={"access_token": "token", "expires_in": 3600},
+        )
+        requests_mocker.get(
+            "https://api.twitch.tv/helix/streams",
+            json=lambda request, context: {
+                "data": [
+                    stream_data(login)
+                    for login in request.qs["user_login"]
+                    if login in ("streamer_0", "streamer_249")
+                ]
+            },
+        )
+
+        twitch_client = TwitchClient(streamers=streamers)
+        streams = twitch_client.get_stream()
+
+    assert len(requests_mocker.request_history) == 4
+    batch_sizes = [
+        len(request.qs["user_login"])
+        for request in requests_mocker.request_history[1:]
+    ]
+    assert batch_sizes == [100, 100, 50]
+    assert list(streams) == streamers
+    assert streams["streamer_0"].id == "streamer_0_stream"
+    assert streams["streamer_249"].id == "streamer_249_stream"
+    assert streams["streamer_1"] is None
+
+
+def test_get_stream_leaves_out_failed_batches(mock_loggers):
+    with (
+        mock.patch.dict(
+            os.environ,
+            {"TWITCH_CLIENT_ID": "id", "TWITCH_CLIENT_SECRET": "secret"},
+        ),
+        requests_mock.Mocker() as requests_mocker,
+    ):
+        requests_mocker.post(
+            "https://id.twitch.tv/oauth2/token",
+            json={"access_token": "token", "expires_in": 3600},
+        )
+        requests_mocker.get(
+            "https://api.twitch.tv/helix/streams",
+            exc=exceptions.ConnectionError,
+        )
+
+        twitch_client = TwitchClient(streamers=["streamer"])
+        streams = twitch_client.get_stream()
+
+    assert streams == {}
+
+
+def test_async_get_stream_leaves_out_only_failed_batch(mock_loggers):
+    streamers = [f"streamer_{i}" for i in range(150)]
+
+    def streams_response(request, context):
+        # The batch of the last 50 streamers is rate limited.
+        if "streamer_149" in request.qs["user_login"]:
+            context.status_code = 429
+            return {}
+        return {"data": [stream_data("streamer_0")]}
+
+    with (
+        mock.patch.dict(
+            os.environ,
+            {"TWITCH_CLIENT_ID": "id", "TWITCH_CLIENT_SECRET": "secret"},
+        ),
+        requests_mock.Mocker() as requests_mocker,
+    ):
+        requests_mocker.post(
+            "https://id.twitch.tv/oauth2/token",
+            json={"access_token": "token", "expires_in": 3600},
+        )
+        requests_mocker.get(
+            "https://api.twitch.tv/helix/streams", json=streams_response
+        )
+
+        twitch_client = AsyncTwitchClient(
+            client=TwitchClient(streamers=streamers),
+            semaphore=asyncio.Semaphore(2),
+        )
+        streams = asyncio.run(twitch_client.get_stream())
+
+    assert list(streams) == streamers[:100]
+    assert streams["streamer_0"].id == "streamer_0_stream"
+
+
+def test_get_users_batches_logins_and_ids(mock_loggers):
+    with (
+        mock.patch.dict(
+            os.environ,
+            {"TWITCH_CLIENT_ID": "id", "TWITCH_CLIENT_SECRET": "secret"},
+        ),
+        requests_mock.Mocker() as requests_mocker,
+    ):
+        requests_mocker.post(
+            "https://id.twitch.tv/oauth2/token",
+            json={"access_token": "token", "expires_in": 3600},
+        )
+        requests_mocker.get(
+            "https://api.twitch.tv/helix/users",
+            json=lambda request, context: {
+                "data": [
+                    {"login": login}
+                    for login in request.qs.get("login", [])
+                    + request.qs.get("id", [])
+                ]
+            },
+        )
+
+        users = TwitchClient(streamers=[]).get_users(
+            logins=[f"login_{i}" for i in range(150)],
+            user_ids=[f"id_{i}" for i in range(100)],
+        )
+
+    assert len(users) == 250
+    assert [
+        len(request.qs.get("login", [])) + len(request.qs.get("id", []))
+        for request in requests_mocker.request_history[1:]
+    ] == [100, 100, 50]
+
+
+def test_get_vod_matches_the_ended_stream(mock_loggers):
+    with (
+        mock.patch.dict(
+            os.environ,
+            {"TWITCH_CLIENT_ID": "id", "TWITCH_CLIENT_SECRET": "secret"},
+        ),
+        requests_mock.Mocker() as requests_mocker,
+    ):
+        requests_mocker.post(
+            "https://id.twitch.tv/oauth2/token",
+            json={"access_token": "token", "expires_in": 3600},
+        )
+        requests_mocker.get(
+            "https://api.twitch.tv/helix/videos",
+            json={"data": [{"stream_id": "older_stream", "url": "vod"}]},
+        )
+        twitch_client = TwitchClient(streamers=[])
+
+        assert twitch_client.get_vod(user_id="user", stream_id="stream") is None
+        assert (
+            twitch_client.get_vod(user_id="user", stream_id="older_stream")
+            == "vod"
+        )
+
+    assert requests_mocker.request_history[1].qs == {
+        "user_id": ["user"],
+        "type": ["archive"],
+        "first": ["1"],
+    }
+
+
+def test_delete_eventsub_subscriptions_of_our_callback(mock_loggers):
+    with (
+        mock.patch.dict(
+            os.environ,
+            {"TWITCH_CLIENT_ID": "id", "TWITCH_CLIENT_SECRET": "secret"},
+        ),
+        requests_mock.Mocker() as requests_mocker,
+    ):
+        requests_mocker.post(
+            "https://id.twitch.tv/oauth2/token",
+            json={"access_token": "token", "expires_in": 3600},
+        )
+        requests_mocker.get(
+            "https://api.twitch.tv/helix/eventsub/subscriptions",
+            [
+                {
+                    "json": {
+                        "data": [
+                            {"id": "online", "transport": {"callback": "ours"}},
+                            {
+                                "id": "other",
+                                "transport": {"callback": "theirs"},
+                            },
+                        ],
+                        "pagination": {"cursor": "next"},
+                    }
+                },
+                {
+                    "json": {
+                        "data": [
+                            {"id": "offline", "transport": {"callback": "ours"}}
+                        ],
+                        "pagination": {},
+                    }
+                },
+            ],
+        )
+        requests_mocker.delete(
+            "https://api.twitch.tv/helix/eventsub/subscriptions?id=online"
+        )
+        requests_mocker.delete(
+            "https://api.twitch.tv/helix/eventsub/subscriptions?id=offline",
+            status_code=404,
+        )
+        twitch_client = TwitchClient(streamers=[])
+
+        twitch_client.delete_eventsub_subscriptions(
+            broadcaster_user_id="user", callback_url="ours"
+        )
+
+    assert [
+        (request.method, request.qs)
+        for request in requests_mocker.request_history[1:]
+    ] == [
+        ("GET", {"user_id": ["user"]}),
+        ("GET", {"user_id": ["user"], "after": ["next"]}),
+        ("DELETE", {"id": ["online"]}),
+        ("DELETE", {"id": ["offline"]}),
+    ]
+
+
+def test_get_stream_retries_with_new_token_after_401(mock_loggers):
+    with (
+        mock.patch.dict(
+            os.environ,
+            {"TWITCH_CLIENT_ID": "id", "TWITCH_CLIENT_SECRET": "secret"},
+        ),
+        requests_mock.Mocker() as requests_mocker,
+    ):
+        requests_mocker.post(
+            "https://id.twitch.tv/oauth2/token",
+            [
+                {"json": {"access_token": "first", "expires_in": 3600}},
+                {"json": {"access_token": "second", "expires_in": 3600}},
+            ],
+        )
+        requests_mocker.get(
+            "https://api.twitch.tv/helix/streams",
+            [{"status_code": 401}, {"json": {"data": [stream_data("a")]}}],
+        )
+
+        twitch_client = TwitchClient(streamers=["a"])
+        streams = twitch_client.get_stream()
+
+    authorizations = [
+        request.headers.get("Authorization")
+        for request in requests_mocker.request_history
+    ]
+    assert authorizations == [None, "Bearer first", None, "Bearer second"]
+    assert streams["a"].id == "a_stream"
+
+
+def test_background_calls_waiting_for_budget_hold_no_slots(mock_loggers):
+    # The budget is down to its reserve and refills a point every ten seconds.
+    budget = HelixBudget(limit=6, reserve=0.5)
+    budget._points = 3
+
+    async def poll_behind_background_calls():
+        twitch_client = AsyncTwitchClient(
+            client=TwitchClient(streamers=["a"]),
+            semaphore=asyncio.Semaphore(2),
+            budget=budget,
+        )
+        background_calls = [
+            asyncio.create_task(twitch_client.get_users(logins=[f"user_{i}"]))
+            for i in range(10)
+        ]
+        await asyncio.sleep(0)
+        streams = await asyncio.wait_for(twitch_client.get_stream(), 2)
+        for background_call in background_calls:
+            background_call.cancel()
+        return streams
+
+    with (
+        mock.patch.dict(
+            os.environ,
+            {"TWITCH_CLIENT_ID": "id", "TWITCH_CLIENT_SECRET": "secret"},
+        ),
+        requests_mock.Mocker() as requests_mocker,
+    ):
+        requests_mocker.post(
+            "https://id.twitch.tv/oauth2/token",
+            json={"access_token": "token", "expires_in": 3600},
+        )
+        requests_mocker.get(
+            "https://api.twitch.tv/helix/streams",
+            json={"data": [stream_data("a")]},
+        )
+        streams = asyncio.run(poll_behind_background_calls())
+
+    assert streams["a"].id == "a_stream"
+    assert not any(
+        request.path == "/helix/users"
+        for request in requests_mocker.request_history
+    )
+
+
+def test_get_stream_leaves_out_batch_when_token_refresh_fails(mock_loggers):
+    with (
+        mock.patch.dict(
+            os.environ,
+            {"TWITCH_CLIENT_ID": "id", "TWITCH_CLIENT_SECRET": "secret"},
+        ),
+        requests_mock.Mocker() as requests_mocker,
+    ):
+        requests_mocker.post(
+            "https://id.twitch.tv/oauth2/token",
+            [
+                {"json": {"access_token": "first", "expires_in": 3600}},
+                {"exc": exceptions.ConnectTimeout},
+            ],
+        )
+        requests_mocker.get(
+            "https://api.twitch.tv/helix/streams", status_code=401
+        )
+
+        twitch_client = TwitchClient(streamers=["a"])
+        streams = twitch_client.get_stream()
+
+    assert streams == {}
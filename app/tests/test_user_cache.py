@@ -0,0 +1,37 @@
+from app.state_store import StateStore
+from app.user_cache import UserCache
+
+
+def create_user(login: str, profile_image_url: str = "image") -> dict:
+    return {"id": login, "login": login, "profile_image_url": profile_image_url}
+
+
+def test_user_cache_reports_missing_and_expired_users():
+    user_cache = UserCache(
+        state_store=StateStore(path="state.db"), ttl_seconds=60
+    )
+    user_cache.update(users=[create_user("first")], now=0)
+    user_cache.update(users=[create_user("second")], now=30)
+
+    assert user_cache.stale(logins=["first", "second", "third"], now=30) == [
+        "third"
+    ]
+    assert user_cache.stale(logins=["first", "second"], now=60) == ["first"]
+    assert user_cache.profile_image("first") == "image"
+
+
+def test_user_cache_evicts_least_recently_used_users():
+    state_store = StateStore(path="state.db")
+    user_cache = UserCache(state_store=state_store, max_size=2)
+    user_cache.update(users=[create_user("first"), create_user("second")])
+    user_cache.get("first")
+    user_cache.update(users=[create_user("third")])
+
+    assert "second" not in user_cache
+    assert "first" in user_cache
+
+    # Persisted users are restored on the next start
+    restored_cache = UserCache(state_store=state_store, max_size=2)
+    assert "first" in restored_cache
+    assert "third" in restored_cache
+    assert "second" not in restored_cache
@@ -0,0 +1,72 @@
+import os
+
+from app.viewer_history import ViewerHistory, ViewerSummary
+
+STARTED_AT = "2021-03-10T15:04:21Z"
+STARTED_TIMESTAMP = 1615388661.0
+
+
+def test_viewer_history_wraps_and_keeps_totals():
+    history = ViewerHistory(directory="history", capacity=3)
+    for minute, viewer_count in enumerate((10, 50, 20, 30, 40)):
+        history.record(
+            stream_id="stream",
+            viewer_count=viewer_count,
+            started_at=STARTED_AT,
+            now=STARTED_TIMESTAMP + 60 * (minute + 1),
+        )
+
+    assert history.samples("stream") == [20, 30, 40]
+    assert history.summary("stream") == ViewerSummary(
+        peak=50, average=30, duration_seconds=300
+    )
+
+
+def test_viewer_history_survives_restart():
+    history = ViewerHistory(directory="history")
+    history.record(
+        stream_id="stream", viewer_count=5, started_at="never", now=100
+    )
+    # Not closed, as after a crash.
+
+    restarted_history = ViewerHistory(directory="history")
+    restarted_history.record(
+        stream_id="stream", viewer_count=7, started_at="never", now=160
+    )
+
+    assert restarted_history.samples("stream") == [5, 7]
+    assert restarted_history.summary("stream") == ViewerSummary(
+        peak=7, average=6, duration_seconds=60
+    )
+
+    restarted_history.remove("stream")
+    history.close()
+
+    assert restarted_history.summary("stream") is None
+    assert restarted_history.samples("unknown") == []
+
+
+def test_viewer_history_shares_one_file_between_streams():
+    history = ViewerHistory(directory="history", capacity=3)
+    open_files = len(os.listdir("/proc/self/fd"))
+    for i in range(100):
+        history.record(
+            stream_id=f"stream_{i}", viewer_count=i, started_at="never", now=0
+        )
+
+    assert len(os.listdir("/proc/self/fd")) <= open_files + 1
+    assert history.samples("stream_42") == [42]
+
+    size = history.path.stat().st_size
+    for i in range(50):
+        history.remove(f"stream_{i}")
+    for i in range(100, 150):
+        history.record(
+            stream_id=f"stream_{i}", viewer_count=i, started_at="never", now=0
+        )
+    history.close()
+
+    # Ended streams left their slots to the new ones.
+    assert history.path.stat().st_size == size
+    assert list(history.directory.iterdir()) == [history.path]
+    assert ViewerHistory(directory="history").samples("stream_149") == [149]
@@ -0,0 +1,82 @@
+import asyncio
+import time
+from unittest import mock
+
+from app.circuit_breaker import CircuitOpenError
+from app.state_store import StateStore
+from app.vod_resolver import VodResolver
+
+
+def test_vod_resolver_retries_until_vod_appears(mock_loggers):
+    twitch_client = mock.AsyncMock()
+    twitch_client.get_vod.side_effect = [None, None, "https://vod"]
+    on_resolved = mock.Mock()
+    resolver = VodResolver(
+        twitch_client=twitch_client,
+        state_store=StateStore(path="state.db"),
+        on_resolved=on_resolved,
+        retry_seconds=(0, 0.01, 0.01),
+    )
+    resolver.add(stream_id="stream", user_id="user")
+
+    async def run_resolver():
+        worker = asyncio.create_task(resolver.run())
+        while resolver.pending():
+            await asyncio.sleep(0.01)
+        worker.cancel()
+
+    asyncio.run(asyncio.wait_for(run_resolver(), timeout=5))
+
+    assert twitch_client.get_vod.await_count == 3
+    twitch_client.get_vod.assert_awaited_with(
+        user_id="user", stream_id="stream"
+    )
+    on_resolved.assert_called_once_with("stream", "https://vod")
+
+
+def test_vod_resolver_gives_up_and_survives_restart(mock_loggers):
+    state_store = StateStore(path="state.db")
+    VodResolver(
+        twitch_client=mock.AsyncMock(),
+        state_store=state_store,
+        on_resolved=mock.Mock(),
+    ).add(stream_id="stream", user_id="user")
+
+    twitch_client = mock.AsyncMock()
+    twitch_client.get_vod.side_effect = ConnectionError()
+    on_resolved = mock.Mock()
+    resolver = VodResolver(
+        twitch_client=twitch_client,
+        state_store=state_store,
+        on_resolved=on_resolved,
+        retry_seconds=(0,),
+    )
+    assert resolver.pending() == 1
+
+    asyncio.run(resolver.resolve(list(resolver._lookups.values())))
+
+    on_resolved.assert_called_once_with("stream", None)
+    assert resolver.pending() == 0
+    assert state_store.load_vod_lookups() == []
+
+
+def test_vod_resolver_waits_for_open_circuit(mock_loggers):
+    state_store = StateStore(path="state.db")
+    twitch_client = mock.AsyncMock()
+    twitch_client.get_vod.side_effect = CircuitOpenError(
+        name="api.twitch.tv/helix/videos", retry_after=30
+    )
+    resolver = VodResolver(
+        twitch_client=twitch_client,
+        state_store=state_store,
+        on_resolved=mock.Mock(),
+        retry_seconds=(0,),
+    )
+    resolver.add(stream_id="stream", user_id="user")
+
+    asyncio.run(resolver.resolve(list(resolver._lookups.values())))
+
+    # Not given up on, as Twitch was never asked
+    [(_, _, attempts, due_at)] = state_store.load_vod_lookups()
+    assert attempts == 0
+    assert due_at > time.time() + 20
@@ -0,0 +1,136 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from json import JSONDecodeError
+
+from loguru import logger
+
+from app.metrics import TOKEN_REFRESHES
+from app.transport import Transport
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    # Windows has no fcntl, processes there will not share a locked cache.
+    fcntl = None
+
+# Tokens are replaced this long before Twitch would reject them.
+REFRESH_MARGIN_SECONDS = 300
+
+
+@dataclass
+class CachedToken:
+    client_id: str
+    access_token: str
+    expires_at: float
+
+    def is_fresh(self) -> bool:
+        return time.time() < self.expires_at - REFRESH_MARGIN_SECONDS
+
+
+class TokenManager:
+    def __init__(
+        self,
+        client_id: str,
+        client_secret: str,
+        transport: Transport,
+        cache_path: str | None = None,
+    ):
+        self._client_id = client_id
+        self._client_secret = client_secret
+        self._transport = transport
+        self._cache_path = cache_path or os.environ.get(
+            "TWITCH_TOKEN_CACHE", "twitch_token.json"
+        )
+        self._token: CachedToken | None = None
+        self._lock = threading.Lock()
+
+    def get_token(self) -> str:
+        with self._lock:
+            if not self._token or not self._token.is_fresh():
+                self._refresh(stale_token=None)
+            return self._token.access_token
+
+    def invalidate(self, rejected_token: str | None = None) -> None:
+        # Requests rejected in parallel all report the same token, only the
+        # first of them refreshes it.
+        with self._lock:
+            current_token = self._token.access_token if self._token else None
+            if rejected_token and rejected_token != current_token:
+                return
+            self._refresh(stale_token=current_token)
+
+    def _refresh(self, stale_token: str | None) -> None:
+        # Another process may have refreshed the token while we waited for
+        # the lock, in which case we adopt theirs instead of minting one.
+        with self._cache_lock():
+            cached_token = self._read_cache()
+            if (
+                cached_token
+                and cached_token.is_fresh()
+                and cached_token.access_token != stale_token
+            ):
+                logger.info("Using cached twitch access token.")
+                self._token = cached_token
+                return
+
+            self._token = self._request_token()
+            self._write_cache()
+
+    def _request_token(self) -> CachedToken:
+        logger.info("Updating twitch access token...")
+        TOKEN_REFRESHES.inc()
+        response = self._transport.post(
+            url="https://id.twitch.tv/oauth2/token",
+            headers={"Content-Type": "application/x-www-form-url-encoded"},
+            params={
+                "client_id": self._client_id,
+                "client_secret": self._client_secret,
+                "grant_type": "client_credentials",
+            },
+        )
+        response.raise_for_status()
+
+        token = response.json()
+        logger.info("Updating twitch access token done.")
+        return CachedToken(
+            client_id=self._client_id,
+            access_token=token["access_token"],
+            expires_at=time.time() + token["expires_in"],
+        )
+
+    @contextmanager
+    def _cache_lock(self):
+        if fcntl is None:  # pragma: no cover
+            yield
+            return
+
+        with open(f"{self._cache_path}.lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_cache(self) -> CachedToken | None:
+        try:
+            with open(self._cache_path, "r") as file:
+                cached_token = CachedToken(**json.load(file))
+        except (FileNotFoundError, JSONDecodeError, TypeError):
+            return None
+
+        if cached_token.client_id != self._client_id:
+            return None
+        return cached_token
+
+    def _write_cache(self) -> None:
+        temporary_path = f"{self._cache_path}.tmp"
+        file_descriptor = os.open(
+            temporary_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600
+        )
+        with os.fdopen(file_descriptor, "w") as file:
+            json.dump(asdict(self._token), file)
+        os.replace(temporary_path, self._cache_path)
@@ -0,0 +1,61 @@
+from collections.abc import Container
+from dataclasses import dataclass, field
+
+from app.twitch_client import StreamInformation
+
+
+# What one poll changes, by streamer login. A stream that restarted shows up
+# both as gone offline, with its old id, and as gone live.
+@dataclass
+class Transitions:
+    went_live: dict[str, StreamInformation] = field(default_factory=dict)
+    # Streams that were live before a restart and are known already.
+    resumed: dict[str, StreamInformation] = field(default_factory=dict)
+    still_live: dict[str, StreamInformation] = field(default_factory=dict)
+    went_offline: dict[str, str] = field(default_factory=dict)
+
+    @property
+    def streamers(self) -> set[str]:
+        return {
+            *self.went_live,
+            *self.resumed,
+            *self.still_live,
+            *self.went_offline,
+        }
+
+
+# Decides the transitions of the polled streamers by diffing the ids of the
+# streams Helix listed against the ids of the streams tracked as live. Only
+# reads its arguments, so it runs without any I/O.
+def compute_transitions(
+    streams: dict[str, StreamInformation | None],
+    live_streams: dict[str, str],
+    known_stream_ids: Container[str],
+) -> Transitions:
+    polled_streams = {
+        stream.id: (login, stream)
+        for login, stream in streams.items()
+        if stream
+    }
+    tracked_streams = {
+        live_streams[login]: login for login in streams if login in live_streams
+    }
+    polled_ids = polled_streams.keys()
+    tracked_ids = tracked_streams.keys()
+    offline_ids = tracked_ids - polled_ids
+    new_ids = polled_ids - tracked_ids
+
+    # Walks the streams in the order they were polled, so messages are queued
+    # in a stable order.
+    transitions = Transitions()
+    for stream_id, login in tracked_streams.items():
+        if stream_id in offline_ids:
+            transitions.went_offline[login] = stream_id
+    for stream_id, (login, stream) in polled_streams.items():
+        if stream_id not in new_ids:
+            transitions.still_live[login] = stream
+        elif stream_id in known_stream_ids:
+            transitions.resumed[login] = stream
+        else:
+            transitions.went_live[login] = stream
+    return transitions
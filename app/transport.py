@@ -0,0 +1,106 @@
+import os
+from dataclasses import dataclass
+
+import requests
+from loguru import logger
+from requests.adapters import HTTPAdapter
+
+from app.circuit_breaker import CircuitBreakers, CircuitOpenError
+
+# Connections kept alive per upstream, keyed by the URL prefix they serve.
+POOL_SIZES = {
+    "https://id.twitch.tv": 2,
+    "https://api.twitch.tv": 20,
+    "https://discord.com": 10,
+}
+
+
+# What the clients catch when an upstream could not be reached in time,
+# including calls failed right away by an open circuit.
+CONNECTION_ERRORS = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+)
+
+
+def log_request_error(err: requests.RequestException, message: str) -> None:
+    # Open circuits fail every call, a traceback each time would be noise.
+    if isinstance(err, CircuitOpenError):
+        logger.warning(f"{message} {err}")
+    else:
+        logger.opt(exception=err).warning(message)
+
+
+@dataclass
+class ConnectionStats:
+    requests: int = 0
+    new_connections: int = 0
+
+    @property
+    def reused_connections(self) -> int:
+        return self.requests - self.new_connections
+
+
+# One keep-alive session shared by the Twitch and Discord clients. Every
+# upstream gets its own connection pool and every request gets a connect and
+# read timeout, so a hung socket can not block the loop forever. Failing
+# upstreams trip their circuit breaker, failing further calls right away.
+class Transport:
+    def __init__(
+        self,
+        pool_sizes: dict[str, int] | None = None,
+        circuit_breakers: CircuitBreakers | None = None,
+    ):
+        self.timeout = (
+            float(os.environ.get("HTTP_CONNECT_TIMEOUT", 3.05)),
+            float(os.environ.get("HTTP_READ_TIMEOUT", 10)),
+        )
+        self.circuit_breakers = circuit_breakers or CircuitBreakers()
+        self.session = requests.Session()
+        self._adapters: dict[str, HTTPAdapter] = dict()
+        for prefix, pool_size in (pool_sizes or POOL_SIZES).items():
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            self.session.mount(prefix, adapter)
+            self._adapters[prefix] = adapter
+
+    def add_response_hook(self, hook) -> None:
+        self.session.hooks["response"].append(hook)
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        breaker = self.circuit_breakers.get(url)
+        breaker.before_call()
+        try:
+            response = self.session.request(method=method, url=url, **kwargs)
+        except CONNECTION_ERRORS:
+            breaker.record_failure()
+            raise
+        if response.status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        return response
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def patch(self, url: str, **kwargs) -> requests.Response:
+        return self.request("PATCH", url, **kwargs)
+
+    def connection_stats(self) -> dict[str, ConnectionStats]:
+        stats = dict()
+        for prefix, adapter in self._adapters.items():
+            stats[prefix] = ConnectionStats()
+            for key in adapter.poolmanager.pools.keys():
+                pool = adapter.poolmanager.pools.get(key)
+                if pool is None:
+                    continue
+                stats[prefix].requests += pool.num_requests
+                stats[prefix].new_connections += pool.num_connections
+        return stats
+
+    def close(self) -> None:
+        self.session.close()
@@ -1,29 +1,52 @@
+import asyncio
 import os
 import random
-from dataclasses import dataclass
+import sys
+import time
+from dataclasses import dataclass, field, fields
 
 import requests
 from loguru import logger
 from requests import HTTPError
-from urllib3.exceptions import NewConnectionError
+
+from app.metrics import RETRIES
+from app.profiling import span, traced_arguments
+from app.rate_limit import BACKGROUND, STREAM_POLL, HelixBudget
+from app.token_manager import TokenManager
+from app.transport import CONNECTION_ERRORS, Transport, log_request_error
+
+# Helix accepts at most 100 logins per /users and /streams request.
+HELIX_BATCH_SIZE = 100
+
+
+def batched(items: list, size: int) -> list[list]:
+    return [items[i : i + size] for i in range(0, len(items), size)]
 
 
 @dataclass
 class CachePrevent:
-    calls: int = 0
     random_number: int = 0
-    five_minute_update_modulo: int = 10
+    refresh_seconds: float = 300
+    last_refresh: float = field(default_factory=time.time)
 
-    def prevent_cache_on_url(self, url: str) -> str:
-        self.calls += 1
-        if self.calls % self.five_minute_update_modulo == 0:
+    def refresh(self) -> None:
+        if time.time() - self.last_refresh >= self.refresh_seconds:
+            self.last_refresh = time.time()
             self.random_number = random.randint(0, 999999)
             logger.info("Forcing image cache refresh.")
 
+    def prevent_cache_on_url(self, url: str) -> str:
         return f"{url}?{self.random_number}"
 
 
-@dataclass
+def intern(value: str | None) -> str | None:
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+# One record per live stream, kept and updated in place by every poll. The
+# logins, names and games repeated across thousands of streams are interned,
+# and the thumbnail is only formatted again after it changed.
+@dataclass(slots=True)
 class StreamInformation:
     id: str
     user_id: str
@@ -35,91 +58,277 @@ class StreamInformation:
     started_at: str
     _thumbnail_url: str
     discord_message_id: str = ""
+    _formatted_thumbnail_url: str | None = field(
+        default=None, init=False, repr=False, compare=False
+    )
+
+    def __post_init__(self):
+        self.user_name = intern(self.user_name)
+        self.user_login = intern(self.user_login)
+        self.game_name = intern(self.game_name)
 
     @property
-    def thumbnail_url(self):
-        return self._thumbnail_url.replace("{width}", "1280").replace(
-            "{height}", "720"
-        )
+    def thumbnail_url(self) -> str:
+        if self._formatted_thumbnail_url is None:
+            self._formatted_thumbnail_url = self._thumbnail_url.replace(
+                "{width}", "1280"
+            ).replace("{height}", "720")
+        return self._formatted_thumbnail_url
+
+    def update(self, stream: "StreamInformation") -> None:
+        # Takes over what can change while a stream is live.
+        self.user_name = stream.user_name
+        self.title = stream.title
+        self.game_name = stream.game_name
+        self.viewer_count = stream.viewer_count
+        if stream._thumbnail_url != self._thumbnail_url:
+            self._thumbnail_url = stream._thumbnail_url
+            self._formatted_thumbnail_url = None
+
+    def as_dict(self) -> dict:
+        return {
+            stream_field.name: getattr(self, stream_field.name)
+            for stream_field in fields(self)
+            if stream_field.init
+        }
 
 
 class TwitchClient:
-    _access_token: str = ""
-
-    def __init__(self, streamer: str):
-        self.streamer = streamer
+    def __init__(
+        self,
+        streamers: list[str],
+        transport: Transport | None = None,
+    ):
+        self.streamers = [streamer.lower() for streamer in streamers]
+        self._transport = transport or Transport()
         self._client_id = os.environ["TWITCH_CLIENT_ID"]
-        self._client_secret = os.environ["TWITCH_CLIENT_SECRET"]
-        self._cache_prevent = CachePrevent()
-
-    def update_access_token(self) -> None:
-        logger.info("Updating twitch access token...")
-        response = requests.post(
-            url="https://id.twitch.tv/oauth2/token",
-            headers={"Content-Type": "application/x-www-form-url-encoded"},
-            params={
-                "client_id": self._client_id,
-                "client_secret": self._client_secret,
-                "grant_type": "client_credentials",
-            },
+        self.token_manager = TokenManager(
+            client_id=self._client_id,
+            client_secret=os.environ["TWITCH_CLIENT_SECRET"],
+            transport=self._transport,
+        )
+        self._cache_prevent = CachePrevent(
+            refresh_seconds=float(
+                os.environ.get("THUMBNAIL_REFRESH_SECONDS", 300)
+            )
         )
-        response.raise_for_status()
 
-        self._access_token = response.json()["access_token"]
-        logger.info("Updating twitch access token done.")
+    @property
+    def _access_token(self) -> str:
+        return self.token_manager.get_token()
+
+    def update_access_token(self, rejected_token: str | None = None) -> None:
+        self.token_manager.invalidate(rejected_token=rejected_token)
+
+    def _helix_request(
+        self, method: str, endpoint: str, **kwargs
+    ) -> requests.Response:
+        return self._transport.request(
+            method=method,
+            url=f"https://api.twitch.tv/helix/{endpoint}",
+            headers={
+                "Client-Id": self._client_id,
+                "Authorization": f"Bearer {self._access_token}",
+            },
+            **kwargs,
+        )
 
-    def _update_access_token_wrapper(self) -> bool:
+    def _update_access_token_wrapper(self, response: requests.Response) -> bool:
+        # Called before a request is retried with a new token, with the
+        # response that rejected the token it was sent with.
+        RETRIES.inc(operation="twitch_auth")
+        authorization = response.request.headers.get("Authorization", "")
         try:
-            self.update_access_token()
+            self.update_access_token(
+                rejected_token=authorization.removeprefix("Bearer ")
+            )
         except HTTPError as e:
             logger.error("API call to update twitch access token failed.")
             logger.exception(e)
             return False
+        except CONNECTION_ERRORS as err:
+            log_request_error(
+                err, message="Could not reach Twitch to update the token."
+            )
+            return False
         except KeyError:
             logger.error("Access token was not in auth response.")
             return False
         return True
 
-    def get_streamer_profile_picture(
-        self, is_retry: bool = False
-    ) -> str | None:
-        response = requests.get(
-            url="https://api.twitch.tv/helix/users",
-            headers={
-                "Client-Id": self._client_id,
-                "Authorization": f"Bearer {self._access_token}",
+    def get_users(
+        self,
+        logins: list[str] | None = None,
+        user_ids: list[str] | None = None,
+        is_retry: bool = False,
+    ) -> dict[str, dict]:
+        # Looks up every tracked streamer unless told otherwise. Logins and
+        # ids share the limit of 100 per request.
+        if logins is None and user_ids is None:
+            logins = self.streamers
+        params = [("login", login) for login in logins or []] + [
+            ("id", user_id) for user_id in user_ids or []
+        ]
+
+        users = {}
+        for batch in batched(params, HELIX_BATCH_SIZE):
+            response = self._helix_request(
+                method="GET",
+                endpoint="users",
+                params=batch,
+            )
+
+            if response.status_code == 401:
+                logger.info("Getting streamers returned an auth issue.")
+
+                if is_retry:
+                    logger.error("Auth failed twice, aborting.")
+                    return users
+
+                if not self._update_access_token_wrapper(response):
+                    return users
+
+                return self.get_users(
+                    logins=logins, user_ids=user_ids, is_retry=True
+                )
+
+            response.raise_for_status()
+
+            for user in response.json()["data"]:
+                users[user["login"]] = user
+
+        return users
+
+    def create_eventsub_subscription(
+        self,
+        subscription_type: str,
+        broadcaster_user_id: str,
+        callback_url: str,
+        secret: str,
+        is_retry: bool = False,
+    ) -> None:
+        response = self._helix_request(
+            method="POST",
+            endpoint="eventsub/subscriptions",
+            json={
+                "type": subscription_type,
+                "version": "1",
+                "condition": {"broadcaster_user_id": broadcaster_user_id},
+                "transport": {
+                    "method": "webhook",
+                    "callback": callback_url,
+                    "secret": secret,
+                },
             },
-            params={"login": self.streamer},
         )
 
         if response.status_code == 401:
-            logger.info("Getting streamer returned an auth issue.")
+            logger.info("Subscribing to EventSub returned an auth issue.")
 
             if is_retry:
                 logger.error("Auth failed twice, aborting.")
-                return None
+                return
 
-            if not self._update_access_token_wrapper():
-                return None
+            if not self._update_access_token_wrapper(response):
+                return
 
-            return self.get_streamer_profile_picture(is_retry=True)
+            return self.create_eventsub_subscription(
+                subscription_type=subscription_type,
+                broadcaster_user_id=broadcaster_user_id,
+                callback_url=callback_url,
+                secret=secret,
+                is_retry=True,
+            )
+
+        if response.status_code == 409:
+            logger.info(
+                f"Already subscribed to {subscription_type} "
+                f"of {broadcaster_user_id}."
+            )
+            return
 
         response.raise_for_status()
 
-        return response.json()["data"][0]["profile_image_url"]
+    def delete_eventsub_subscriptions(
+        self,
+        broadcaster_user_id: str,
+        callback_url: str,
+        is_retry: bool = False,
+    ) -> None:
+        # Deletes only subscriptions sent to our callback, other apps sharing
+        # the client id keep theirs.
+        params = {"user_id": broadcaster_user_id}
+        subscription_ids = []
+        while True:
+            response = self._helix_request(
+                method="GET", endpoint="eventsub/subscriptions", params=params
+            )
+
+            if response.status_code == 401:
+                logger.info("Listing EventSub returned an auth issue.")
+
+                if is_retry:
+                    logger.error("Auth failed twice, aborting.")
+                    return
 
-    def get_stream(self, is_retry: bool = False) -> StreamInformation | None:
+                if not self._update_access_token_wrapper(response):
+                    return
+
+                return self.delete_eventsub_subscriptions(
+                    broadcaster_user_id=broadcaster_user_id,
+                    callback_url=callback_url,
+                    is_retry=True,
+                )
+
+            response.raise_for_status()
+
+            subscription_ids.extend(
+                subscription["id"]
+                for subscription in response.json()["data"]
+                if subscription["transport"].get("callback") == callback_url
+            )
+            cursor = response.json().get("pagination", {}).get("cursor")
+            if not cursor:
+                break
+            params["after"] = cursor
+
+        for subscription_id in subscription_ids:
+            response = self._helix_request(
+                method="DELETE",
+                endpoint="eventsub/subscriptions",
+                params={"id": subscription_id},
+            )
+            # Twitch may have dropped it in the meantime.
+            if response.status_code != 404:
+                response.raise_for_status()
+
+    def get_stream(
+        self, streamers: list[str] | None = None
+    ) -> dict[str, StreamInformation | None]:
+        # Logins of offline streamers map to None. Logins of a batch that failed
+        # to connect are left out entirely, as their state is unknown.
+        self._cache_prevent.refresh()
+        streams = {}
+        for batch in batched(streamers or self.streamers, HELIX_BATCH_SIZE):
+            batch_streams = self._get_stream_batch(logins=batch)
+            if batch_streams is not None:
+                streams.update(batch_streams)
+        return streams
+
+    def _get_stream_batch(
+        self, logins: list[str], is_retry: bool = False
+    ) -> dict[str, StreamInformation | None] | None:
         try:
-            response = requests.get(
-                url="https://api.twitch.tv/helix/streams",
-                headers={
-                    "Client-Id": self._client_id,
-                    "Authorization": f"Bearer {self._access_token}",
-                },
-                params={"user_login": self.streamer},
+            response = self._helix_request(
+                method="GET",
+                endpoint="streams",
+                params=[("user_login", login) for login in logins]
+                + [("first", HELIX_BATCH_SIZE)],
+            )
+        except CONNECTION_ERRORS as err:
+            log_request_error(
+                err, "Getting streams failed with a connection error."
             )
-        except requests.exceptions.ConnectionError:
-            logger.warning("Getting streams failed with a connection Error.")
             return None
 
         if response.status_code == 401:
@@ -129,48 +338,41 @@ class TwitchClient:
                 logger.error("Auth failed twice, aborting.")
                 return None
 
-            if not self._update_access_token_wrapper():
+            if not self._update_access_token_wrapper(response):
                 return None
 
-            return self.get_stream(is_retry=True)
+            return self._get_stream_batch(logins=logins, is_retry=True)
 
         response.raise_for_status()
 
-        streams = response.json()["data"]
-        if len(streams) == 0:
-            return None
+        streams: dict[str, StreamInformation | None] = dict.fromkeys(logins)
+        for stream_data in response.json()["data"]:
+            streams[stream_data.get("user_login")] = StreamInformation(
+                id=stream_data.get("id"),
+                user_id=stream_data.get("user_id"),
+                user_name=stream_data.get("user_name"),
+                user_login=stream_data.get("user_login"),
+                title=stream_data.get("title"),
+                game_name=stream_data.get("game_name"),
+                viewer_count=stream_data.get("viewer_count"),
+                started_at=stream_data.get("started_at"),
+                _thumbnail_url=self._cache_prevent.prevent_cache_on_url(
+                    url=stream_data.get("thumbnail_url"),
+                ),
+            )
+        return streams
 
-        stream_data = streams[0]
-        return StreamInformation(
-            id=stream_data.get("id"),
-            user_id=stream_data.get("user_id"),
-            user_name=stream_data.get("user_name"),
-            user_login=stream_data.get("user_login"),
-            title=stream_data.get("title"),
-            game_name=stream_data.get("game_name"),
-            viewer_count=stream_data.get("viewer_count"),
-            started_at=stream_data.get("started_at"),
-            _thumbnail_url=self._cache_prevent.prevent_cache_on_url(
-                url=stream_data.get("thumbnail_url"),
-            ),
+    def get_vod(
+        self, user_id: str, stream_id: str, is_retry: bool = False
+    ) -> str | None:
+        # Only the newest archive can belong to the stream that just ended.
+        # Connection errors are left to the VOD resolver, which retries.
+        response = self._helix_request(
+            method="GET",
+            endpoint="videos",
+            params={"user_id": user_id, "type": "archive", "first": 1},
         )
 
-    def get_vod(self, user_id: str, is_retry: bool = False) -> str | None:
-        try:
-            response = requests.get(
-                url="https://api.twitch.tv/helix/videos",
-                headers={
-                    "Client-Id": self._client_id,
-                    "Authorization": f"Bearer {self._access_token}",
-                },
-                params={"user_id": user_id},
-            )
-        except NewConnectionError as err:
-            logger.opt(exception=err).warning(
-                "Getting vods failed with a new connection Error, more details below."
-            )
-            return None
-
         if response.status_code == 401:
             logger.info("Getting vod returned an auth issue.")
 
@@ -178,16 +380,133 @@ class TwitchClient:
                 logger.error("Auth failed twice, aborting.")
                 return None
 
-            if not self._update_access_token_wrapper():
+            if not self._update_access_token_wrapper(response):
                 return None
 
-            return self.get_vod(user_id=user_id, is_retry=True)
+            return self.get_vod(
+                user_id=user_id, stream_id=stream_id, is_retry=True
+            )
 
         response.raise_for_status()
 
         vods = response.json()["data"]
-        if len(vods) == 0:
+        if len(vods) == 0 or vods[0].get("stream_id") != stream_id:
             return None
 
         vod_data = vods[0]
         return vod_data.get("url")
+
+
+# Waits for the Helix budget in the event loop before taking a slot of the
+# semaphore, so background calls waiting for points above the reserve do not
+# hold slots that stream polls and Discord requests need.
+class AsyncTwitchClient:
+    def __init__(
+        self,
+        client: TwitchClient,
+        semaphore: asyncio.Semaphore,
+        budget: HelixBudget | None = None,
+    ):
+        self.client = client
+        self._semaphore = semaphore
+        self._budget = budget or HelixBudget()
+
+    async def _run(
+        self, function, *args, priority: int | None = None, **kwargs
+    ):
+        with span(f"twitch.{function.__name__}", **traced_arguments(kwargs)):
+            if priority is not None:
+                await self._budget.acquire(priority=priority)
+            async with self._semaphore:
+                return await asyncio.to_thread(function, *args, **kwargs)
+
+    async def update_access_token(self) -> None:
+        await self._run(self.client.update_access_token)
+
+    async def get_users(
+        self, logins: list[str] | None = None, user_ids: list[str] | None = None
+    ) -> dict[str, dict]:
+        # One call per batch, so each of them waits for its own point.
+        if logins is None and user_ids is None:
+            logins = self.client.streamers
+        params = [("login", login) for login in logins or []] + [
+            ("id", user_id) for user_id in user_ids or []
+        ]
+        batch_results = await asyncio.gather(
+            *(
+                self._run(
+                    self.client.get_users,
+                    priority=BACKGROUND,
+                    logins=[value for key, value in batch if key == "login"],
+                    user_ids=[value for key, value in batch if key == "id"],
+                )
+                for batch in batched(params, HELIX_BATCH_SIZE)
+            )
+        )
+        users = {}
+        for batch_users in batch_results:
+            users.update(batch_users)
+        return users
+
+    async def create_eventsub_subscription(
+        self,
+        subscription_type: str,
+        broadcaster_user_id: str,
+        callback_url: str,
+        secret: str,
+    ) -> None:
+        await self._run(
+            self.client.create_eventsub_subscription,
+            priority=BACKGROUND,
+            subscription_type=subscription_type,
+            broadcaster_user_id=broadcaster_user_id,
+            callback_url=callback_url,
+            secret=secret,
+        )
+
+    async def delete_eventsub_subscriptions(
+        self, broadcaster_user_id: str, callback_url: str
+    ) -> None:
+        await self._run(
+            self.client.delete_eventsub_subscriptions,
+            priority=BACKGROUND,
+            broadcaster_user_id=broadcaster_user_id,
+            callback_url=callback_url,
+        )
+
+    async def get_stream(
+        self, streamers: list[str] | None = None
+    ) -> dict[str, StreamInformation | None]:
+        # A batch that failed is left out, the others are kept.
+        self.client._cache_prevent.refresh()
+        batches = batched(streamers or self.client.streamers, HELIX_BATCH_SIZE)
+        batch_results = await asyncio.gather(
+            *(
+                self._run(
+                    self.client._get_stream_batch,
+                    priority=STREAM_POLL,
+                    logins=batch,
+                )
+                for batch in batches
+            ),
+            return_exceptions=True,
+        )
+        streams = {}
+        for batch, batch_streams in zip(batches, batch_results):
+            if isinstance(batch_streams, requests.RequestException):
+                logger.opt(exception=batch_streams).error(
+                    f"Getting streams of {len(batch)} streamers failed."
+                )
+            elif isinstance(batch_streams, BaseException):
+                raise batch_streams
+            elif batch_streams is not None:
+                streams.update(batch_streams)
+        return streams
+
+    async def get_vod(self, user_id: str, stream_id: str) -> str | None:
+        return await self._run(
+            self.client.get_vod,
+            priority=BACKGROUND,
+            user_id=user_id,
+            stream_id=stream_id,
+        )
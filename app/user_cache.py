@@ -0,0 +1,69 @@
+import os
+import time
+from collections import OrderedDict
+
+from app.state_store import StateStore
+
+
+# Keeps Twitch users by login, least recently used first, persisted in the
+# state store. Users older than the TTL are reported as stale so they can be
+# refetched in batches, and the least recently used are evicted beyond the
+# maximum size.
+class UserCache:
+    def __init__(
+        self,
+        state_store: StateStore,
+        ttl_seconds: float | None = None,
+        max_size: int | None = None,
+    ):
+        self._state_store = state_store
+        self.ttl_seconds = ttl_seconds or float(
+            os.environ.get("USER_CACHE_TTL_SECONDS", 6 * 3600)
+        )
+        self.max_size = max_size or int(
+            os.environ.get("USER_CACHE_SIZE", 10000)
+        )
+        # Maps logins to their user and when it was fetched.
+        self._users: OrderedDict[str, tuple[dict, float]] = OrderedDict(
+            (user["login"], (user, fetched_at))
+            for user, fetched_at in state_store.load_users()
+        )
+        self._evict()
+
+    def __contains__(self, login: str) -> bool:
+        return login in self._users
+
+    def get(self, login: str) -> dict | None:
+        if login not in self._users:
+            return None
+        self._users.move_to_end(login)
+        return self._users[login][0]
+
+    def profile_image(self, login: str) -> str | None:
+        user = self.get(login)
+        return user["profile_image_url"] if user else None
+
+    def stale(self, logins: list[str], now: float | None = None) -> list[str]:
+        now = time.time() if now is None else now
+        return [
+            login
+            for login in logins
+            if login not in self._users
+            or now - self._users[login][1] >= self.ttl_seconds
+        ]
+
+    def update(self, users: list[dict], now: float | None = None) -> None:
+        now = time.time() if now is None else now
+        for user in users:
+            self._users[user["login"]] = (user, now)
+            self._users.move_to_end(user["login"])
+        self._state_store.save_users([(user, now) for user in users])
+        self._evict()
+
+    def _evict(self) -> None:
+        evicted = []
+        while len(self._users) > self.max_size:
+            login, _ = self._users.popitem(last=False)
+            evicted.append(login)
+        if evicted:
+            self._state_store.delete_users(evicted)
@@ -0,0 +1,198 @@
+import mmap
+import os
+import struct
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+
+# A marker and the number of samples every slot of the file holds.
+FILE_HEADER = struct.Struct("<4sI")
+FILE_MARKER = b"VWRS"
+# The stream a slot belongs to, empty for free slots, the number of samples,
+# their sum, the peak, when the stream started and when the last sample was
+# taken.
+SLOT_HEADER = struct.Struct("<64sQQIdd")
+SAMPLE = struct.Struct("<I")
+# A day of samples at one poll every 30 seconds.
+DEFAULT_CAPACITY = 2880
+# Slots the file starts with, it doubles whenever they run out.
+MIN_SLOTS = 16
+
+
+def parse_started_at(started_at: str, default: float) -> float:
+    try:
+        return datetime.fromisoformat(started_at).timestamp()
+    except (TypeError, ValueError):
+        return default
+
+
+@dataclass
+class ViewerSummary:
+    peak: int
+    average: int
+    duration_seconds: float
+
+
+# Records the viewer count of every poll of a live stream into a ring buffer
+# in a slot of fixed size, all slots in one memory-mapped file. Peak, sum and
+# count are kept in the slot's header, so they cover the whole stream even
+# once the ring wrapped around, and survive a crash. Slots of ended streams
+# are reused, so a single file descriptor is open however many streams are
+# live.
+class ViewerHistory:
+    def __init__(
+        self, directory: str | None = None, capacity: int | None = None
+    ):
+        self.directory = Path(
+            directory or os.environ.get("VIEWER_HISTORY_DIR", "viewer_history")
+        )
+        self.capacity = capacity or int(
+            os.environ.get("VIEWER_HISTORY_SAMPLES", DEFAULT_CAPACITY)
+        )
+        self._buffer: mmap.mmap | None = None
+        self._slots: dict[str, int] = dict()
+        self._free_slots: list[int] = []
+
+    @property
+    def path(self) -> Path:
+        return self.directory / "viewers.bin"
+
+    @property
+    def _slot_size(self) -> int:
+        return SLOT_HEADER.size + self.capacity * SAMPLE.size
+
+    def _offset(self, slot: int) -> int:
+        return FILE_HEADER.size + slot * self._slot_size
+
+    def _slot_count(self) -> int:
+        return (len(self._buffer) - FILE_HEADER.size) // self._slot_size
+
+    def _open(self, create: bool = False) -> mmap.mmap | None:
+        # Maps the file once, creating it only when asked to. A file keeps
+        # the capacity it was created with.
+        if self._buffer is not None:
+            return self._buffer
+
+        if not self.path.exists():
+            if not create:
+                return None
+            self.directory.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "wb") as file:
+                file.write(FILE_HEADER.pack(FILE_MARKER, self.capacity))
+
+        with open(self.path, "r+b") as file:
+            self._buffer = mmap.mmap(file.fileno(), 0)
+        _, self.capacity = FILE_HEADER.unpack_from(self._buffer)
+        for slot in reversed(range(self._slot_count())):
+            stream_id = SLOT_HEADER.unpack_from(
+                self._buffer, self._offset(slot)
+            )[0].rstrip(b"\0")
+            if stream_id:
+                self._slots[stream_id.decode()] = slot
+            else:
+                self._free_slots.append(slot)
+        return self._buffer
+
+    def _allocate(self, stream_id: str, started_at: float) -> int:
+        if not self._free_slots:
+            slot_count = self._slot_count()
+            added_slots = max(slot_count, MIN_SLOTS)
+            self._buffer.resize(self._offset(slot_count + added_slots))
+            self._free_slots.extend(
+                reversed(range(slot_count, slot_count + added_slots))
+            )
+
+        slot = self._free_slots.pop()
+        self._slots[stream_id] = slot
+        SLOT_HEADER.pack_into(
+            self._buffer,
+            self._offset(slot),
+            stream_id.encode(),
+            0,
+            0,
+            0,
+            started_at,
+            started_at,
+        )
+        return slot
+
+    def record(
+        self, stream_id: str, viewer_count: int, started_at: str, now: float
+    ) -> None:
+        buffer = self._open(create=True)
+        slot = self._slots.get(stream_id)
+        if slot is None:
+            slot = self._allocate(
+                stream_id, started_at=parse_started_at(started_at, default=now)
+            )
+        offset = self._offset(slot)
+        _, count, total, peak, started_at, _ = SLOT_HEADER.unpack_from(
+            buffer, offset
+        )
+        SAMPLE.pack_into(
+            buffer,
+            offset + SLOT_HEADER.size + count % self.capacity * SAMPLE.size,
+            viewer_count,
+        )
+        SLOT_HEADER.pack_into(
+            buffer,
+            offset,
+            stream_id.encode(),
+            count + 1,
+            total + viewer_count,
+            max(peak, viewer_count),
+            started_at,
+            now,
+        )
+
+    def _header(self, stream_id: str) -> tuple | None:
+        if self._open() is None or stream_id not in self._slots:
+            return None
+        return SLOT_HEADER.unpack_from(
+            self._buffer, self._offset(self._slots[stream_id])
+        )
+
+    def samples(self, stream_id: str) -> list[int]:
+        # The samples still in the ring, oldest first.
+        header = self._header(stream_id)
+        if not header:
+            return []
+        count = header[1]
+        samples = list(
+            struct.unpack_from(
+                f"<{min(count, self.capacity)}I",
+                self._buffer,
+                self._offset(self._slots[stream_id]) + SLOT_HEADER.size,
+            )
+        )
+        start = count % self.capacity if count > self.capacity else 0
+        return samples[start:] + samples[:start]
+
+    def summary(self, stream_id: str) -> ViewerSummary | None:
+        header = self._header(stream_id)
+        if not header:
+            return None
+        _, count, total, peak, started_at, last_at = header
+        if not count:
+            return None
+        return ViewerSummary(
+            peak=peak,
+            average=round(total / count),
+            duration_seconds=last_at - started_at,
+        )
+
+    def remove(self, stream_id: str) -> None:
+        if self._open() is None or stream_id not in self._slots:
+            return
+        slot = self._slots.pop(stream_id)
+        SLOT_HEADER.pack_into(
+            self._buffer, self._offset(slot), b"", 0, 0, 0, 0, 0
+        )
+        self._free_slots.append(slot)
+
+    def close(self) -> None:
+        if self._buffer is not None:
+            self._buffer.close()
+        self._buffer = None
+        self._slots.clear()
+        self._free_slots.clear()
@@ -0,0 +1,135 @@
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Callable
+
+from loguru import logger
+
+from app.circuit_breaker import CircuitOpenError
+from app.state_store import StateStore
+from app.twitch_client import AsyncTwitchClient
+
+# How long to wait before each lookup of a VOD. Once all are used up, the
+# stream is given up on.
+VOD_RETRY_SECONDS = (0, 60, 120, 300, 600, 1200, 1800)
+IDLE_WAIT_SECONDS = 60
+MIN_WAIT_SECONDS = 0.1
+
+
+@dataclass
+class VodLookup:
+    stream_id: str
+    user_id: str
+    attempts: int
+    due_at: float
+
+
+# Looks up the VODs of ended streams in the background, as Twitch often
+# publishes them a while after the stream ended. Lookups are kept in the
+# state store, so they continue after a restart.
+class VodResolver:
+    def __init__(
+        self,
+        twitch_client: AsyncTwitchClient,
+        state_store: StateStore,
+        on_resolved: Callable[[str, str | None], None],
+        retry_seconds: tuple[float, ...] = VOD_RETRY_SECONDS,
+    ):
+        self._twitch_client = twitch_client
+        self._state_store = state_store
+        self._on_resolved = on_resolved
+        self._retry_seconds = retry_seconds
+        self._lookups: dict[str, VodLookup] = {
+            row[0]: VodLookup(*row) for row in state_store.load_vod_lookups()
+        }
+        self._wake = asyncio.Event()
+
+    def add(self, stream_id: str, user_id: str) -> None:
+        lookup = VodLookup(
+            stream_id=stream_id,
+            user_id=user_id,
+            attempts=0,
+            due_at=time.time() + self._retry_seconds[0],
+        )
+        self._lookups[stream_id] = lookup
+        self._save(lookup)
+        self._wake.set()
+
+    def remove(self, stream_id: str) -> None:
+        if self._lookups.pop(stream_id, None):
+            self._state_store.delete_vod_lookup(stream_id)
+
+    def pending(self) -> int:
+        return len(self._lookups)
+
+    def _save(self, lookup: VodLookup) -> None:
+        self._state_store.save_vod_lookup(
+            stream_id=lookup.stream_id,
+            user_id=lookup.user_id,
+            attempts=lookup.attempts,
+            due_at=lookup.due_at,
+        )
+
+    async def run(self) -> None:
+        while True:
+            self._wake.clear()
+            now = time.time()
+            due_lookups = [
+                lookup
+                for lookup in self._lookups.values()
+                if lookup.due_at <= now
+            ]
+            if due_lookups:
+                await self.resolve(due_lookups)
+                continue
+
+            next_due_at = min(
+                (lookup.due_at for lookup in self._lookups.values()),
+                default=now + IDLE_WAIT_SECONDS,
+            )
+            try:
+                await asyncio.wait_for(
+                    self._wake.wait(),
+                    timeout=max(next_due_at - now, MIN_WAIT_SECONDS),
+                )
+            except asyncio.TimeoutError:
+                pass
+
+    async def resolve(self, lookups: list[VodLookup]) -> None:
+        # Streams that ended together are looked up concurrently.
+        results = await asyncio.gather(
+            *(
+                self._twitch_client.get_vod(
+                    user_id=lookup.user_id, stream_id=lookup.stream_id
+                )
+                for lookup in lookups
+            ),
+            return_exceptions=True,
+        )
+        for lookup, vod_url in zip(lookups, results):
+            if isinstance(vod_url, CircuitOpenError):
+                # Twitch was not asked, so the attempt does not count.
+                lookup.due_at = time.time() + vod_url.retry_after
+                self._save(lookup)
+                continue
+
+            if isinstance(vod_url, Exception):
+                logger.opt(exception=vod_url).warning(
+                    f"Looking up the VOD of stream {lookup.stream_id} failed."
+                )
+                vod_url = None
+
+            lookup.attempts += 1
+            if vod_url or lookup.attempts >= len(self._retry_seconds):
+                if not vod_url:
+                    logger.info(
+                        f"No VOD of stream {lookup.stream_id} was published, "
+                        "giving up."
+                    )
+                del self._lookups[lookup.stream_id]
+                self._state_store.delete_vod_lookup(lookup.stream_id)
+                self._on_resolved(lookup.stream_id, vod_url)
+                continue
+
+            lookup.due_at = time.time() + self._retry_seconds[lookup.attempts]
+            self._save(lookup)